@@ -0,0 +1,27 @@
+// Shared fixture behaviour: delayed XHR-backed content, animated modals and dropdowns.
+function api(path, delayMs) {
+  return fetch(`/api/${path}?delay=${delayMs}`).then((r) => r.json());
+}
+
+function openModal(id) {
+  const el = document.getElementById(id);
+  el.hidden = false;
+  el.classList.remove('fade-in');
+  void el.offsetWidth;
+  el.classList.add('fade-in');
+}
+
+function closeModal(id) {
+  document.getElementById(id).hidden = true;
+}
+
+function toggleDropdown(id) {
+  const el = document.getElementById(id);
+  el.hidden = !el.hidden;
+}
+
+document.addEventListener('keydown', (e) => {
+  if (e.key === 'Escape') {
+    document.querySelectorAll('[role="dialog"], .dropdown').forEach((el) => { el.hidden = true; });
+  }
+});
@@ -0,0 +1,408 @@
+"""Offline benchmark: drives run_once against the bundled fixture app with a static planner.
+
+Run from the project directory:
+    python -m bench.run_bench                      # compare against bench/baselines.json
+    python -m bench.run_bench --update-baselines   # record the current numbers as the baseline (commit the file)
+    python -m bench.run_bench --no-compare         # just print the numbers
+    python -m bench.run_bench --closed-loop        # step-wise planning with the stub LLM instead of the static plans
+    python -m bench.run_bench --replay             # also replay the recordings, one with a step that now fails
+    python -m bench.run_bench --router             # also check request blocking, the HTTP cache and failed fetches
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+from loguru import logger
+from playwright._impl._transport import Transport
+
+BENCH_DIR = Path(__file__).resolve().parent
+FIXTURE_DIR = BENCH_DIR / "fixture"
+TASKS_FILE = BENCH_DIR / "tasks.json"
+BASELINES_FILE = BENCH_DIR / "baselines.json"
+
+# metric -> allowed relative increase over baseline before the run counts as a regression
+THRESHOLDS = {
+    "ms_per_step": 0.25,
+    "round_trips_per_step": 0.10,
+    "bytes_serialized_per_step": 0.15,
+    "bytes_on_disk": 0.15,
+}
+# Tunables that change the numbers; recorded with baselines so mismatched comparisons are visible
+ENV_KEYS = ["SETTLE_MODE", "SETTLE_QUIET_MS", "SCREENSHOT_FORMAT", "SCREENSHOT_QUALITY", "SCREENSHOT_THUMBNAILS",
+            "RESOLVE_MODE", "SLOW_MO_MS", "SIGNIFICANCE_THRESHOLD", "SCREENSHOT_STORE"]
+
+FIXTURE_DATA = {
+    "boards": ["My Trello board", "Roadmap", "Bench sandbox"],
+    "lists": [
+        {"name": "Today", "cards": ["First Card Name", "Review PRs", "Standup notes"]},
+        {"name": "This Week", "cards": ["Ship fixture app", "Write benchmarks"]},
+        {"name": "Later", "cards": ["Quarterly planning"]},
+    ],
+    "members": ["Ada (admin)", "Grace", "Linus", "Margaret"],
+}
+
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    """Static fixture files plus /api/<name>?delay=ms JSON endpoints standing in for the apps' XHR.
+
+    A static file requested with ?max_age=N is served with Cache-Control: max-age=N; anything under /bench-drop/
+    gets its connection closed without a response.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=str(FIXTURE_DIR), **kwargs)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith("/bench-drop/"):
+            self.close_connection = True
+            return
+        if not url.path.startswith("/api/"):
+            return super().do_GET()
+        delay_ms = int(parse_qs(url.query).get("delay", ["0"])[0])
+        time.sleep(delay_ms / 1000)
+        name = url.path[len("/api/"):]
+        if name.startswith("page/"):
+            data = {"columns": ["Name", "Status", "Owner"], "rows": [[f"{name[5:]} item {i}", "Open", "Ada"] for i in range(8)]}
+        else:
+            data = FIXTURE_DATA.get(name, {})
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def end_headers(self):
+        max_age = parse_qs(urlparse(self.path).query).get("max_age")
+        if max_age:
+            self.send_header("Cache-Control", f"max-age={max_age[0]}")
+        super().end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_fixture():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+class ProtocolCounter:
+    """Counts messages and bytes on the Playwright driver pipe (each request is one browser round trip)."""
+
+    def __init__(self):
+        self.round_trips = self.bytes_sent = self.bytes_received = 0
+        self._serialize = Transport.serialize_message
+        self._deserialize = Transport.deserialize_message
+
+    def install(self):
+        counter = self
+
+        def serialize(transport, message):
+            data = counter._serialize(transport, message)
+            counter.round_trips += 1
+            counter.bytes_sent += len(data)
+            return data
+
+        def deserialize(transport, data):
+            counter.bytes_received += len(data)
+            return counter._deserialize(transport, data)
+
+        Transport.serialize_message = serialize
+        Transport.deserialize_message = deserialize
+
+    def uninstall(self):
+        Transport.serialize_message = self._serialize
+        Transport.deserialize_message = self._deserialize
+
+    def take(self) -> Dict[str, int]:
+        out = {"round_trips": self.round_trips, "bytes_serialized": self.bytes_sent + self.bytes_received}
+        self.round_trips = self.bytes_sent = self.bytes_received = 0
+        return out
+
+
+def _dir_bytes(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+async def run_suite(tasks: List[Dict[str, Any]], base: str, work: Path, closed_loop: bool = False) -> Dict[str, Any]:
+    from main import run_once
+    from src.agent.task_planner import TaskPlanner
+    from src.capture.metadata_handler import task_slug
+    from src.config.app_configs import AppConfig
+
+    class StaticPlanner(TaskPlanner):
+        """Serves the fixture plans from tasks.json; no LLM, no plan cache."""
+
+        def plan(self, app: str, task: str, start_url: str) -> Dict[str, Any]:
+            spec = next(t for t in tasks if t["app"] == app and t["task"] == task)
+            steps = json.loads(json.dumps(spec["steps"]).replace("{base}", base))
+            return {"steps": steps, "source": "static"}
+
+        async def aplan(self, app: str, task: str, start_url: str) -> Dict[str, Any]:
+            return self.plan(app, task, start_url)
+
+    # Closed loop: the stub LLM picks each step from the observed page, starting where the static plan would
+    planner = TaskPlanner() if closed_loop else StaticPlanner()
+    counter = ProtocolCounter()
+    counter.install()
+    per_task: Dict[str, Dict[str, Any]] = {}
+    try:
+        for spec in tasks:
+            start = spec["steps"][0]["selector"]["css"].replace("{base}", base) if closed_loop else base
+            cfg = AppConfig(name=spec["app"], base_url=base, workspace_url=start)
+            out_root = work / "dataset"
+            counter.take()
+            result = await run_once(spec["app"], spec["task"], str(out_root), headless=True, profile=str(work / "profile"),
+                                    max_steps=50, manual_login=False, cfg=cfg, planner=planner)
+            proto = counter.take()
+            td = out_root / spec["app"] / task_slug(spec["task"])
+            meta = json.loads((td / "metadata.json").read_text(encoding="utf-8"))
+            steps = max(result["steps"], 1)
+            per_task[f"{spec['app']}: {spec['task']}"] = {
+                "steps": result["steps"],
+                "errors": result["errors"],
+                "ms_per_step": round(result["duration_s"] * 1000 / steps, 1),
+                "round_trips_per_step": round(proto["round_trips"] / steps, 1),
+                "bytes_serialized_per_step": round(proto["bytes_serialized"] / steps),
+                "screenshots": result["screenshots"],
+                "bytes_on_disk": _dir_bytes(td),
+                "phases": (meta.get("trace") or {}).get("phases", {}),
+            }
+            loop = [st["closed_loop"] for st in meta.get("steps", []) if st.get("closed_loop")]
+            if loop:
+                per_task[f"{spec['app']}: {spec['task']}"]["closed_loop"] = {
+                    "prompt_tokens_per_step": round(statistics.mean(l["prompt_tokens"] for l in loop)),
+                    "plan_ms_per_step": round(statistics.mean(l["plan_ms"] for l in loop), 1),
+                    "full_observations": sum(1 for l in loop if l["full_observation"]),
+                }
+    finally:
+        counter.uninstall()
+    return per_task
+
+
+async def check_replay(run_dir: Path, base: str) -> List[str]:
+    """Replay the suite's recordings with one step broken on purpose; every workflow must still get its metadata
+    and the broken step must come back as an error, not abort the run."""
+    from src.agent.replay import replay
+    from src.config.app_configs import APPS, AppConfig
+
+    src = run_dir / "dataset"
+    # Replays run through the batch runner, which only knows registered apps
+    for app_dir in src.iterdir():
+        if app_dir.is_dir() and not app_dir.name.startswith("."):
+            APPS.setdefault(app_dir.name, AppConfig(name=app_dir.name, base_url=base, workspace_url=base))
+    broken = sorted(src.glob("*/*/metadata.json"))[0]
+    meta = json.loads(broken.read_text(encoding="utf-8"))
+    meta["steps"].append({"index": len(meta["steps"]) + 1, "description": "Click a control that does not exist",
+                          "action": "click", "selector": {"css": "#bench-missing-control"}})
+    broken.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    report = await replay(str(src), str(run_dir / "replay"), profile=str(run_dir / "profile"), concurrency=2)
+    problems = [f"{w['app']}: {w['task']} produced no metadata" for w in report["workflows"] if w.get("failed")]
+    replayed = run_dir / "replay" / broken.parent.parent.name / broken.parent.name / "metadata.json"
+    if replayed.exists() and not any(s.get("error") for s in json.loads(replayed.read_text(encoding="utf-8"))["steps"]):
+        problems.append(f"{meta['task']}: the broken step did not record an error")
+    return problems
+
+
+# Adds a stylesheet per URL; resolves to "load", "error" or (if the request hung) "timeout" for each
+LOAD_STYLES_JS = """
+async (urls) => Promise.all(urls.map((url) => new Promise((resolve) => {
+  const link = document.createElement('link');
+  link.rel = 'stylesheet';
+  const timer = setTimeout(() => resolve('timeout'), 5000);
+  link.onload = () => { clearTimeout(timer); resolve('load'); };
+  link.onerror = () => { clearTimeout(timer); resolve('error'); };
+  link.href = url;
+  document.head.appendChild(link);
+})))
+"""
+
+
+async def check_router(work: Path, base: str) -> List[str]:
+    """Load fixture stylesheets through RequestRouter: blocked URLs must fail, cacheable ones must be stored and then
+    served from HttpCache in a fresh context, the cache must stay under its size cap, and a request whose upstream
+    fetch fails must error out instead of hanging."""
+    from playwright.async_api import async_playwright
+    from src.utils.browser_helpers import LAUNCH_ARGS
+    from src.utils.request_router import HttpCache, RequestRouter
+
+    size = (FIXTURE_DIR / "style.css").stat().st_size
+    cache = HttpCache(str(work / "http_cache"), max_bytes=size * 3, max_age_s=60)
+    router = RequestRouter(["*/bench-blocked/*"], cache=cache)
+    cached = [f"{base}/style.css?max_age=600&n={i}" for i in range(6)]
+    problems = []
+    async with async_playwright() as pw:
+        browser = await pw.chromium.launch(headless=True, args=LAUNCH_ARGS)
+        try:
+            for attempt in ("first", "second"):
+                # A new context each time, so only HttpCache (not Chromium's memory cache) can answer the repeat
+                context = await browser.new_context()
+                await router.install(context)
+                page = await context.new_page()
+                await page.goto(f"{base}/home.html")
+                urls = cached if attempt == "second" else cached + [f"{base}/bench-blocked/style.css", f"{base}/bench-drop/style.css"]
+                results = dict(zip(urls, await page.evaluate(LOAD_STYLES_JS, urls)))
+                await context.close()
+                if attempt == "first":
+                    first = dict(router.stats)
+                problems += [f"{attempt} load: {url} -> {res}" for url, res in results.items()
+                             if res != ("load" if "max_age" in url else "error")]
+        finally:
+            await browser.close()
+    if first["blocked"] != 1:
+        problems.append(f"expected 1 blocked request, got {first['blocked']}")
+    if first["cache_stores"] != len(cached):
+        problems.append(f"expected {len(cached)} cache stores, got {first['cache_stores']}")
+    # Only the entries that survived eviction can be hits the second time
+    if router.stats["cache_hits"] - first["cache_hits"] < 1:
+        problems.append("no repeated stylesheet was served from the HTTP cache")
+    if not cache.evicted or (cache._bytes or 0) > cache.max_bytes:
+        problems.append(f"cache not held to its cap: {cache._bytes} bytes for a {cache.max_bytes} byte cap, {cache.evicted} evicted")
+    return problems
+
+
+def totals(per_task: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    steps = sum(t["steps"] for t in per_task.values()) or 1
+    ms = sum(t["ms_per_step"] * t["steps"] for t in per_task.values())
+    return {
+        "steps": steps,
+        "errors": sum(t["errors"] for t in per_task.values()),
+        "ms_per_step": round(ms / steps, 1),
+        "steps_per_s": round(steps / (ms / 1000), 2) if ms else 0.0,
+        "round_trips_per_step": round(sum(t["round_trips_per_step"] * t["steps"] for t in per_task.values()) / steps, 1),
+        "bytes_serialized_per_step": round(sum(t["bytes_serialized_per_step"] * t["steps"] for t in per_task.values()) / steps),
+        "screenshots": sum(t["screenshots"] for t in per_task.values()),
+        "bytes_on_disk": sum(t["bytes_on_disk"] for t in per_task.values()),
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], thresholds: Dict[str, float]) -> List[str]:
+    regressions = []
+    for metric, allowed in thresholds.items():
+        old, new = baseline.get(metric), current.get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if change > allowed:
+            regressions.append(f"{metric}: {old} -> {new} (+{change:.0%}, allowed +{allowed:.0%})")
+    if baseline.get("screenshots") is not None and baseline["screenshots"] != current["screenshots"]:
+        regressions.append(f"screenshots: {baseline['screenshots']} -> {current['screenshots']} (capture behaviour changed)")
+    return regressions
+
+
+def print_table(per_task: Dict[str, Dict[str, Any]], total: Dict[str, Any]):
+    cols = ["steps", "ms_per_step", "round_trips_per_step", "bytes_serialized_per_step", "screenshots", "bytes_on_disk"]
+    print(f"{'task':<60}" + "".join(f"{c:>14.14}" for c in cols))
+    for name, t in list(per_task.items()) + [("TOTAL", total)]:
+        print(f"{name[:59]:<60}" + "".join(f"{t[c]:>14}" for c in cols))
+    print(f"steps/s: {total['steps_per_s']}  errors: {total['errors']}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench.run_bench", description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=1, help="Run the suite N times and keep the median ms/step")
+    parser.add_argument("--update-baselines", action="store_true")
+    parser.add_argument("--no-compare", action="store_true", help="Print the numbers without comparing them to the baseline")
+    parser.add_argument("--only", help="Substring filter on app/task")
+    parser.add_argument("--json", dest="json_out", help="Also write the full results to this file")
+    parser.add_argument("--closed-loop", action="store_true", help="PLAN_MODE=closed with the stub LLM (not comparable to baselines)")
+    parser.add_argument("--replay", action="store_true", help="Replay the first run's recordings (one step broken on purpose) and check the results")
+    parser.add_argument("--router", action="store_true", help="Also check request blocking, HTTP cache hits and eviction, and failed upstream fetches")
+    args = parser.parse_args(argv)
+
+    tasks = json.loads(TASKS_FILE.read_text(encoding="utf-8"))
+    if args.only:
+        tasks = [t for t in tasks if args.only.lower() in f"{t['app']}: {t['task']}".lower()]
+    with tempfile.TemporaryDirectory(prefix="wf-bench-") as tmp:
+        work = Path(tmp)
+        # Isolate every on-disk cache so runs are comparable; tunables are left to the caller's environment
+        os.environ.update({
+            "TRACE": "on", "PLAN_CACHE": "off", "DATASET_INDEX": "off", "HTTP_CACHE": "off",
+            "SELECTOR_MEMORY_DIR": str(work / "selector_memory"),
+        })
+        os.environ.setdefault("SLOW_MO_MS", "0")
+        if args.closed_loop:
+            os.environ.update({"PLAN_MODE": "closed", "AI_PROVIDER": "stub"})
+            os.environ.setdefault("STUB_PLANNER_LATENCY_MS", "0")
+        server, base = serve_fixture()
+        runs = []
+        try:
+            for i in range(max(1, args.repeat)):
+                run_dir = work / f"run-{i}"
+                run_dir.mkdir()
+                runs.append(asyncio.run(run_suite(tasks, base, run_dir, closed_loop=args.closed_loop)))
+            replay_problems = asyncio.run(check_replay(work / "run-0", base)) if args.replay else []
+            router_problems = asyncio.run(check_router(work, base)) if args.router else []
+        finally:
+            server.shutdown()
+
+    per_task = runs[0]
+    for name, t in per_task.items():
+        t["ms_per_step"] = statistics.median(r[name]["ms_per_step"] for r in runs)
+    total = totals(per_task)
+    env = {k: os.environ[k] for k in ENV_KEYS if k in os.environ}
+    print_table(per_task, total)
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps({"total": total, "tasks": per_task, "env": env}, indent=2), encoding="utf-8")
+    for problem in replay_problems:
+        logger.error(f"Replay: {problem}")
+    if replay_problems:
+        return 1
+    if args.replay:
+        logger.info("Replay: every workflow recorded, broken step reported as an error")
+    for problem in router_problems:
+        logger.error(f"Router: {problem}")
+    if router_problems:
+        return 1
+    if args.router:
+        logger.info("Router: blocking, HTTP cache hits and eviction, and failed fetches behave")
+
+    if args.closed_loop:
+        for name, t in per_task.items():
+            if t.get("closed_loop"):
+                print(f"{name[:59]:<60} {t['closed_loop']}")
+        if args.update_baselines:
+            parser.error("--update-baselines records the static-plan suite; drop --closed-loop")
+        return 0
+    if args.update_baselines:
+        if args.only:
+            parser.error("--update-baselines needs the full suite (drop --only)")
+        BASELINES_FILE.write_text(json.dumps({"total": total, "tasks": per_task, "env": env, "thresholds": THRESHOLDS}, indent=2) + "\n", encoding="utf-8")
+        logger.info(f"Baselines written to {BASELINES_FILE}")
+        return 0
+    if args.no_compare:
+        return 0
+    if not BASELINES_FILE.exists():
+        # A check that silently passes without a baseline is no check; record one on the reference machine and commit it
+        logger.error(f"No baselines at {BASELINES_FILE}; record them with --update-baselines and commit the file")
+        return 1
+    baseline = json.loads(BASELINES_FILE.read_text(encoding="utf-8"))
+    if baseline.get("env", {}) != env:
+        logger.warning(f"Environment differs from baseline: {baseline.get('env')} vs {env}")
+    thresholds = {**THRESHOLDS, **baseline.get("thresholds", {})}
+    if args.only:
+        regressions = [f"{name}: {r}" for name, t in per_task.items() if name in baseline.get("tasks", {})
+                       for r in compare(t, baseline["tasks"][name], thresholds)]
+    else:
+        regressions = compare(total, baseline.get("total", {}), thresholds)
+    for r in regressions:
+        logger.error(f"Regression: {r}")
+    if not regressions:
+        logger.info("No regressions against baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,117 +1,283 @@
 import argparse
 import asyncio
+import json
 import os
-import time
-from typing import List, Dict, Any
+import sys
+from typing import Optional
 from loguru import logger
 from dotenv import load_dotenv
 
-from src.config.app_configs import APPS
+from src.config.app_configs import APPS, AppConfig
 from src.agent.task_planner import TaskPlanner
-from src.agent.action_executor import ActionExecutor
-from src.agent.state_detector import StateDetector
-from src.capture.screenshot_manager import ScreenshotManager
+from src.agent.batch_runner import load_tasks_file, run_batch
+from src.agent.workflow_runner import run_workflow
+from src.agent.browser_pool import BrowserPool
+from src.agent.capture_server import CaptureServer
+from src.agent.replay import replay
+from src.agent.job_ledger import JobLedger, run_workers
+from src.capture.blob_store import BlobStore
 from src.capture.metadata_handler import MetadataHandler
-from src.utils.browser_helpers import BrowserManager
+from src.capture.dataset_index import DatasetIndex
+from src.capture.postprocess import PostProcessor
+from src.capture.shards import ShardExporter, ShardReader
+from src.utils.browser_helpers import BrowserManager, SharedBrowser
+from src.utils.request_router import RequestRouter
+from src.utils.session_manager import SessionManager
+from src.utils import tracing
 
-async def run_once(app: str, task: str, out_root: str, headless: bool, profile: str, max_steps: int, manual_login: bool):
-    cfg = APPS.get(app)
+async def run_once(app: str, task: str, out_root: str, headless: bool, profile: str, max_steps: int, manual_login: bool,
+                   cfg: Optional[AppConfig] = None, planner: Optional[TaskPlanner] = None):
+    cfg = cfg or APPS.get(app)
     if not cfg:
         raise SystemExit(f"Unknown app: {app}")
 
-    planner = TaskPlanner()
-    detector = StateDetector(
-        networkidle_ms=int(os.getenv("NETWORKIDLE_TIMEOUT_MS", "1500")),
-        capture_delay_ms=int(os.getenv("CAPTURE_DELAY_MS", "500")),
-        significance_threshold=float(os.getenv("SIGNIFICANCE_THRESHOLD", "0.12")),
-    )
-    shots = ScreenshotManager(out_root)
-    meta = MetadataHandler(out_root)
-
-    async with BrowserManager(headless=headless, profile=profile) as bm:
-        page = await bm.new_page()
-        await BrowserManager.ensure_logged_in(page, cfg.login_url, manual=manual_login)
-
-        # Plan steps
-        plan = planner.plan(app, task, cfg.workspace_url or cfg.base_url)
-        steps: List[Dict[str, Any]] = plan.get("steps", [])
-        execu = ActionExecutor(page)
-
-        recorded: List[Dict[str, Any]] = []
-        logger.info(f"Executing {len(steps)} planned steps (max {max_steps})")
-        
-        for i, step in enumerate(steps[:max_steps], start=1):
-            try:
-                # Always try to perform action (has internal error handling now)
-                await execu.perform(step)
-                
-                # Always detect state and try to capture
-                state = await detector.detect(page)
-                do_capture = bool(step.get("capture_hint", False)) or state.get("significant", False)
-                img_path = None
-                
-                # Always capture screenshots for key steps
-                if do_capture or i == 1 or i == len(steps):
-                    try:
-                        img_path = await shots.capture(page, app, task, step.get("description", f"step-{i}"))
-                    except Exception as capture_err:
-                        logger.warning(f"Screenshot capture failed: {capture_err}")
-                
-                recorded.append({
-                    "index": i,
-                    "description": step.get("description"),
-                    "action": step.get("action"),
-                    "selector": step.get("selector"),
-                    "input": step.get("input"),
-                    "url": state.get("url"),
-                    "has_modal": state.get("has_modal"),
-                    "has_overlay": state.get("has_overlay"),
-                    "screenshot": img_path,
-                    "timestamp": state.get("timestamp"),
-                })
-            except Exception as e:
-                logger.warning(f"Step {i} encountered error (continuing): {e}")
-                # Still try to capture current state
-                try:
-                    img_path = await shots.capture(page, app, task, f"step-{i}-error")
-                    recorded.append({
-                        "index": i,
-                        "description": step.get("description"),
-                        "action": step.get("action"),
-                        "error": str(e),
-                        "screenshot": img_path,
-                        "timestamp": time.time(),
-                    })
-                except:
-                    recorded.append({
-                        "index": i,
-                        "description": step.get("description"),
-                        "action": step.get("action"),
-                        "error": str(e),
-                        "timestamp": time.time(),
-                    })
-        
-        meta.write(app, task, recorded)
-        logger.info(f"Workflow complete: {len(recorded)} steps recorded, {len([r for r in recorded if r.get('screenshot')])} screenshots captured")
+    planner = planner or TaskPlanner()
+    router = RequestRouter.from_env(cfg)
+    # Started here rather than in the runner so the login lands on the same timeline
+    token = tracing.activate(tracing.Tracer.from_env(f"{app}: {task}"))
+    try:
+        async with BrowserManager(headless=headless, profile=profile, router=router) as bm:
+            page = await bm.new_page()
+            with tracing.span("login"):
+                await SessionManager().ensure(bm.context, cfg, manual=manual_login, interactive=not bm.headless, page=page)
+            result = await run_workflow(page, cfg, task, out_root, max_steps, planner=planner)
+    finally:
+        tracing.deactivate(token)
+    logger.info(f"Plan cache: {planner.ai.cache.stats}")
+    if router:
+        logger.info(f"Request router: {router.stats}")
+    return result
+
+def blobs_command(argv):
+    parser = argparse.ArgumentParser(prog="main.py blobs", description="Maintain the content-addressed screenshot store")
+    parser.add_argument("action", choices=["gc", "export"])
+    parser.add_argument("--out", default="dataset", help="Dataset root holding .blobs/")
+    parser.add_argument("--dest", default="dataset_export", help="export: directory for the per-task layout")
+    parser.add_argument("--copy", action="store_true", help="export: copy files instead of hard-linking")
+    parser.add_argument("--grace-hours", type=float, default=1.0, help="gc: keep unreferenced blobs younger than this")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+    store = BlobStore(args.out)
+    if args.action == "gc":
+        store.gc(grace_s=args.grace_hours * 3600, dry_run=args.dry_run)
+    else:
+        store.export(args.dest, copy=args.copy)
+
+def recover_command(argv):
+    parser = argparse.ArgumentParser(prog="main.py recover", description="Rebuild metadata.json from journals left by interrupted runs")
+    parser.add_argument("--out", default="dataset", help="Dataset root")
+    args = parser.parse_args(argv)
+    recovered = MetadataHandler.recover(args.out)
+    logger.info(f"Recovered {len(recovered)} interrupted workflows")
+
+def index_command(argv):
+    parser = argparse.ArgumentParser(prog="main.py index", description="Maintain and query the SQLite dataset index")
+    parser.add_argument("action", choices=["refresh", "query", "stats"])
+    parser.add_argument("--out", default="dataset", help="Dataset root")
+    parser.add_argument("--app")
+    parser.add_argument("--action-type", dest="action_type", help="Step action (click, type, ...)")
+    parser.add_argument("--has-modal", action="store_true", default=None)
+    parser.add_argument("--has-overlay", action="store_true", default=None)
+    parser.add_argument("--errored", action="store_true", default=None)
+    parser.add_argument("--ok", action="store_true", help="Only steps without errors")
+    parser.add_argument("--url", help="Substring of the step URL")
+    parser.add_argument("--selector", help="Selector value, e.g. 'Share' or 'button:New page'")
+    parser.add_argument("--task", help="Substring of the task text")
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args(argv)
+    index = DatasetIndex(args.out)
+    try:
+        index.refresh()
+        if args.action == "stats":
+            print(json.dumps(index.stats(), indent=2))
+        elif args.action == "query":
+            rows = index.query(
+                app=args.app, has_modal=args.has_modal, has_overlay=args.has_overlay,
+                errored=False if args.ok else args.errored, action=args.action_type, url_contains=args.url,
+                selector=args.selector, task_contains=args.task, limit=args.limit,
+            )
+            for row in rows:
+                print(json.dumps(row))
+    finally:
+        index.close()
+
+def report_command(argv):
+    parser = argparse.ArgumentParser(prog="main.py report", description="p50/p95 per traced phase across the dataset (runs with TRACE=on)")
+    parser.add_argument("--out", default="dataset", help="Dataset root")
+    args = parser.parse_args(argv)
+    phases = tracing.report(args.out)
+    if not phases:
+        logger.info(f"No {tracing.TRACE_NAME} files under {args.out}; run with --trace or TRACE=on first")
+        return
+    print(f"{'phase':<16}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'total s':>10}")
+    for name, s in phases.items():
+        print(f"{name:<16}{s['count']:>8}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['total_ms'] / 1000:>10.1f}")
+
+async def serve(apps, out_root: str, headless: bool, profile: str, max_steps: int, pool_size: Optional[int],
+                host: str, port: int, socket_path: Optional[str]):
+    async with SharedBrowser(headless=headless, profile=profile, sessions=SessionManager()) as sb:
+        pool = BrowserPool(sb, apps, size=pool_size)
+        await pool.start()
+        server = CaptureServer(pool, out_root, max_steps)
+        try:
+            await server.serve(host, port, socket_path)
+        finally:
+            await server.close()
+            await pool.close()
+
+def serve_command(argv):
+    parser = argparse.ArgumentParser(prog="main.py serve", description="Run a capture daemon with warm, logged-in browser contexts")
+    parser.add_argument("--apps", default=",".join(APPS), help="Comma-separated apps to keep warm")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVE_PORT", "8765")))
+    parser.add_argument("--socket", help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--pool-size", type=int, help="Warm contexts per app (default POOL_SIZE or 2)")
+    parser.add_argument("--out", default="dataset", help="Output root directory")
+    parser.add_argument("--profile", default=os.getenv("PERSISTENT_PROFILE", ".playwright"))
+    parser.add_argument("--max-steps", type=int, default=20)
+    parser.add_argument("--headed", action="store_true", help="Show the browser (default headless)")
+    args = parser.parse_args(argv)
+    unknown = [a for a in args.apps.split(",") if a not in APPS]
+    if unknown:
+        parser.error(f"unknown apps: {unknown}")
+    try:
+        asyncio.run(serve([APPS[a] for a in args.apps.split(",")], args.out, not args.headed, args.profile,
+                          args.max_steps, args.pool_size, args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        logger.info("Capture server stopped")
+
+def replay_command(argv):
+    parser = argparse.ArgumentParser(prog="main.py replay", description="Re-run recorded workflows without the LLM and diff them against the recording")
+    parser.add_argument("--out", default="dataset", help="Dataset root holding the recordings")
+    parser.add_argument("--dest", default="dataset_replay", help="Where the fresh capture goes (use the same path as --out to refresh in place)")
+    parser.add_argument("--app")
+    parser.add_argument("--task", help="Substring of the task text")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "4")))
+    parser.add_argument("--profile", default=os.getenv("PERSISTENT_PROFILE", ".playwright"))
+    parser.add_argument("--headed", action="store_true")
+    args = parser.parse_args(argv)
+    report = asyncio.run(replay(args.out, args.dest, app=args.app, task_contains=args.task, headless=not args.headed,
+                                profile=args.profile, concurrency=args.concurrency))
+    for wf in report.get("workflows", []):
+        status = "FAILED" if wf.get("failed") else f"{wf['changed_steps']}/{wf['steps']} steps changed"
+        print(f"{wf['app']}: {wf['task']} -> {status}")
+
+def postprocess_command(argv):
+    parser = argparse.ArgumentParser(prog="main.py postprocess", description="Redact, annotate and thumbnail recorded frames in parallel")
+    parser.add_argument("--out", default="dataset", help="Dataset root")
+    parser.add_argument("--app")
+    parser.add_argument("--workers", type=int, help="Worker processes (default POSTPROCESS_WORKERS or all cores)")
+    parser.add_argument("--force", action="store_true", help="Redo frames whose outputs are already up to date")
+    args = parser.parse_args(argv)
+    print(json.dumps(PostProcessor(args.out, workers=args.workers).run(app=args.app, force=args.force), indent=2))
+
+def schedule_command(argv):
+    parser = argparse.ArgumentParser(prog="main.py schedule", description="Resumable job ledger: queue tasks, then run them with worker processes")
+    parser.add_argument("action", choices=["add", "run", "status", "retry"])
+    parser.add_argument("--ledger", default=os.getenv("LEDGER_PATH", "jobs.sqlite"), help="SQLite ledger file")
+    parser.add_argument("--tasks-file", help="add: JSONL file of {\"app\", \"task\"} jobs")
+    parser.add_argument("--max-attempts", type=int, help="add: attempts before a job is marked failed (default LEDGER_MAX_ATTEMPTS or 3)")
+    parser.add_argument("--app", help="retry: only this app's failed jobs")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SCHEDULE_WORKERS", "1")), help="run: worker processes, each with its own browser")
+    parser.add_argument("--slots", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "4")), help="run: concurrent contexts per worker")
+    parser.add_argument("--out", default="dataset", help="Output root directory")
+    parser.add_argument("--profile", default=os.getenv("PERSISTENT_PROFILE", ".playwright"))
+    parser.add_argument("--max-steps", type=int, default=20)
+    parser.add_argument("--headed", action="store_true")
+    parser.add_argument("--manual-login", action="store_true")
+    args = parser.parse_args(argv)
+    ledger = JobLedger(args.ledger)
+    try:
+        if args.action == "add":
+            if not args.tasks_file:
+                parser.error("add needs --tasks-file")
+            added = ledger.add(load_tasks_file(args.tasks_file), max_attempts=args.max_attempts)
+            logger.info(f"Queued {added} new jobs in {args.ledger} (existing jobs are kept as they are)")
+        elif args.action == "retry":
+            logger.info(f"Re-queued {ledger.retry_failed(args.app)} failed jobs")
+        elif args.action == "run":
+            run_workers(args.ledger, args.out, not args.headed, args.profile, args.max_steps, args.workers, args.slots,
+                        manual_login=args.manual_login)
+        print(json.dumps(ledger.counts(), indent=2))
+    finally:
+        ledger.close()
+
+def shards_command(argv):
+    parser = argparse.ArgumentParser(prog="main.py shards", description="Export the dataset to memory-mappable tar shards")
+    parser.add_argument("action", choices=["export", "stats"])
+    parser.add_argument("--out", default="dataset", help="Dataset root")
+    parser.add_argument("--dest", default="dataset_shards", help="Directory for shards and manifest.json")
+    parser.add_argument("--shard-mb", type=float, help="Target shard size (default SHARD_SIZE_MB or 256)")
+    parser.add_argument("--workers", type=int, help="Worker processes (default SHARD_WORKERS or all cores)")
+    parser.add_argument("--force", action="store_true", help="Repack every workflow instead of only new or changed ones")
+    args = parser.parse_args(argv)
+    if args.action == "export":
+        print(json.dumps(ShardExporter(args.out, args.dest, shard_mb=args.shard_mb, workers=args.workers).export(force=args.force), indent=2))
+        return
+    with ShardReader(args.dest) as reader:
+        shards = reader.manifest["shards"]
+        print(json.dumps({
+            "shards": len(shards), "workflows": len(reader.manifest["workflows"]),
+            "records": sum(s["records"] for s in shards.values()), "bytes": sum(s["bytes"] for s in shards.values()),
+        }, indent=2))
+
+COMMANDS = {
+    "index": index_command,
+    "blobs": blobs_command,
+    "recover": recover_command,
+    "report": report_command,
+    "serve": serve_command,
+    "replay": replay_command,
+    "postprocess": postprocess_command,
+    "schedule": schedule_command,
+    "shards": shards_command,
+}
 
 if __name__ == "__main__":
     load_dotenv()
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]](sys.argv[2:])
+        raise SystemExit(0)
     parser = argparse.ArgumentParser()
-    parser.add_argument("--app", required=True, help="App key (trello, notion, linear)")
-    parser.add_argument("--task", required=True, help="Natural language task")
+    parser.add_argument("--app", help="App key (trello, notion, linear)")
+    parser.add_argument("--task", help="Natural language task")
+    parser.add_argument("--tasks-file", help="JSONL file of {\"app\", \"task\"} jobs to run as a batch")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "4")), help="Parallel workers in batch mode")
     parser.add_argument("--out", default="dataset", help="Output root directory")
     parser.add_argument("--headless", action="store_true", help="Run headless")
     parser.add_argument("--profile", default=os.getenv("PERSISTENT_PROFILE", ".playwright"))
     parser.add_argument("--max-steps", type=int, default=20)
     parser.add_argument("--manual-login", action="store_true")
+    parser.add_argument("--plan-cache", choices=["on", "off", "refresh"], help="Use, bypass, or overwrite cached LLM plans (default: PLAN_CACHE or on)")
+    parser.add_argument("--trace", action="store_true", help="Record per-step spans to trace.json (same as TRACE=on)")
     args = parser.parse_args()
+    if args.trace:
+        os.environ["TRACE"] = "on"
+    if args.plan_cache:
+        os.environ["PLAN_CACHE"] = args.plan_cache
+    headless = args.headless or (str(os.getenv("HEADLESS", "false")).lower() == "true")
 
-    asyncio.run(run_once(
-        app=args.app,
-        task=args.task,
-        out_root=args.out,
-        headless=args.headless or (str(os.getenv("HEADLESS", "false")).lower() == "true"),
-        profile=args.profile,
-        max_steps=args.max_steps,
-        manual_login=args.manual_login,
-    ))
+    if args.tasks_file:
+        jobs = load_tasks_file(args.tasks_file)
+        logger.info(f"Loaded {len(jobs)} jobs from {args.tasks_file}")
+        asyncio.run(run_batch(
+            jobs,
+            out_root=args.out,
+            headless=headless,
+            profile=args.profile,
+            max_steps=args.max_steps,
+            concurrency=args.concurrency,
+            manual_login=args.manual_login,
+        ))
+    else:
+        if not args.app or not args.task:
+            parser.error("--app and --task are required unless --tasks-file is given")
+        asyncio.run(run_once(
+            app=args.app,
+            task=args.task,
+            out_root=args.out,
+            headless=headless,
+            profile=args.profile,
+            max_steps=args.max_steps,
+            manual_login=args.manual_login,
+        ))
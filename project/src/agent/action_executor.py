@@ -1,43 +1,168 @@
+import os
 import re
 from typing import Any, Dict, Optional
 from loguru import logger
 from playwright.async_api import Page, Locator
+from src.agent.page_tracker import snapshot, signature
+from src.agent.settle import SettleEngine
+from src.agent.selector_memory import SelectorMemory
+from src.agent.locator_race import candidate_specs, race
+from src.utils import tracing
 
 Selector = Dict[str, Any]
 
 class ActionExecutor:
-    def __init__(self, page: Page):
+    def __init__(self, page: Page, settler: Optional[SettleEngine] = None, memory: Optional[SelectorMemory] = None,
+                 type_delay_ms: Optional[int] = None, sensitive: bool = False):
         self.page = page
+        # Whether post-action snapshots also collect sensitive regions, so the detector can reuse them
+        self.sensitive = sensitive
+        self.settler = settler
+        self.memory = memory
+        # RESOLVE_MODE=race probes several candidate locators concurrently instead of trusting the planner's one
+        self.race = os.getenv("RESOLVE_MODE", "single").lower() == "race"
+        self.race_timeout_ms = int(os.getenv("RACE_TIMEOUT_MS", "3000"))
+        # Per-keystroke delay; replay sets it to 0
+        self.type_delay_ms = int(os.getenv("TYPE_DELAY_MS", "50")) if type_delay_ms is None else type_delay_ms
+        self._pinned: Optional[Dict[str, Any]] = None
+        self._spec: Optional[Dict[str, Any]] = None
+        self.last_settle: Optional[Dict[str, Any]] = None
+        self.last_error: Optional[str] = None
+        self.last_target_box: Optional[Dict[str, float]] = None
+        # Snapshot of the settled page after the action, when nothing ran after it; saves the detector an evaluate
+        self.last_snapshot: Optional[Dict[str, Any]] = None
 
-    def _resolve(self, selector: Optional[Selector]) -> Locator:
+    @staticmethod
+    def _spec_for(selector: Optional[Selector]) -> Optional[Dict[str, Any]]:
+        # Planner selector -> one concrete locator strategy (None means "body")
         if not selector:
-            return self.page.locator("body")
+            return None
         if sel := selector.get("css"):
             if sel.startswith("http"):
                 # used by goto
-                return self.page.locator("body")
-            return self.page.locator(sel)
+                return None
+            return {"kind": "css", "value": sel}
         if "role" in selector and selector.get("name_regex"):
-            role = selector["role"]
-            pattern = selector["name_regex"]
-            return self.page.get_by_role(role, name=re.compile(pattern, re.I))
+            return {"kind": "role", "role": selector["role"], "name_regex": selector["name_regex"]}
         if "role" in selector and "name" in selector:
-            return self.page.get_by_role(selector["role"], name=selector["name"])
+            return {"kind": "role", "role": selector["role"], "name": selector["name"]}
         if sel := selector.get("text"):
-            return self.page.get_by_text(sel)
+            return {"kind": "text", "value": sel}
         if sel := selector.get("placeholder"):
-            return self.page.get_by_placeholder(sel)
+            return {"kind": "placeholder", "value": sel}
         if sel := selector.get("label"):
-            return self.page.get_by_label(sel)
+            return {"kind": "label", "value": sel}
         if sel := selector.get("xpath"):
-            return self.page.locator(f"xpath={sel}")
-        return self.page.locator("body")
+            return {"kind": "xpath", "value": sel}
+        return None
+
+    def _from_spec(self, spec: Optional[Dict[str, Any]]) -> Locator:
+        if not spec:
+            return self.page.locator("body")
+        kind = spec["kind"]
+        if kind == "css":
+            loc = self.page.locator(spec["value"])
+        elif kind == "role" and spec.get("name_regex"):
+            loc = self.page.get_by_role(spec["role"], name=re.compile(spec["name_regex"], re.I))
+        elif kind == "role":
+            loc = self.page.get_by_role(spec["role"], name=spec.get("name"), exact=spec.get("exact"))
+        elif kind == "text" and spec.get("value_regex"):
+            loc = self.page.get_by_text(re.compile(spec["value_regex"], re.I))
+        elif kind == "text":
+            loc = self.page.get_by_text(spec["value"], exact=spec.get("exact"))
+        elif kind == "placeholder":
+            loc = self.page.get_by_placeholder(spec["value"])
+        elif kind == "label":
+            loc = self.page.get_by_label(spec["value"])
+        elif kind == "xpath":
+            loc = self.page.locator(f"xpath={spec['value']}")
+        else:
+            return self.page.locator("body")
+        if spec.get("visible"):
+            loc = loc.locator("visible=true")
+        if "nth" in spec:
+            loc = loc.nth(spec["nth"])
+        return loc
+
+    def _resolve(self, selector: Optional[Selector]) -> Locator:
+        return self._from_spec(self._spec_for(selector))
+
+    async def _locate(self, selector: Optional[Selector], action: Optional[str] = None) -> Locator:
+        """Locator for an element action: a locator pinned by the step (replay), the remembered locator for this
+        URL pattern, then the planner's (or, in race mode, whichever candidate derived from it resolves first)."""
+        self._spec = self._spec_for(selector)
+        if self._pinned:
+            loc = self._from_spec(self._pinned).first
+            try:
+                if await loc.count() > 0:
+                    self._spec = self._pinned
+                    return loc
+            except Exception:
+                pass
+        if self.memory and self._spec:
+            entry = self.memory.lookup(self.page.url, selector)
+            if entry:
+                for spec in (entry.get("spec"), entry.get("fallback")):
+                    if not spec:
+                        continue
+                    loc = self._from_spec(spec).first
+                    try:
+                        if await loc.count() > 0:
+                            logger.info(f"Using remembered locator {spec}")
+                            self._spec = spec
+                            return loc
+                    except Exception:
+                        pass
+                self.memory.record_miss(self.page.url, selector)
+        if self.race and self._spec:
+            won = await race(candidate_specs(selector, self._spec, action), self._from_spec, self.race_timeout_ms)
+            if won:
+                spec, loc = won
+                if spec != self._spec:
+                    logger.info(f"Resolved by race: {spec}")
+                self._spec = spec
+                return loc
+        return self._resolve(selector).first
+
+    @property
+    def last_locator(self) -> Optional[Dict[str, Any]]:
+        """Concrete locator spec the last element action resolved to (recorded so replay can skip resolution)."""
+        return self._spec
+
+    def _remember(self, selector: Optional[Selector], url: str, target: Optional[Dict[str, Any]] = None):
+        if not self.memory or not self._spec or not selector:
+            return
+        fallback = None
+        if target and target.get("target_role") and target.get("target_name"):
+            fallback = {"kind": "role", "role": target["target_role"], "name": target["target_name"], "exact": True}
+        self.memory.record_hit(url, selector, self._spec, fallback=fallback, box=target.get("target_box") if target else None)
+
+    async def _target(self, locator: Locator) -> Optional[Dict[str, Any]]:
+        """Snapshot taken on the element itself; records its viewport box for the step metadata."""
+        try:
+            pre = await snapshot(self.page, locator)
+        except Exception:
+            return None
+        self.last_target_box = pre.get("target_box")
+        return pre
 
     async def perform(self, step: Dict[str, Any]):
+        with tracing.span("perform", action=step.get("action")):
+            return await self._perform(step)
+
+    async def _perform(self, step: Dict[str, Any]):
         action = step.get("action")
         selector = step.get("selector")
         wait_ms = step.get("wait_ms", 300)
         desc = step.get("description", action)
+        self.last_error = None
+        self.last_target_box = None
+        self.last_settle = None
+        self.last_snapshot = None
+        settled = False
+        self._spec = None
+        self._pinned = step.get("locator")
+        start_url = self.page.url
         logger.info(f"Action: {action} | {desc}")
         
         try:
@@ -46,62 +171,80 @@ class ActionExecutor:
                 if url:
                     await self.page.goto(url, timeout=30000)
             elif action == "click":
-                locator = self._resolve(selector).first
-                pre_url = self.page.url
-                # simple DOM fingerprint by content length (fast)
-                try:
-                    pre_len = len(await self.page.content())
-                except Exception:
-                    pre_len = -1
+                with tracing.span("resolve"):
+                    locator = await self._locate(selector, action)
                 # Check if element exists
                 if await locator.count() > 0:
-                    try:
-                        await locator.scroll_into_view_if_needed(timeout=3000)
-                    except Exception:
-                        pass
-                    await locator.click(timeout=6000)
+                    with tracing.span("scroll"):
+                        try:
+                            await locator.scroll_into_view_if_needed(timeout=3000)
+                        except Exception:
+                            pass
+                    # Tracker snapshot on the element: mutation counter + its bounding box, one round trip
+                    pre = await self._target(locator)
+                    with tracing.span("click"):
+                        await locator.click(timeout=6000)
                     # give page a chance to change
+                    if self.settler:
+                        with tracing.span("settle"):
+                            self.last_settle = {**await self.settler.settle(self.page), "budget_ms": 6000 + wait_ms}
+                        settled = True
+                    else:
+                        with tracing.span("networkidle"):
+                            try:
+                                await self.page.wait_for_load_state("networkidle", timeout=6000)
+                            except Exception:
+                                pass
                     try:
-                        await self.page.wait_for_load_state("networkidle", timeout=6000)
-                    except Exception:
-                        pass
-                    post_url = self.page.url
-                    try:
-                        post_len = len(await self.page.content())
+                        post = await snapshot(self.page, sensitive=self.sensitive)
                     except Exception:
-                        post_len = -1
-                    if post_url != pre_url or (pre_len != -1 and post_len != pre_len):
+                        post = None
+                    if pre is None or post is None or post["url"] != pre["url"] or signature(post) != signature(pre):
                         logger.info(f"✓ Clicked: {desc}")
+                        self._remember(selector, start_url, pre)
+                        # Without a settler a fixed wait still follows, so the page may move on after this snapshot
+                        self.last_snapshot = post if settled else None
                     else:
                         # Retry once with force click after another scroll
-                        try:
-                            await locator.scroll_into_view_if_needed(timeout=3000)
-                        except Exception:
-                            pass
-                        await locator.click(timeout=6000)
+                        with tracing.span("retry"):
+                            try:
+                                await locator.scroll_into_view_if_needed(timeout=3000)
+                            except Exception:
+                                pass
+                            await locator.click(timeout=6000)
                         logger.info(f"✓ Clicked (retry): {desc}")
+                        self._remember(selector, start_url, pre)
                 else:
                     logger.warning(f"✗ Element not found for click: {desc}")
+                    self.last_error = "Element not found for click"
             elif action == "hover":
-                locator = self._resolve(selector).first
+                with tracing.span("resolve"):
+                    locator = await self._locate(selector, action)
                 if await locator.count() > 0:
+                    target = await self._target(locator)
                     await locator.hover(timeout=5000)
+                    self._remember(selector, start_url, target)
                 else:
                     logger.warning(f"✗ Element not found for hover: {desc}")
+                    self.last_error = "Element not found for hover"
             elif action == "type":
                 text = step.get("input", "")
                 # If no selector provided, type into currently focused element
                 if not selector or selector == {}:
-                    await self.page.keyboard.type(text, delay=50)
+                    await self.page.keyboard.type(text, delay=self.type_delay_ms)
                     logger.info(f"✓ Typed into focused element: {text[:50]}")
                 else:
-                    locator = self._resolve(selector).first
+                    with tracing.span("resolve"):
+                        locator = await self._locate(selector, action)
                     if await locator.count() > 0:
                         await locator.fill("", timeout=5000)
-                        await locator.type(text, delay=50, timeout=5000)
+                        target = await self._target(locator)
+                        await locator.type(text, delay=self.type_delay_ms, timeout=5000)
                         logger.info(f"✓ Typed: {text[:50]}")
+                        self._remember(selector, start_url, target)
                     else:
                         logger.warning(f"✗ Element not found for type: {desc}")
+                        self.last_error = "Element not found for type"
             elif action == "press":
                 key = step.get("input", "Enter")
                 # Support key combinations like "Control+n" or "Escape"
@@ -126,6 +269,15 @@ class ActionExecutor:
                 await self.page.mouse.wheel(0, y)
             else:
                 logger.warning(f"Unknown action: {action}")
-            await self.page.wait_for_timeout(wait_ms)
+                self.last_error = f"Unknown action: {action}"
+            if not self.settler:
+                with tracing.span("wait", ms=wait_ms):
+                    await self.page.wait_for_timeout(wait_ms)
+            elif not settled:
+                # wait_ms is the planner's worst-case guess; settle returns as soon as the page is still
+                with tracing.span("settle"):
+                    self.last_settle = {**await self.settler.settle(self.page, cap_ms=max(wait_ms, self.settler.quiet_ms)), "budget_ms": wait_ms}
         except Exception as e:
             logger.warning(f"Action failed (continuing): {action} | {desc} | Error: {e}")
+            self.last_error = str(e)
+        return self.last_error is None
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from loguru import logger
+
+from src.config.app_configs import APPS
+from src.agent.task_planner import TaskPlanner
+from src.agent.workflow_runner import run_workflow
+from src.capture.frame_writer import FrameWriter
+from src.utils.browser_helpers import SharedBrowser
+from src.utils.session_manager import SessionManager
+
+
+def load_tasks_file(path: str) -> List[Dict[str, Any]]:
+    """Read one JSON object per line: {"app": "trello", "task": "...", "max_steps": 10}."""
+    jobs: List[Dict[str, Any]] = []
+    for lineno, line in enumerate(Path(path).read_text(encoding="utf-8").splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            job = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise SystemExit(f"{path}:{lineno}: invalid JSON ({e})")
+        if not job.get("app") or not job.get("task"):
+            raise SystemExit(f"{path}:{lineno}: both 'app' and 'task' are required")
+        if job["app"] not in APPS:
+            raise SystemExit(f"{path}:{lineno}: unknown app: {job['app']}")
+        jobs.append(job)
+    return jobs
+
+
+def summarize(results: List[Dict[str, Any]], elapsed_s: float) -> Dict[str, Any]:
+    ok = [r for r in results if not r.get("failed")]
+    steps = sum(r.get("steps", 0) for r in results)
+    minutes = max(elapsed_s, 1e-6) / 60
+    return {
+        "tasks": len(results),
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "steps": steps,
+        "screenshots": sum(r.get("screenshots", 0) for r in results),
+        "elapsed_s": round(elapsed_s, 2),
+        "tasks_per_min": round(len(results) / minutes, 2),
+        "steps_per_min": round(steps / minutes, 2),
+    }
+
+
+async def run_batch(
+    jobs: List[Dict[str, Any]],
+    out_root: str,
+    headless: bool,
+    profile: str,
+    max_steps: int,
+    concurrency: int,
+    manual_login: bool = False,
+    planner: Optional[TaskPlanner] = None,
+    plan_ahead: Optional[int] = None,
+    slow_mo_ms: Optional[int] = None,
+    **overrides,
+) -> Dict[str, Any]:
+    planner = planner or TaskPlanner()
+    plan_ahead = int(os.getenv("PLAN_AHEAD", "2")) if plan_ahead is None else plan_ahead
+
+    sem = asyncio.Semaphore(max(1, concurrency))
+    # One bounded writer pool for all workers so disk I/O cannot outrun memory
+    writer = FrameWriter.from_env()
+    started = time.time()
+
+    async with SharedBrowser(headless=headless, profile=profile, sessions=SessionManager(), slow_mo_ms=slow_mo_ms) as sb:
+        # Probe each app's saved session once (logging in only if it expired); every worker context then reuses it
+        for app in sorted({j["app"] for j in jobs}):
+            await sb.ensure_session(APPS[app], manual=manual_login)
+
+        async def worker(n: int, job: Dict[str, Any]) -> Dict[str, Any]:
+            async with sem:
+                logger.info(f"[{n}/{len(jobs)}] Starting {job['app']}: {job['task']}")
+                # Plan the next few tasks while this one runs in the browser
+                for nxt in jobs[n:n + plan_ahead]:
+                    cfg = APPS[nxt["app"]]
+                    planner.prefetch(cfg.name, nxt["task"], cfg.workspace_url or cfg.base_url)
+                context = None
+                try:
+                    context = await sb.new_context(APPS[job["app"]])
+                    page = await context.new_page()
+                    page.set_default_navigation_timeout(sb.navigation_timeout_ms)
+                    return await run_workflow(
+                        page, APPS[job["app"]], job["task"], out_root,
+                        int(job.get("max_steps", max_steps)), planner=planner, writer=writer, **overrides,
+                    )
+                except Exception as e:
+                    logger.warning(f"[{n}/{len(jobs)}] Task failed (continuing): {job['task']} | {e}")
+                    return {"app": job["app"], "task": job["task"], "failed": True, "error": str(e), "steps": 0, "screenshots": 0}
+                finally:
+                    if context:
+                        try:
+                            await context.close()
+                        except Exception:
+                            pass
+
+        try:
+            results = await asyncio.gather(*(worker(n, job) for n, job in enumerate(jobs, start=1)))
+        finally:
+            planner.cancel_prefetch()
+            await writer.close()
+        network = sb.network_stats()
+
+    summary = summarize(list(results), time.time() - started)
+    summary["plan_cache"] = dict(planner.ai.cache.stats)
+    summary["plans_coalesced"] = planner.ai.coalesced
+    summary["network"] = network
+    logger.info(
+        f"Batch complete: {summary['succeeded']}/{summary['tasks']} tasks, {summary['steps']} steps in {summary['elapsed_s']}s "
+        f"({summary['tasks_per_min']} tasks/min, {summary['steps_per_min']} steps/min)"
+    )
+    for r in results:
+        if r.get("failed"):
+            logger.warning(f"Failed: {r['app']}: {r['task']} | {r.get('error')}")
+    return summary
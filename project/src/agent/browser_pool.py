@@ -0,0 +1,181 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from loguru import logger
+from playwright.async_api import BrowserContext, Page
+
+from src.config.app_configs import AppConfig
+from src.utils.browser_helpers import SharedBrowser
+
+
+@dataclass
+class PooledContext:
+    cfg: AppConfig
+    context: BrowserContext
+    page: Page
+    jobs: int = 0
+    created: float = field(default_factory=time.time)
+
+
+def process_tree_rss_mb() -> Optional[float]:
+    """RSS of this process and all descendants (driver + Chromium); Linux only, None elsewhere."""
+    try:
+        children: Dict[int, List[int]] = {}
+        for entry in os.scandir("/proc"):
+            if not entry.name.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry.name}/stat", "rb") as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            # comm may contain spaces; fields after the closing paren are fixed
+            ppid = int(stat[stat.rindex(b")") + 2:].split()[1])
+            children.setdefault(ppid, []).append(int(entry.name))
+        total, todo = 0, [os.getpid()]
+        page_kb = os.sysconf("SC_PAGE_SIZE") // 1024
+        while todo:
+            pid = todo.pop()
+            todo.extend(children.get(pid, []))
+            try:
+                with open(f"/proc/{pid}/statm") as f:
+                    total += int(f.read().split()[1]) * page_kb
+            except OSError:
+                continue
+        return round(total / 1024, 1)
+    except (OSError, ValueError):
+        return None
+
+
+class BrowserPool:
+    """Warm, logged-in contexts per app, each parked on the app's workspace URL between jobs.
+
+    A context is recycled after max_jobs jobs, once its page's JS heap passes max_heap_mb, or when the whole
+    browser's RSS passes POOL_MAX_RSS_MB.
+    """
+
+    def __init__(self, sb: SharedBrowser, apps: List[AppConfig], size: Optional[int] = None,
+                 max_jobs: Optional[int] = None, max_heap_mb: Optional[float] = None):
+        self.sb = sb
+        self.apps = {cfg.name: cfg for cfg in apps}
+        self.size = int(os.getenv("POOL_SIZE", "2")) if size is None else size
+        self.max_jobs = int(os.getenv("POOL_MAX_JOBS", "25")) if max_jobs is None else max_jobs
+        self.max_heap_mb = float(os.getenv("POOL_MAX_HEAP_MB", "512")) if max_heap_mb is None else max_heap_mb
+        # Whole browser (all contexts); 0 disables the check
+        self.max_rss_mb = float(os.getenv("POOL_MAX_RSS_MB", "0"))
+        self._idle: Dict[str, asyncio.Queue] = {name: asyncio.Queue() for name in self.apps}
+        self._busy: Dict[str, int] = {name: 0 for name in self.apps}
+        self._warming: Dict[str, int] = {name: 0 for name in self.apps}
+        self._refills: set = set()
+        self.acquire_timeout_s = float(os.getenv("POOL_ACQUIRE_TIMEOUT_S", "120"))
+        self.stats = {name: {"jobs": 0, "recycled": 0, "failed_warmups": 0} for name in self.apps}
+        self.started = time.time()
+
+    async def start(self):
+        for cfg in self.apps.values():
+            await self.sb.ensure_session(cfg)
+        await asyncio.gather(*(self._add(cfg) for cfg in self.apps.values() for _ in range(self.size)))
+        logger.info(f"Browser pool ready: {self.size} warm contexts for {', '.join(self.apps)}")
+
+    async def _warm(self, cfg: AppConfig) -> PooledContext:
+        context = await self.sb.new_context(cfg)
+        page = await context.new_page()
+        page.set_default_navigation_timeout(self.sb.navigation_timeout_ms)
+        await page.goto(cfg.workspace_url or cfg.base_url, wait_until="domcontentloaded")
+        return PooledContext(cfg, context, page)
+
+    async def _add(self, cfg: AppConfig):
+        self._warming[cfg.name] += 1
+        try:
+            self._idle[cfg.name].put_nowait(await self._warm(cfg))
+        except Exception as e:
+            self.stats[cfg.name]["failed_warmups"] += 1
+            logger.warning(f"Could not warm a {cfg.name} context: {e}")
+        finally:
+            self._warming[cfg.name] -= 1
+
+    def _refill(self, cfg: AppConfig):
+        task = asyncio.ensure_future(self._add(cfg))
+        self._refills.add(task)
+        task.add_done_callback(self._refills.discard)
+
+    async def acquire(self, app: str) -> PooledContext:
+        if app not in self.apps:
+            raise KeyError(f"App not in pool: {app}")
+        queue = self._idle[app]
+        if queue.empty() and self._busy[app] + self._warming[app] < self.size:
+            # A failed warm-up or recycle left the app short; top it back up
+            self._refill(self.apps[app])
+        pc = await asyncio.wait_for(queue.get(), self.acquire_timeout_s)
+        self._busy[app] += 1
+        return pc
+
+    async def _heap_mb(self, pc: PooledContext) -> float:
+        cdp = await pc.context.new_cdp_session(pc.page)
+        try:
+            await cdp.send("Performance.enable")
+            metrics = await cdp.send("Performance.getMetrics")
+        finally:
+            await cdp.detach()
+        used = next((m["value"] for m in metrics.get("metrics", []) if m["name"] == "JSHeapUsedSize"), 0)
+        return used / (1024 * 1024)
+
+    async def release(self, pc: PooledContext, healthy: bool = True):
+        app = pc.cfg.name
+        pc.jobs += 1
+        self.stats[app]["jobs"] += 1
+        reason = None
+        if not healthy or pc.page.is_closed():
+            reason = "unhealthy"
+        elif pc.jobs >= self.max_jobs:
+            reason = f"{pc.jobs} jobs"
+        else:
+            try:
+                heap = await self._heap_mb(pc)
+                if heap > self.max_heap_mb:
+                    reason = f"JS heap {heap:.0f} MB"
+            except Exception:
+                pass
+            rss = process_tree_rss_mb() if self.max_rss_mb else None
+            if reason is None and rss and rss > self.max_rss_mb:
+                reason = f"browser RSS {rss:.0f} MB"
+
+        if reason is None:
+            try:
+                # Park it on the workspace again so the next job starts from a loaded app
+                await pc.page.goto(pc.cfg.workspace_url or pc.cfg.base_url, wait_until="domcontentloaded")
+                self._busy[app] -= 1
+                self._idle[app].put_nowait(pc)
+                return
+            except Exception as e:
+                reason = f"reset failed: {e}"
+        logger.info(f"Recycling {app} context ({reason})")
+        self.stats[app]["recycled"] += 1
+        try:
+            await pc.context.close()
+        except Exception:
+            pass
+        self._busy[app] -= 1
+        self._refill(pc.cfg)
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "uptime_s": round(time.time() - self.started),
+            "rss_mb": process_tree_rss_mb(),
+            "apps": {
+                name: {"idle": self._idle[name].qsize(), "busy": self._busy[name], "warming": self._warming[name], **self.stats[name]}
+                for name in self.apps
+            },
+        }
+
+    async def close(self):
+        for task in list(self._refills):
+            task.cancel()
+        for queue in self._idle.values():
+            while not queue.empty():
+                try:
+                    await queue.get_nowait().context.close()
+                except Exception:
+                    pass
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+from loguru import logger
+
+from src.agent.browser_pool import BrowserPool
+from src.agent.task_planner import TaskPlanner
+from src.agent.workflow_runner import run_workflow
+from src.capture.frame_writer import FrameWriter
+
+REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+
+class CaptureServer:
+    """Tiny JSON-over-HTTP front end (TCP or Unix socket) that runs capture jobs on warm pool contexts.
+
+    POST /jobs {"app", "task", "max_steps"?, "wait"?} -> {"id"} (202) or the finished job when "wait" is true
+    GET  /jobs/<id>                                   -> {"status": queued|running|done|failed, "result"?, "error"?}
+    GET  /health                                      -> pool and job counters
+    """
+
+    def __init__(self, pool: BrowserPool, out_root: str, max_steps: int, planner: Optional[TaskPlanner] = None,
+                 writer: Optional[FrameWriter] = None):
+        self.pool = pool
+        self.out_root = out_root
+        self.max_steps = max_steps
+        self.planner = planner or TaskPlanner()
+        self.writer = writer or FrameWriter.from_env()
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.keep_jobs = int(os.getenv("SERVE_KEEP_JOBS", "1000"))
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def submit(self, job: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex[:12]
+        self.jobs[job_id] = {"id": job_id, "status": "queued", "app": job["app"], "task": job["task"], "submitted": time.time()}
+        self._tasks[job_id] = asyncio.ensure_future(self._run(job_id, job))
+        self._prune()
+        return job_id
+
+    def _prune(self):
+        finished = [j for j in self.jobs.values() if j["status"] in ("done", "failed")]
+        for j in sorted(finished, key=lambda j: j["submitted"])[:max(0, len(self.jobs) - self.keep_jobs)]:
+            del self.jobs[j["id"]]
+
+    async def _run(self, job_id: str, job: Dict[str, Any]):
+        record = self.jobs[job_id]
+        try:
+            pc = await self.pool.acquire(job["app"])
+        except Exception as e:
+            record.update(status="failed", error=f"No browser context available: {e!r}")
+            self._tasks.pop(job_id, None)
+            return
+        record.update(status="running", started=time.time())
+        healthy = True
+        try:
+            result = await run_workflow(pc.page, pc.cfg, job["task"], self.out_root,
+                                        int(job.get("max_steps", self.max_steps)), planner=self.planner, writer=self.writer)
+            record.update(status="done", result=result)
+        except Exception as e:
+            healthy = False
+            logger.warning(f"Job {job_id} failed: {e}")
+            record.update(status="failed", error=str(e))
+        finally:
+            record["finished"] = time.time()
+            self._tasks.pop(job_id, None)
+            await self.pool.release(pc, healthy=healthy)
+
+    def health(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for j in self.jobs.values():
+            counts[j["status"]] = counts.get(j["status"], 0) + 1
+        return {"pool": self.pool.health(), "jobs": counts, "network": self.pool.sb.network_stats(),
+                "plan_cache": dict(self.planner.ai.cache.stats)}
+
+    async def _route(self, method: str, path: str, body: bytes) -> Tuple[int, Any]:
+        if path == "/health":
+            return 200, self.health()
+        if path == "/jobs" and method == "POST":
+            try:
+                job = json.loads(body or b"{}")
+            except ValueError:
+                return 400, {"error": "body must be JSON"}
+            if not isinstance(job, dict) or not job.get("task") or job.get("app") not in self.pool.apps:
+                return 400, {"error": f"need task and app in {sorted(self.pool.apps)}"}
+            job_id = self.submit(job)
+            if job.get("wait"):
+                task = self._tasks.get(job_id)
+                if task:
+                    # A client disconnecting must not cancel the job itself
+                    await asyncio.shield(task)
+                return 200, self.jobs[job_id]
+            return 202, {"id": job_id}
+        if path == "/jobs" and method == "GET":
+            return 200, list(self.jobs.values())
+        if path.startswith("/jobs/"):
+            job = self.jobs.get(path[len("/jobs/"):])
+            return (200, job) if job else (404, {"error": "unknown job"})
+        return 404, {"error": "not found"}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            if len(request_line) < 2:
+                return
+            method, path = request_line[0].upper(), request_line[1].split("?", 1)[0]
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", "0") or 0))
+            try:
+                status, payload = await self._route(method, path, body)
+            except Exception as e:
+                logger.warning(f"Request {method} {path} failed: {e}")
+                status, payload = 500, {"error": str(e)}
+            data = json.dumps(payload, default=str).encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("latin-1") + data
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765, socket_path: Optional[str] = None):
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            self._server = await asyncio.start_unix_server(self._handle, path=socket_path)
+            logger.info(f"Capture server listening on unix:{socket_path}")
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port)
+            logger.info(f"Capture server listening on http://{host}:{port}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+        for task in list(self._tasks.values()):
+            task.cancel()
+        self.planner.cancel_prefetch()
+        await self.writer.close()
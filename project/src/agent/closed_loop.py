@@ -0,0 +1,198 @@
+import json
+import os
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from playwright.async_api import Page
+
+from src.agent.selector_memory import url_pattern
+from src.utils import tracing
+
+# Interactive elements with their computed role and accessible name, in document order.
+# Inside an open modal dialog only the dialog's elements are listed: nothing behind it is clickable.
+OBSERVE_JS = """
+(limit) => {
+  const IMPLICIT = { A: 'link', BUTTON: 'button', TEXTAREA: 'textbox', SELECT: 'combobox', SUMMARY: 'button' };
+  const INPUT_ROLES = { checkbox: 'checkbox', radio: 'radio', button: 'button', submit: 'button', reset: 'button', search: 'searchbox', range: 'slider' };
+  const INTERACTIVE = new Set(['button', 'link', 'textbox', 'searchbox', 'combobox', 'checkbox', 'radio', 'switch', 'tab',
+    'menuitem', 'menuitemcheckbox', 'menuitemradio', 'option', 'treeitem', 'slider', 'spinbutton']);
+  const REGION = 'section[aria-label], nav[aria-label], aside[aria-label], [role="region"][aria-label], [role="navigation"][aria-label], [role="menu"][aria-label], [role="dialog"][aria-label]';
+  const W = window.innerWidth, H = window.innerHeight;
+  const shown = (el) => {
+    if (el.closest('[hidden], [aria-hidden="true"], [inert]')) return null;
+    const r = el.getBoundingClientRect();
+    return r.width > 0 && r.height > 0 ? r : null;
+  };
+  const clip = (s) => (s || '').replace(/\\s+/g, ' ').trim().slice(0, 60);
+  const nameOf = (el) => {
+    const labelledby = el.getAttribute('aria-labelledby');
+    if (labelledby) {
+      const text = labelledby.split(/\\s+/).map((id) => document.getElementById(id)?.innerText || '').join(' ');
+      if (clip(text)) return clip(text);
+    }
+    return clip(el.getAttribute('aria-label')) || clip(el.labels && el.labels[0] && el.labels[0].innerText)
+      || clip(el.tagName === 'INPUT' || el.tagName === 'TEXTAREA' ? '' : el.innerText)
+      || clip(el.getAttribute('placeholder')) || clip(el.getAttribute('title'))
+      || clip(el.querySelector && el.querySelector('img[alt]')?.getAttribute('alt'))
+      || clip(el.tagName === 'INPUT' && ['button', 'submit', 'reset'].includes(el.type) ? el.value : '');
+  };
+  const dialogs = [...document.querySelectorAll('[role="dialog"][aria-modal="true"], [role="alertdialog"], dialog[open]')].filter(shown);
+  const scope = dialogs.length ? dialogs[dialogs.length - 1] : document.body || document.documentElement;
+  const nodes = [];
+  let more = 0;
+  for (const el of scope.querySelectorAll('a[href], button, input, textarea, select, summary, [role], [contenteditable="true"]')) {
+    let role = el.getAttribute('role') || IMPLICIT[el.tagName] || (el.isContentEditable ? 'textbox' : null);
+    if (el.tagName === 'INPUT') {
+      if (el.type === 'hidden') continue;
+      role = el.getAttribute('role') || INPUT_ROLES[el.type] || 'textbox';
+    }
+    if (!INTERACTIVE.has(role) || el.disabled || el.getAttribute('aria-disabled') === 'true') continue;
+    const r = shown(el);
+    if (!r) continue;
+    if (nodes.length >= limit) { more++; continue; }
+    const node = { role, name: nameOf(el) };
+    const region = el.parentElement && el.parentElement.closest(REGION);
+    if (region && region !== scope) node.region = clip(region.getAttribute('aria-label'));
+    if (role === 'textbox' || role === 'searchbox' || role === 'combobox') {
+      const v = clip(el.value !== undefined ? el.value : el.innerText);
+      if (v) node.value = v;
+    }
+    const state = [];
+    if (el.getAttribute('aria-expanded') === 'true') state.push('expanded');
+    if (el.checked || el.getAttribute('aria-checked') === 'true') state.push('checked');
+    if (el.getAttribute('aria-selected') === 'true' || el.getAttribute('aria-current')) state.push('selected');
+    if (document.activeElement === el) state.push('focused');
+    if (state.length) node.state = state;
+    if (r.bottom < 0 || r.top > H || r.right < 0 || r.left > W) node.offscreen = true;
+    nodes.push(node);
+  }
+  return {
+    url: location.href,
+    title: document.title,
+    dialog: dialogs.length ? clip(scope.getAttribute('aria-label') || scope.querySelector('h1, h2, h3')?.innerText) || 'dialog' : null,
+    nodes,
+    more,
+  };
+}
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English/JSON; good enough for budgeting without a tokenizer
+    return (len(text) + 3) // 4
+
+
+def node_line(node: Dict[str, Any]) -> str:
+    line = f'{node["role"]} "{node.get("name") or ""}"'
+    if node.get("region"):
+        line += f' @{node["region"]}'
+    if node.get("value"):
+        line += f' value="{node["value"]}"'
+    if node.get("state"):
+        line += f' [{",".join(node["state"])}]'
+    if node.get("offscreen"):
+        line += " (scroll)"
+    return line
+
+
+class Observer:
+    """Compact observations for the closed-loop planner.
+
+    The first observation (and any after the URL pattern changes or a reset) lists every interactive element;
+    the rest only list the lines added (+) and removed (-) since the previous one. Either way the text is cut to
+    fit token_budget, keeping on-screen elements and additions first.
+    """
+
+    def __init__(self, token_budget: Optional[int] = None, max_nodes: int = 400):
+        self.token_budget = int(os.getenv("OBSERVE_TOKEN_BUDGET", "800")) if token_budget is None else token_budget
+        self.max_nodes = max_nodes
+        self._prev: Optional[Counter] = None
+        self._prev_url: Optional[str] = None
+
+    def reset(self):
+        self._prev = None
+
+    async def observe(self, page: Page) -> Dict[str, Any]:
+        with tracing.span("evaluate", fn="observe"):
+            snap = await page.evaluate(OBSERVE_JS, self.max_nodes)
+        return self.render(snap)
+
+    def render(self, snap: Dict[str, Any]) -> Dict[str, Any]:
+        nodes = snap.get("nodes") or []
+        # On-screen elements first so a tight budget drops what would need scrolling anyway
+        lines = [node_line(n) for n in sorted(nodes, key=lambda n: bool(n.get("offscreen")))]
+        current = Counter(lines)
+        full = self._prev is None or url_pattern(snap.get("url") or "") != url_pattern(self._prev_url or "")
+        header = [f"URL: {snap.get('url')}", f"Title: {snap.get('title')}"]
+        if snap.get("dialog"):
+            header.append(f'Modal dialog open: "{snap["dialog"]}" (only its elements are listed)')
+        if full:
+            body = lines
+        else:
+            added = list((current - self._prev).elements())
+            removed = list((self._prev - current).elements())
+            body = [f"+ {l}" for l in added] + [f"- {l}" for l in removed]
+            if not body:
+                body = ["(no change in interactive elements)"]
+        self._prev, self._prev_url = current, snap.get("url")
+
+        budget = self.token_budget - estimate_tokens("\n".join(header)) - 8
+        kept: List[str] = []
+        used = 0
+        for line in body:
+            cost = estimate_tokens(line) + 1
+            if used + cost > budget:
+                break
+            kept.append(line)
+            used += cost
+        dropped = len(body) - len(kept) + int(snap.get("more") or 0)
+        if dropped:
+            kept.append(f"... {dropped} more not shown")
+        text = "\n".join(header + [("Interactive elements:" if full else "Changes since last observation:")] + kept)
+        return {"text": text, "full": full, "nodes": len(nodes), "tokens": estimate_tokens(text), "url": snap.get("url")}
+
+
+class Dialogue:
+    """Running message history for one closed-loop workflow: observations from us, one step per reply.
+
+    Once the history passes max_tokens it is restarted from a summary of the steps taken so far, and the
+    caller should send a full observation next.
+    """
+
+    def __init__(self, app: str, task: str, max_tokens: Optional[int] = None):
+        self.app = app
+        self.task = task
+        self.max_tokens = int(os.getenv("CLOSED_LOOP_HISTORY_TOKENS", "6000")) if max_tokens is None else max_tokens
+        self.messages: List[Dict[str, str]] = []
+        self.taken: List[str] = []
+        self.tokens = 0
+
+    @property
+    def needs_full(self) -> bool:
+        return not self.messages
+
+    def observe(self, observation: Dict[str, Any], outcome: Optional[str] = None) -> int:
+        """Add the next user turn; returns its estimated size in tokens."""
+        parts = []
+        if not self.messages:
+            parts.append(f"App: {self.app}\nTask: {self.task}")
+            if self.taken:
+                parts.append("Steps already taken:\n" + "\n".join(self.taken))
+        if outcome:
+            parts.append(f"Last action: {outcome}")
+        parts.append(observation["text"])
+        content = "\n\n".join(parts)
+        self.messages.append({"role": "user", "content": content})
+        cost = estimate_tokens(content)
+        self.tokens += cost
+        return cost
+
+    def reply(self, step: Dict[str, Any]):
+        content = json.dumps({"done": True} if step.get("done") else {"step": step})
+        self.messages.append({"role": "assistant", "content": content})
+        self.tokens += estimate_tokens(content)
+        if not step.get("done"):
+            self.taken.append(f"{len(self.taken) + 1}. {step.get('action')} {json.dumps(step.get('selector') or {})} {step.get('input') or ''}".rstrip())
+
+    def trim(self):
+        if self.tokens > self.max_tokens:
+            self.messages, self.tokens = [], 0
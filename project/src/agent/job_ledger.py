@@ -0,0 +1,285 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+from loguru import logger
+
+from src.agent.task_planner import TaskPlanner
+from src.agent.workflow_runner import run_workflow
+from src.capture.frame_writer import FrameWriter
+from src.config.app_configs import APPS, AppConfig
+from src.utils.browser_helpers import SharedBrowser
+from src.utils.session_manager import SessionManager
+
+LEDGER_NAME = "jobs.sqlite"
+STATES = ("pending", "running", "done", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    app TEXT NOT NULL,
+    task TEXT NOT NULL,
+    max_steps INTEGER,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    next_at REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_until REAL,
+    last_error TEXT,
+    result TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    UNIQUE (app, task)
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs(state, next_at);
+CREATE TABLE IF NOT EXISTS starts (
+    domain TEXT NOT NULL,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS starts_domain ON starts(domain, ts);
+"""
+
+
+def domain_of(cfg: AppConfig) -> str:
+    host = urlparse(cfg.base_url).hostname or cfg.name
+    return host[4:] if host.startswith("www.") else host
+
+
+class JobLedger:
+    """SQLite ledger of (app, task) jobs shared by any number of worker processes.
+
+    Jobs move pending -> running (leased) -> done, or back to pending with exponential backoff until
+    max_attempts, then failed. A claim runs in one IMMEDIATE transaction, so per-domain concurrency and
+    start-rate caps hold across processes; a lease that is not renewed (crashed worker) returns its job to pending.
+    """
+
+    def __init__(self, path: Optional[str] = None, lease_s: Optional[float] = None):
+        self.path = Path(path or os.getenv("LEDGER_PATH", LEDGER_NAME))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lease_s = float(os.getenv("LEDGER_LEASE_S", "120")) if lease_s is None else lease_s
+        self.backoff_s = float(os.getenv("LEDGER_BACKOFF_S", "30"))
+        self.backoff_max_s = float(os.getenv("LEDGER_BACKOFF_MAX_S", "900"))
+        # Manual transactions: claim() needs BEGIN IMMEDIATE to serialize against other processes
+        self.conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def add(self, jobs: List[Dict[str, Any]], max_attempts: Optional[int] = None) -> int:
+        """Queue jobs; an (app, task) already in the ledger is left as is, so done jobs are never re-run."""
+        max_attempts = int(os.getenv("LEDGER_MAX_ATTEMPTS", "3")) if max_attempts is None else max_attempts
+        now = time.time()
+        cur = self.conn.executemany(
+            "INSERT OR IGNORE INTO jobs (app, task, max_steps, max_attempts, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+            [(j["app"], j["task"], j.get("max_steps"), max_attempts, now, now) for j in jobs],
+        )
+        return cur.rowcount
+
+    def retry_failed(self, app: Optional[str] = None) -> int:
+        sql = "UPDATE jobs SET state = 'pending', attempts = 0, next_at = 0, updated = ? WHERE state = 'failed'"
+        params: List[Any] = [time.time()]
+        if app:
+            sql += " AND app = ?"
+            params.append(app)
+        return self.conn.execute(sql, params).rowcount
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        out: Dict[str, Dict[str, int]] = {}
+        for row in self.conn.execute("SELECT app, state, COUNT(*) AS n FROM jobs GROUP BY app, state"):
+            out.setdefault(row["app"], {s: 0 for s in STATES})[row["state"]] = row["n"]
+        return out
+
+    @staticmethod
+    def _caps() -> Dict[str, Tuple[int, float]]:
+        """Per domain: (max concurrent jobs, max starts per minute); apps sharing a domain share the tightest cap."""
+        tighter = lambda a, b: min(a, b) if a and b else a or b  # 0 means uncapped
+        caps: Dict[str, Tuple[int, float]] = {}
+        for cfg in APPS.values():
+            conc, rate = caps.get(domain_of(cfg), (0, 0))
+            caps[domain_of(cfg)] = (tighter(conc, cfg.max_concurrency), tighter(rate, cfg.starts_per_min))
+        return caps
+
+    def claim(self, owner: str) -> Tuple[Optional[Dict[str, Any]], Optional[float]]:
+        """Lease the next runnable job. Returns (job, None), or (None, seconds to wait); (None, None) means no work is left."""
+        now = time.time()
+        caps = self._caps()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Leases nobody renewed: the worker died mid-job
+            self.conn.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END, "
+                "lease_owner = NULL, last_error = 'lease expired', updated = ? WHERE state = 'running' AND lease_until < ?",
+                (now, now),
+            )
+            self.conn.execute("DELETE FROM starts WHERE ts < ?", (now - 60,))
+            running: Dict[str, int] = {}
+            for row in self.conn.execute("SELECT app, COUNT(*) AS n FROM jobs WHERE state = 'running' GROUP BY app"):
+                d = domain_of(APPS[row["app"]]) if row["app"] in APPS else row["app"]
+                running[d] = running.get(d, 0) + row["n"]
+            started = {row["domain"]: (row["n"], row["first"]) for row in
+                       self.conn.execute("SELECT domain, COUNT(*) AS n, MIN(ts) AS first FROM starts GROUP BY domain")}
+
+            wait: Optional[float] = None
+            blocked: set = set()
+            for row in self.conn.execute("SELECT * FROM jobs WHERE state = 'pending' ORDER BY next_at, id").fetchall():
+                if row["next_at"] > now:
+                    wait = min(wait, row["next_at"] - now) if wait is not None else row["next_at"] - now
+                    break
+                cfg = APPS.get(row["app"])
+                d = domain_of(cfg) if cfg else row["app"]
+                if d in blocked:
+                    continue
+                conc, rate = caps.get(d, (0, 0))
+                n_started, first = started.get(d, (0, now))
+                if conc and running.get(d, 0) >= conc:
+                    blocked.add(d)
+                    continue
+                if rate and n_started >= rate:
+                    # Sliding one-minute window: the oldest start ages out first
+                    blocked.add(d)
+                    hint = first + 60 - now
+                    wait = min(wait, hint) if wait is not None else hint
+                    continue
+                self.conn.execute(
+                    "UPDATE jobs SET state = 'running', attempts = attempts + 1, lease_owner = ?, lease_until = ?, updated = ? WHERE id = ?",
+                    (owner, now + self.lease_s, now, row["id"]),
+                )
+                self.conn.execute("INSERT INTO starts (domain, ts) VALUES (?, ?)", (d, now))
+                self.conn.execute("COMMIT")
+                return {**dict(row), "attempts": row["attempts"] + 1}, None
+
+            if wait is None:
+                live = self.conn.execute("SELECT COUNT(*) FROM jobs WHERE state IN ('pending', 'running')").fetchone()[0]
+                # Running jobs elsewhere may still fail back to pending; keep polling until they settle
+                wait = 1.0 if live else None
+            self.conn.execute("COMMIT")
+            return None, wait
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def renew(self, job_id: int, owner: str) -> bool:
+        cur = self.conn.execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND state = 'running' AND lease_owner = ?",
+            (time.time() + self.lease_s, job_id, owner),
+        )
+        return cur.rowcount == 1
+
+    def complete(self, job_id: int, owner: str, result: Dict[str, Any]):
+        self.conn.execute(
+            "UPDATE jobs SET state = 'done', lease_owner = NULL, lease_until = NULL, last_error = NULL, result = ?, updated = ? "
+            "WHERE id = ? AND lease_owner = ?",
+            (json.dumps(result, default=str), time.time(), job_id, owner),
+        )
+
+    def fail(self, job_id: int, owner: str, error: str):
+        row = self.conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        now = time.time()
+        if row and row["attempts"] < row["max_attempts"]:
+            delay = min(self.backoff_max_s, self.backoff_s * 2 ** (row["attempts"] - 1)) * random.uniform(1.0, 1.25)
+            state, next_at = "pending", now + delay
+            logger.info(f"Job {job_id} failed (attempt {row['attempts']}/{row['max_attempts']}); retrying in {delay:.0f}s")
+        else:
+            state, next_at = "failed", now
+        self.conn.execute(
+            "UPDATE jobs SET state = ?, next_at = ?, lease_owner = NULL, lease_until = NULL, last_error = ?, updated = ? "
+            "WHERE id = ? AND lease_owner = ?",
+            (state, next_at, error, now, job_id, owner),
+        )
+
+
+async def work(ledger_path: str, out_root: str, headless: bool, profile: str, max_steps: int, slots: int,
+               manual_login: bool = False) -> Dict[str, int]:
+    """One worker: a browser with `slots` concurrent contexts, each pulling the next runnable job from the ledger."""
+    ledger = JobLedger(ledger_path)
+    planner = TaskPlanner()
+    writer = FrameWriter.from_env()
+    stats = {"done": 0, "failed": 0}
+    async with SharedBrowser(headless=headless, profile=profile, sessions=SessionManager()) as sb:
+
+        async def heartbeat(job_id: int, owner: str):
+            while True:
+                await asyncio.sleep(ledger.lease_s / 3)
+                ledger.renew(job_id, owner)
+
+        async def slot(n: int):
+            owner = f"{os.getpid()}-{n}-{uuid.uuid4().hex[:6]}"
+            while True:
+                job, wait = ledger.claim(owner)
+                if job is None:
+                    if wait is None:
+                        return
+                    await asyncio.sleep(min(wait, 5.0))
+                    continue
+                cfg = APPS[job["app"]]
+                logger.info(f"[{owner}] {cfg.name}: {job['task']} (attempt {job['attempts']}/{job['max_attempts']})")
+                beat = asyncio.ensure_future(heartbeat(job["id"], owner))
+                context = None
+                try:
+                    await sb.ensure_session(cfg, manual=manual_login)
+                    context = await sb.new_context(cfg)
+                    page = await context.new_page()
+                    page.set_default_navigation_timeout(sb.navigation_timeout_ms)
+                    result = await run_workflow(page, cfg, job["task"], out_root, job["max_steps"] or max_steps,
+                                                planner=planner, writer=writer)
+                    if not result["steps"] or result["errors"] >= result["steps"]:
+                        # Nothing usable was recorded (empty plan, or every step errored): retry with backoff
+                        error = "no steps recorded" if not result["steps"] else f"all {result['steps']} steps failed"
+                        logger.warning(f"[{owner}] {cfg.name}: {job['task']} failed: {error}")
+                        ledger.fail(job["id"], owner, error)
+                        stats["failed"] += 1
+                    else:
+                        ledger.complete(job["id"], owner, result)
+                        stats["done"] += 1
+                except Exception as e:
+                    logger.warning(f"[{owner}] {cfg.name}: {job['task']} failed: {e}")
+                    ledger.fail(job["id"], owner, str(e))
+                    stats["failed"] += 1
+                finally:
+                    beat.cancel()
+                    if context:
+                        try:
+                            await context.close()
+                        except Exception:
+                            pass
+
+        try:
+            await asyncio.gather(*(slot(n) for n in range(max(1, slots))))
+        finally:
+            planner.cancel_prefetch()
+            await writer.close()
+            ledger.close()
+    return stats
+
+
+def _worker_main(*args):
+    stats = asyncio.run(work(*args))
+    logger.info(f"Worker {os.getpid()} finished: {stats}")
+
+
+def run_workers(ledger_path: str, out_root: str, headless: bool, profile: str, max_steps: int, workers: int,
+                slots: int, manual_login: bool = False):
+    """Start `workers` processes, each with its own browser; they share nothing but the ledger file."""
+    if workers <= 1:
+        _worker_main(ledger_path, out_root, headless, profile, max_steps, slots, manual_login)
+        return
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_worker_main, args=(ledger_path, out_root, headless, profile, max_steps, slots, manual_login),
+                         name=f"capture-worker-{n}") for n in range(workers)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+        if p.exitcode:
+            logger.warning(f"{p.name} exited with code {p.exitcode}; its leased jobs return to pending when the lease expires")
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from loguru import logger
+from playwright.async_api import Locator
+
+Spec = Dict[str, Any]
+
+CLICKABLE = "button, a, [role=button], [role=link], [role=menuitem], [role=tab], [role=option], [role=treeitem]"
+
+
+def _css_string(value: str) -> str:
+    # ensure_ascii would write "é" as \u00e9, which CSS reads as the letters "u00e9"
+    return json.dumps(value, ensure_ascii=False)
+
+
+def candidate_specs(selector: Optional[Dict[str, Any]], primary: Optional[Spec], action: Optional[str] = None) -> List[Spec]:
+    """Several plausible concrete locators for one planner selector, primary strategy first.
+
+    For "type" only fillable candidates are generated so a same-named button can never win the race.
+    """
+    specs: List[Spec] = [primary] if primary else []
+    if not selector:
+        return specs
+    text = selector.get("text") or selector.get("name") or selector.get("label") or selector.get("placeholder")
+    if not text and selector.get("name_regex"):
+        specs.append({"kind": "text", "value_regex": selector["name_regex"]})
+    role = selector.get("role")
+    if text and action == "type":
+        specs += [
+            {"kind": "label", "value": text},
+            {"kind": "placeholder", "value": text},
+            {"kind": "css", "value": f":is(input, textarea, [contenteditable=true])[aria-label={_css_string(text)} i]"},
+        ]
+        specs += [{"kind": "role", "role": r, "name": text} for r in ((role,) if role else ("textbox", "searchbox", "combobox"))]
+    elif text:
+        specs += [
+            {"kind": "text", "value": text, "exact": True},
+            {"kind": "role", "role": role or "button", "name": text, "exact": True},
+            {"kind": "text", "value_regex": rf"^\s*{re.escape(text)}\s*$"},
+            {"kind": "label", "value": text},
+            # Nearby-text heuristics: clickable ancestor of the text, or icon buttons carrying it as aria-label/title
+            {"kind": "css", "value": f":is({CLICKABLE}):has-text({_css_string(text)})"},
+            {"kind": "css", "value": f"[aria-label={_css_string(text)} i], [title={_css_string(text)} i]"},
+        ]
+        if not role:
+            specs += [{"kind": "role", "role": r, "name": text, "exact": True} for r in ("link", "menuitem", "tab")]
+    deduped, seen = [], set()
+    for spec in specs:
+        key = json.dumps(spec, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            deduped.append(spec)
+    return deduped
+
+
+async def _probe(spec: Spec, loc: Locator, timeout_ms: int) -> Tuple[Spec, int]:
+    # Hidden duplicates (closed menus, off-canvas copies) must not make a visible unique target lose
+    visible = loc.locator("visible=true")
+    await visible.first.wait_for(state="visible", timeout=timeout_ms)
+    if not await visible.first.is_enabled():
+        raise ValueError("disabled")
+    return spec, await visible.count()
+
+
+async def race(specs: List[Spec], build: Callable[[Spec], Locator], timeout_ms: int = 3000) -> Optional[Tuple[Spec, Locator]]:
+    """Probe all candidates concurrently; the first visible, enabled, unique match wins and the rest are cancelled.
+
+    If nothing matches uniquely, the candidate with the fewest visible matches is used (its first match).
+    Worst case is one timeout_ms, not the sum of each strategy's timeouts.
+    """
+    if not specs:
+        return None
+    tasks = {asyncio.ensure_future(_probe(spec, build(spec), timeout_ms)): i for i, spec in enumerate(specs)}
+    pending = set(tasks)
+    ambiguous: List[Tuple[int, int, Spec]] = []
+    winner: Optional[Spec] = None
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # Several may finish in the same tick; prefer the earlier candidate
+            for task in sorted(done, key=lambda t: tasks[t]):
+                if task.cancelled() or task.exception() is not None:
+                    continue
+                spec, count = task.result()
+                if count == 1:
+                    winner = {**spec, "visible": True}
+                    break
+                ambiguous.append((count, tasks[task], spec))
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+    if winner is None and ambiguous:
+        count, _, spec = min(ambiguous, key=lambda a: (a[0], a[1]))
+        logger.info(f"No unique locator; using first of {count} matches for {spec}")
+        winner = {**spec, "visible": True, "nth": 0}
+    if winner is None:
+        return None
+    return winner, build(winner).first
@@ -0,0 +1,127 @@
+from typing import Any, Dict, Optional, Union
+from playwright.async_api import BrowserContext, Locator, Page
+from src.utils import tracing
+
+# Attributes that churn without a meaningful UI change (animations, progress, focus rings)
+VOLATILE_ATTRS = ["style", "aria-valuenow", "aria-valuetext", "aria-busy", "data-focus-visible-added", "data-timestamp"]
+
+MODAL_SELECTOR = '[role="dialog"], .modal, [class*="Dialog"], [data-modal="true"]'
+OVERLAY_SELECTOR = '[class*="overlay"], [class*="Popover"], [class*="dropdown"]'
+# Redacted by the post-processing stage, together with any visible text that looks like an email address
+SENSITIVE_SELECTOR = ('input[type="email"], input[type="password"], input[autocomplete*="email"], '
+                      'img[class*="avatar" i], [class*="avatar" i], [data-testid*="avatar" i], img[alt*="avatar" i]')
+
+# Installed as an init script on every document; keeps a mutation counter and an
+# order-sensitive FNV-1a hash of structural changes so callers never need page.content().
+TRACKER_JS = """
+(() => {
+  if (window.__wfTracker) return;
+  const VOLATILE = new Set(%s);
+  const t = { count: 0, hash: 2166136261, target: null, lastChange: performance.now(), lastNet: 0, pending: new Map(), nextId: 0 };
+  const mix = (s) => {
+    for (let i = 0; i < s.length; i++) {
+      t.hash ^= s.charCodeAt(i);
+      t.hash = Math.imul(t.hash, 16777619) >>> 0;
+    }
+  };
+  new MutationObserver((records) => {
+    for (const r of records) {
+      if (r.type === 'attributes' && VOLATILE.has(r.attributeName)) continue;
+      t.count++;
+      t.lastChange = performance.now();
+      mix(r.type + '|' + (r.target.nodeName || '') + '|' + (r.attributeName || '') + '|' + r.addedNodes.length + '|' + r.removedNodes.length);
+    }
+  }).observe(document, { subtree: true, childList: true, attributes: true, characterData: true });
+  // In-flight fetch/XHR bookkeeping for the settle engine
+  const begin = () => { const id = t.nextId++; t.pending.set(id, performance.now()); return id; };
+  const end = (id) => { t.pending.delete(id); t.lastNet = performance.now(); };
+  if (window.fetch) {
+    const origFetch = window.fetch;
+    window.fetch = function (...args) {
+      const id = begin();
+      return origFetch.apply(this, args).finally(() => end(id));
+    };
+  }
+  if (window.XMLHttpRequest) {
+    const origSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function (...args) {
+      const id = begin();
+      this.addEventListener('loadend', () => end(id), { once: true });
+      return origSend.apply(this, args);
+    };
+  }
+  window.__wfTracker = t;
+})()
+""" % (str(VOLATILE_ATTRS).replace("'", '"'))
+
+# One round trip: tracker counters, modal/overlay flags, URL and the remembered target's box.
+# Called with an element (via Locator.evaluate) it also remembers that element as the target;
+# called with {sensitive: true} it adds the viewport and the on-screen boxes of sensitive content.
+SNAPSHOT_JS = """
+(el) => {
+  %s;
+  const t = window.__wfTracker;
+  if (el instanceof Element) t.target = el;
+  const opts = el && !(el instanceof Element) ? el : {};
+  const IMPLICIT_ROLES = { A: 'link', BUTTON: 'button', TEXTAREA: 'textbox', SELECT: 'combobox', INPUT: 'textbox', H1: 'heading', H2: 'heading', H3: 'heading', LI: 'listitem' };
+  const box = (n) => {
+    if (!n || !n.isConnected) return null;
+    const r = n.getBoundingClientRect();
+    return { x: r.x, y: r.y, width: r.width, height: r.height };
+  };
+  const W = window.innerWidth, H = window.innerHeight;
+  const onScreen = (r) => r.width > 0 && r.height > 0 && r.x < W && r.y < H && r.x + r.width > 0 && r.y + r.height > 0;
+  const sensitive = () => {
+    const out = [];
+    for (const n of document.querySelectorAll(%r)) {
+      const r = n.getBoundingClientRect();
+      if (onScreen(r)) out.push({ x: r.x, y: r.y, width: r.width, height: r.height, kind: n.tagName === 'INPUT' ? n.type : 'avatar' });
+      if (out.length >= 100) return out;
+    }
+    const EMAIL = /[\\w.+-]+@[\\w-]+\\.[\\w.-]+/;
+    const walker = document.createTreeWalker(document.body || document.documentElement, NodeFilter.SHOW_TEXT);
+    const range = document.createRange();
+    for (let n = walker.nextNode(); n && out.length < 100; n = walker.nextNode()) {
+      if (!n.nodeValue.includes('@') || !EMAIL.test(n.nodeValue)) continue;
+      range.selectNodeContents(n);
+      const r = range.getBoundingClientRect();
+      if (onScreen(r)) out.push({ x: r.x, y: r.y, width: r.width, height: r.height, kind: 'email' });
+    }
+    for (const n of document.querySelectorAll('input, textarea')) {
+      if (out.length >= 100 || !EMAIL.test(n.value || '')) continue;
+      const r = n.getBoundingClientRect();
+      if (onScreen(r)) out.push({ x: r.x, y: r.y, width: r.width, height: r.height, kind: 'email' });
+    }
+    return out;
+  };
+  return {
+    url: location.href,
+    mutations: t.count,
+    hash: t.hash,
+    has_modal: !!document.querySelector(%r),
+    has_overlay: !!document.querySelector(%r),
+    target_box: box(t.target),
+    target_role: t.target && t.target.isConnected ? (t.target.getAttribute('role') || IMPLICIT_ROLES[t.target.tagName] || null) : null,
+    target_name: t.target && t.target.isConnected
+      ? ((t.target.getAttribute('aria-label') || t.target.innerText || t.target.getAttribute('title') || '').trim().split('\\n')[0].slice(0, 80) || null)
+      : null,
+    viewport: opts.sensitive ? { width: W, height: H, dpr: window.devicePixelRatio } : undefined,
+    sensitive: opts.sensitive ? sensitive() : undefined,
+  };
+}
+""" % (TRACKER_JS.strip(), SENSITIVE_SELECTOR, MODAL_SELECTOR, OVERLAY_SELECTOR)
+
+
+async def install_tracker(target: Union[BrowserContext, Page]):
+    await target.add_init_script(TRACKER_JS)
+
+
+async def snapshot(page: Page, target: Optional[Locator] = None, sensitive: bool = False) -> Dict[str, Any]:
+    with tracing.span("evaluate", fn="snapshot"):
+        if target is not None:
+            return await target.evaluate(SNAPSHOT_JS, timeout=3000)
+        return await page.evaluate(SNAPSHOT_JS, {"sensitive": sensitive})
+
+
+def signature(snap: Dict[str, Any]) -> str:
+    return f"{snap.get('hash', 0):08x}-{snap.get('mutations', 0)}"
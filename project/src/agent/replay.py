@@ -0,0 +1,168 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from loguru import logger
+
+from src.agent.batch_runner import run_batch
+from src.agent.selector_memory import url_pattern
+from src.agent.task_planner import TaskPlanner
+from src.capture.delta_frames import frame_bytes
+from src.capture.metadata_handler import task_slug
+from src.capture.visual_diff import thumbnail, tile_scores
+
+REPORT_NAME = "replay_report.json"
+# Fields copied from a recorded step into the replayed plan
+STEP_FIELDS = ("description", "action", "selector", "input", "locator")
+
+
+def load_recordings(out_root: str, app: Optional[str] = None, task_contains: Optional[str] = None) -> List[Dict[str, Any]]:
+    recordings = []
+    for meta_path in sorted(Path(out_root).glob("*/*/metadata.json")):
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable {meta_path}: {e}")
+            continue
+        if app and meta.get("app") != app:
+            continue
+        if task_contains and task_contains.lower() not in (meta.get("task") or "").lower():
+            continue
+        if meta.get("steps"):
+            recordings.append({"path": meta_path, **meta})
+    return recordings
+
+
+def _screenshot_path(shot: Optional[str], meta_path: Path) -> Optional[Path]:
+    if not shot:
+        return None
+    # Older datasets were recorded on Windows
+    path = Path(shot.replace("\\", "/"))
+    if path.exists():
+        return path
+    local = meta_path.parent / path.name
+    return local if local.exists() else None
+
+
+def _thumb(step: Dict[str, Any], meta_path: Path):
+    try:
+        if step.get("delta"):
+            # Delta frames only hold the changed region; compare full frames
+            return thumbnail(frame_bytes(step, meta_path))
+        path = _screenshot_path(step.get("screenshot"), meta_path)
+        return thumbnail(path.read_bytes()) if path else None
+    except Exception:
+        return None
+
+
+class RecordedPlanner(TaskPlanner):
+    """Hands back the recorded steps instead of asking the LLM; waits become settle caps, not sleeps."""
+
+    def __init__(self, recordings: List[Dict[str, Any]], settle_cap_ms: int):
+        super().__init__()
+        self.recordings = {(r["app"], r["task"]): r for r in recordings}
+        self.settle_cap_ms = settle_cap_ms
+        # Steps prepended to a replay (the recording began on an already-open page); used to realign the diff
+        self.offsets: Dict[tuple, int] = {}
+
+    def plan_length(self, app: str, task: str) -> int:
+        """Steps plan() will hand back, counting the goto it prepends."""
+        rec = self.recordings[(app, task)]
+        return len(rec["steps"]) + (rec["steps"][0].get("action") != "goto")
+
+    def plan(self, app: str, task: str, start_url: str) -> Dict[str, Any]:
+        rec = self.recordings[(app, task)]
+        steps = []
+        if rec["steps"][0].get("action") != "goto":
+            steps.append({"description": "Open workspace", "action": "goto", "selector": {"css": start_url}, "wait_ms": self.settle_cap_ms})
+        self.offsets[(app, task)] = len(steps)
+        for s in rec["steps"]:
+            step = {k: s[k] for k in STEP_FIELDS if s.get(k) is not None}
+            step["wait_ms"] = self.settle_cap_ms
+            steps.append(step)
+        return {"steps": steps, "source": "replay"}
+
+    async def aplan(self, app: str, task: str, start_url: str) -> Dict[str, Any]:
+        return self.plan(app, task, start_url)
+
+    def prefetch(self, app: str, task: str, start_url: str):
+        pass
+
+    def mark_failed(self, app: str, plan: Dict[str, Any]):
+        pass
+
+
+def diff_steps(old: List[Dict[str, Any]], new: List[Dict[str, Any]], old_thumbs: Dict[int, Any], new_meta_path: Path,
+               offset: int = 0) -> List[Dict[str, Any]]:
+    new_by_index = {s.get("index") - offset: s for s in new if s.get("index") is not None}
+    rows = []
+    for o in old:
+        i = o.get("index")
+        n = new_by_index.get(i)
+        if n is None:
+            rows.append({"index": i, "description": o.get("description"), "missing": True})
+            continue
+        row: Dict[str, Any] = {"index": i, "description": o.get("description"), "changes": []}
+        if url_pattern(o.get("url") or "") != url_pattern(n.get("url") or ""):
+            row["changes"].append("url")
+            row["url"] = {"old": o.get("url"), "new": n.get("url")}
+        for flag in ("has_modal", "has_overlay"):
+            if bool(o.get(flag)) != bool(n.get(flag)):
+                row["changes"].append(flag)
+                row[flag] = {"old": o.get(flag), "new": n.get(flag)}
+        if bool(o.get("error")) != bool(n.get("error")):
+            row["changes"].append("error")
+            row["error"] = {"old": o.get("error"), "new": n.get("error")}
+        a, b = old_thumbs.get(i), _thumb(n, new_meta_path)
+        if a is not None and b is not None:
+            row["visual_score"] = round(max(tile_scores(a, b)), 4)
+        elif (a is None) != (b is None):
+            row["changes"].append("screenshot")
+        rows.append(row)
+    return rows
+
+
+async def replay(out_root: str, dest: str, app: Optional[str] = None, task_contains: Optional[str] = None,
+                 headless: bool = True, profile: Optional[str] = None, concurrency: int = 4,
+                 visual_threshold: Optional[float] = None) -> Dict[str, Any]:
+    recordings = load_recordings(out_root, app, task_contains)
+    if not recordings:
+        logger.warning(f"No recorded workflows under {out_root} match")
+        return {"workflows": []}
+    visual_threshold = float(os.getenv("SIGNIFICANCE_THRESHOLD", "0.12")) if visual_threshold is None else visual_threshold
+
+    # Old frames are read now: replaying in place overwrites them
+    old_thumbs = {
+        (r["app"], r["task"]): {s.get("index"): _thumb(s, r["path"]) for s in r["steps"]}
+        for r in recordings
+    }
+    planner = RecordedPlanner(recordings, settle_cap_ms=int(os.getenv("REPLAY_SETTLE_CAP_MS", "3000")))
+    jobs = [{"app": r["app"], "task": r["task"], "max_steps": planner.plan_length(r["app"], r["task"])} for r in recordings]
+    summary = await run_batch(jobs, out_root=dest, headless=headless, profile=profile or os.getenv("PERSISTENT_PROFILE", ".playwright"),
+                              max_steps=max(j["max_steps"] for j in jobs), concurrency=concurrency, planner=planner, plan_ahead=0,
+                              # Human pacing is only needed for the LLM's benefit; readiness checks replace it.
+                              # The recording is the plan. Passed per run so the caller's environment is left alone.
+                              slow_mo_ms=0, type_delay_ms=0, plan_mode="upfront", settle_mode="adaptive")
+
+    report: Dict[str, Any] = {"source": out_root, "dest": dest, "batch": summary, "workflows": []}
+    for r in recordings:
+        new_path = Path(dest) / r["app"] / task_slug(r["task"]) / "metadata.json"
+        try:
+            new = json.loads(new_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            report["workflows"].append({"app": r["app"], "task": r["task"], "failed": True})
+            continue
+        rows = diff_steps(r["steps"], new.get("steps", []), old_thumbs[(r["app"], r["task"])], new_path,
+                          offset=planner.offsets.get((r["app"], r["task"]), 0))
+        for row in rows:
+            if row.get("visual_score") is not None and row["visual_score"] >= visual_threshold:
+                row["changes"].append("visual")
+        changed = [row for row in rows if row.get("changes") or row.get("missing")]
+        wf = {"app": r["app"], "task": r["task"], "steps": len(rows), "changed_steps": len(changed), "diff": rows}
+        (new_path.parent / REPORT_NAME).write_text(json.dumps(wf, indent=2), encoding="utf-8")
+        report["workflows"].append({k: v for k, v in wf.items() if k != "diff"})
+    Path(dest).mkdir(parents=True, exist_ok=True)
+    (Path(dest) / REPORT_NAME).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    changed = sum(1 for w in report["workflows"] if w.get("changed_steps") or w.get("failed"))
+    logger.info(f"Replayed {len(recordings)} workflows in {summary.get('elapsed_s')}s; {changed} differ from the recording")
+    return report
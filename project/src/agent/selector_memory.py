@@ -0,0 +1,121 @@
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+from urllib.parse import urlparse
+from loguru import logger
+
+_HEX_ID = re.compile(r"[0-9a-f]{32}", re.I)
+_UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.I)
+
+
+def _generalize_segment(seg: str) -> str:
+    seg = _UUID.sub("*", _HEX_ID.sub("*", seg))
+    if seg.isdigit():
+        return "*"
+    # Short opaque ids such as Trello's board key (lvdxKkua): mixed case or digits, no separators
+    if len(seg) >= 6 and "-" not in seg and "*" not in seg and (re.search(r"\d", seg) or (seg.lower() != seg and seg.upper() != seg)):
+        return "*"
+    return seg
+
+
+def url_pattern(url: str) -> str:
+    """https://trello.com/b/lvdxKkua/my-trello-board -> trello.com/b/*/my-trello-board"""
+    parsed = urlparse(url or "")
+    segments = [_generalize_segment(s) for s in parsed.path.split("/") if s]
+    return "/".join([parsed.netloc] + segments)
+
+
+def selector_key(selector: Dict[str, Any]) -> str:
+    return json.dumps(selector, sort_keys=True, ensure_ascii=False)
+
+
+class SelectorMemory:
+    """Per-app record of which concrete locator resolved a planner selector on a given URL pattern.
+
+    Entries: {"spec": {...}, "fallback": {"kind": "role", ...} | None, "hits", "misses", "last_ok", "box"}.
+    Entries unused for max_age_days, or that keep missing, are evicted.
+    """
+
+    def __init__(self, app: str, root: Optional[str] = None, max_age_days: Optional[float] = None):
+        self.app = app
+        self.path = Path(root or os.getenv("SELECTOR_MEMORY_DIR", ".selector_memory")) / f"{app}.json"
+        self.max_age_s = float(os.getenv("SELECTOR_MEMORY_MAX_AGE_DAYS", "30") if max_age_days is None else max_age_days) * 86400
+        self.entries: Dict[str, Dict[str, Any]] = self._load()
+        self._dirty: Set[str] = set()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @classmethod
+    def from_env(cls, app: str) -> Optional["SelectorMemory"]:
+        if os.getenv("SELECTOR_MEMORY", "on").lower() == "off":
+            return None
+        return cls(app)
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _key(url: str, selector: Dict[str, Any]) -> str:
+        return f"{url_pattern(url)} {selector_key(selector)}"
+
+    def _stale(self, entry: Dict[str, Any]) -> bool:
+        if time.time() - entry.get("last_ok", 0) > self.max_age_s:
+            return True
+        return entry.get("misses", 0) >= entry.get("hits", 0) + 3
+
+    def lookup(self, url: str, selector: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        key = self._key(url, selector)
+        entry = self.entries.get(key)
+        if entry and self._stale(entry):
+            del self.entries[key]
+            self._dirty.add(key)
+            self.stats["evictions"] += 1
+            return None
+        return entry
+
+    def record_hit(self, url: str, selector: Dict[str, Any], spec: Dict[str, Any],
+                   fallback: Optional[Dict[str, Any]] = None, box: Optional[Dict[str, float]] = None):
+        key = self._key(url, selector)
+        entry = self.entries.get(key)
+        if entry is None or entry.get("spec") != spec:
+            entry = {"spec": spec, "hits": 0, "misses": 0, "created": time.time()}
+            self.entries[key] = entry
+        entry["hits"] += 1
+        entry["last_ok"] = time.time()
+        if fallback:
+            entry["fallback"] = fallback
+        if box:
+            entry["box"] = box
+        self._dirty.add(key)
+        self.stats["hits"] += 1
+
+    def record_miss(self, url: str, selector: Dict[str, Any]):
+        key = self._key(url, selector)
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry["misses"] = entry.get("misses", 0) + 1
+            self._dirty.add(key)
+        self.stats["misses"] += 1
+
+    def save(self):
+        if not self._dirty:
+            return
+        # Merge into what is on disk so concurrent workflows on the same app don't drop each other's entries
+        merged = self._load()
+        for key in self._dirty:
+            if key in self.entries:
+                merged[key] = self.entries[key]
+            else:
+                merged.pop(key, None)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(merged, indent=1, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+        self.entries = merged
+        self._dirty.clear()
+        logger.info(f"Selector memory ({self.app}): {self.stats}")
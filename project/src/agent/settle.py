@@ -0,0 +1,99 @@
+import os
+import time
+from typing import Any, Dict, Optional
+from playwright.async_api import Page
+from src.agent.page_tracker import TRACKER_JS
+from src.utils import tracing
+
+# Resolves in-page once there is no recent fetch/XHR, no DOM mutation for quietMs, no finite
+# CSS/Web animation running and animation frames arrive on time (main thread idle), or at capMs.
+SETTLE_JS = """
+async ({ quietMs, capMs, longPollMs }) => {
+  %s;
+  const t = window.__wfTracker;
+  const start = performance.now();
+  const frame = () => new Promise((resolve) => {
+    const timer = setTimeout(resolve, 100);
+    requestAnimationFrame(() => { clearTimeout(timer); resolve(); });
+  });
+  const animations = () => {
+    if (!document.getAnimations) return 0;
+    return document.getAnimations().filter((a) => {
+      if (a.playState !== 'running') return false;
+      const timing = a.effect && a.effect.getComputedTiming ? a.effect.getComputedTiming() : null;
+      return !timing || timing.endTime !== Infinity;
+    }).length;
+  };
+  const inflight = (now) => {
+    let n = 0;
+    for (const started of t.pending.values()) if (now - started < longPollMs) n++;
+    return n;
+  };
+  let last = performance.now();
+  while (true) {
+    await frame();
+    const now = performance.now();
+    const gap = now - last;
+    last = now;
+    const net = inflight(now);
+    const anims = animations();
+    const quietFor = now - Math.max(t.lastChange, t.lastNet);
+    if (net === 0 && anims === 0 && quietFor >= quietMs && gap < 50) {
+      return { settled: true, reason: 'quiet', elapsed_ms: now - start };
+    }
+    if (now - start >= capMs) {
+      return { settled: false, reason: net ? 'network' : (anims ? 'animation' : (gap >= 50 ? 'busy' : 'mutations')), elapsed_ms: now - start };
+    }
+  }
+}
+""" % TRACKER_JS.strip()
+# Errors from page.evaluate that mean a navigation replaced the document, so settling should go on in the new one
+NAVIGATION_ERRORS = ("Execution context was destroyed", "Cannot find context with specified id")
+
+
+class SettleEngine:
+    """Event-driven replacement for fixed networkidle + sleep waits."""
+
+    def __init__(self, quiet_ms: int = 300, cap_ms: int = 6000, long_poll_ms: int = 4000):
+        self.quiet_ms = quiet_ms
+        self.cap_ms = cap_ms
+        self.long_poll_ms = long_poll_ms
+
+    @classmethod
+    def from_env(cls, mode: Optional[str] = None) -> Optional["SettleEngine"]:
+        if (mode or os.getenv("SETTLE_MODE", "adaptive")).lower() == "fixed":
+            return None
+        return cls(
+            quiet_ms=int(os.getenv("SETTLE_QUIET_MS", "300")),
+            cap_ms=int(os.getenv("SETTLE_CAP_MS", "6000")),
+            long_poll_ms=int(os.getenv("SETTLE_LONG_POLL_MS", "4000")),
+        )
+
+    async def settle(self, page: Page, cap_ms: Optional[int] = None) -> Dict[str, Any]:
+        cap_ms = self.cap_ms if cap_ms is None else cap_ms
+        started = time.monotonic()
+        navigations = 0
+        while True:
+            remaining = cap_ms - (time.monotonic() - started) * 1000
+            if remaining <= 0 or page.is_closed():
+                return {"settle_ms": round((time.monotonic() - started) * 1000), "settled": False, "reason": "cap", "navigations": navigations}
+            try:
+                with tracing.span("evaluate", fn="settle"):
+                    res = await page.evaluate(SETTLE_JS, {"quietMs": self.quiet_ms, "capMs": remaining, "longPollMs": self.long_poll_ms})
+                return {
+                    "settle_ms": round((time.monotonic() - started) * 1000),
+                    "settled": res.get("settled", False),
+                    "reason": res.get("reason"),
+                    "navigations": navigations,
+                }
+            except Exception as e:
+                if not any(m in str(e) for m in NAVIGATION_ERRORS):
+                    # Anything else (page closed, script error) would fail the same way on every retry
+                    return {"settle_ms": round((time.monotonic() - started) * 1000), "settled": False, "reason": "error",
+                            "navigations": navigations, "error": str(e).splitlines()[0] if str(e) else type(e).__name__}
+                # A navigation destroyed the execution context; wait for the new document and keep settling
+                navigations += 1
+                try:
+                    await page.wait_for_load_state("domcontentloaded", timeout=max(remaining, 1))
+                except Exception:
+                    pass
@@ -1,49 +1,64 @@
-import hashlib
-import json
 import time
-from typing import Any, Dict
-from loguru import logger
+from typing import Any, Dict, Optional
 from playwright.async_api import Page
+from src.agent.page_tracker import snapshot, signature as page_signature
+from src.agent.settle import SettleEngine
+from src.capture.visual_diff import VisualScorer
+from src.utils import tracing
 
 class StateDetector:
-    def __init__(self, networkidle_ms: int = 1500, capture_delay_ms: int = 500, significance_threshold: float = 0.12):
+    def __init__(self, networkidle_ms: int = 1500, capture_delay_ms: int = 500, significance_threshold: float = 0.12, settler: Optional[SettleEngine] = None,
+                 sensitive_regions: bool = True):
         self.networkidle_ms = networkidle_ms
         self.capture_delay_ms = capture_delay_ms
         self.significance_threshold = significance_threshold
+        # Pixel-level significance is judged at capture time against this threshold
+        self.visual = VisualScorer(significance_threshold)
+        self.settler = settler
+        # Boxes of emails/avatars/password fields in the captured frame, for redaction after capture
+        self.sensitive_regions = sensitive_regions
         self._last_signature = None
 
-    async def stabilize(self, page: Page):
+    async def stabilize(self, page: Page) -> Dict[str, Any]:
+        with tracing.span("stabilize"):
+            return await self._stabilize(page)
+
+    async def _stabilize(self, page: Page) -> Dict[str, Any]:
+        budget_ms = self.networkidle_ms + self.capture_delay_ms
+        if self.settler:
+            stats = await self.settler.settle(page)
+            return {**stats, "budget_ms": budget_ms}
+        started = time.monotonic()
         try:
             await page.wait_for_load_state("networkidle")
         except Exception:
             pass
         await page.wait_for_timeout(self.networkidle_ms)
         await page.wait_for_timeout(self.capture_delay_ms)
+        return {"settle_ms": round((time.monotonic() - started) * 1000), "settled": True, "reason": "fixed", "budget_ms": budget_ms}
 
-    async def dom_signature(self, page: Page) -> str:
-        html = await page.content()
-        # Normalize by stripping dynamic attrs that often change
-        simplified = html.encode("utf-8", errors="ignore")
-        return hashlib.sha256(simplified).hexdigest()
-
-    async def detect(self, page: Page) -> Dict[str, Any]:
-        await self.stabilize(page)
-        url = page.url
-        has_modal = await page.evaluate("""
-            () => !!document.querySelector('[role="dialog"], .modal, [class*="Dialog"], [data-modal="true"]')
-        """)
-        has_overlay = await page.evaluate("""
-            () => !!document.querySelector('[class*="overlay"], [class*="Popover"], [class*="dropdown"]')
-        """)
-        signature = await self.dom_signature(page)
+    async def detect(self, page: Page, stabilize: bool = True, snap: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """snap: a snapshot of the already-settled page taken right after the action; reused instead of settling
+        and evaluating again."""
+        # Screencast mode records frames while the page moves, so it skips the pre-capture settle
+        settle = await self.stabilize(page) if stabilize and snap is None else None
+        # URL, modal/overlay flags and the mutation-tracker signature in a single evaluate
+        if snap is None:
+            snap = await snapshot(page, sensitive=self.sensitive_regions)
+        signature = page_signature(snap)
         changed = (self._last_signature is None) or (self._last_signature != signature)
         self._last_signature = signature
+        has_modal = snap.get("has_modal")
+        has_overlay = snap.get("has_overlay")
         return {
-            "url": url,
+            "url": snap.get("url") or page.url,
             "has_modal": bool(has_modal),
             "has_overlay": bool(has_overlay),
             "signature": signature,
             "changed": changed,
             "significant": changed or has_modal or has_overlay,
+            "settle": settle,
+            "viewport": snap.get("viewport"),
+            "sensitive": snap.get("sensitive"),
             "timestamp": time.time(),
         }
@@ -1,10 +1,12 @@
-from typing import Any, Dict
+import asyncio
+from typing import Any, Dict, List, Tuple
 from loguru import logger
 from src.utils.ai_helpers import AIClient
 
 class TaskPlanner:
     def __init__(self):
         self.ai = AIClient()
+        self._ahead: Dict[Tuple[str, str, str], asyncio.Future] = {}
 
     def plan(self, app: str, task: str, start_url: str) -> Dict[str, Any]:
         logger.info(f"Planning task for app={app}: {task}")
@@ -12,3 +14,45 @@ class TaskPlanner:
         if not isinstance(plan, dict) or "steps" not in plan:
             plan = {"steps": []}
         return plan
+
+    async def aplan(self, app: str, task: str, start_url: str) -> Dict[str, Any]:
+        fut = self._ahead.pop((app, task, start_url), None)
+        if fut is not None:
+            logger.info(f"Using plan-ahead result for app={app}: {task}")
+            plan = await fut
+        else:
+            logger.info(f"Planning task for app={app}: {task}")
+            plan = await self.ai.aplan(app, task, start_url)
+        if not isinstance(plan, dict) or "steps" not in plan:
+            plan = {"steps": []}
+        return plan
+
+    async def next_step(self, app: str, task: str, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """One step of closed-loop planning (PLAN_MODE=closed); {"done": True} ends the workflow."""
+        return await self.ai.next_step(app, task, messages)
+
+    def prefetch(self, app: str, task: str, start_url: str):
+        """Start planning a task in the background so it is ready when a worker picks it up."""
+        key = (app, task, start_url)
+        if key not in self._ahead:
+            self._ahead[key] = asyncio.ensure_future(self.ai.aplan(app, task, start_url))
+
+    def cancel_prefetch(self):
+        for fut in self._ahead.values():
+            fut.cancel()
+        self._ahead.clear()
+
+    def mark_failed(self, app: str, plan: Dict[str, Any]):
+        # Only cached LLM plans carry a key; heuristic plans are rebuilt every time anyway
+        if plan.get("cache_key"):
+            self.ai.cache.mark_failed(plan["cache_key"])
+        if plan.get("templates"):
+            self.ai.templates.demote(app, plan["templates"])
+
+    def mark_succeeded(self, app: str, task: str, plan: Dict[str, Any], start_url: str):
+        """Learn a template from an LLM plan (fresh or cached) that ran cleanly, so the next similar task skips the LLM."""
+        if plan.get("cache_key") and self.ai.templates.mode != "off":
+            try:
+                self.ai.templates.promote(app, task, plan, start_url)
+            except Exception as e:
+                logger.warning(f"Template promotion failed: {e}")
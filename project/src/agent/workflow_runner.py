@@ -0,0 +1,355 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+from loguru import logger
+from playwright.async_api import Page
+
+from src.agent.task_planner import TaskPlanner
+from src.agent.action_executor import ActionExecutor
+from src.agent.closed_loop import Dialogue, Observer
+from src.agent.state_detector import StateDetector
+from src.agent.settle import SettleEngine
+from src.agent.selector_memory import SelectorMemory
+from src.capture.screenshot_manager import ScreenshotManager
+from src.capture.delta_frames import DeltaEncoder
+from src.capture.screencast import Screencast
+from src.capture.frame_writer import FrameWriter
+from src.capture.metadata_handler import MetadataHandler
+from src.capture.blob_store import BlobStore
+from src.capture.dataset_index import DatasetIndex
+from src.config.app_configs import AppConfig
+from src.utils import tracing
+
+
+def make_detector(settler: Optional[SettleEngine] = None) -> StateDetector:
+    return StateDetector(
+        networkidle_ms=int(os.getenv("NETWORKIDLE_TIMEOUT_MS", "1500")),
+        capture_delay_ms=int(os.getenv("CAPTURE_DELAY_MS", "500")),
+        significance_threshold=float(os.getenv("SIGNIFICANCE_THRESHOLD", "0.12")),
+        settler=settler,
+        sensitive_regions=os.getenv("SENSITIVE_REGIONS", "on").lower() != "off",
+    )
+
+
+class WorkflowRunner:
+    """Plans one task and executes it step by step on an already-open page."""
+
+    def __init__(self, page: Page, cfg: AppConfig, task: str, out_root: str, max_steps: int,
+                 planner: Optional[TaskPlanner] = None, writer: Optional[FrameWriter] = None,
+                 plan_mode: Optional[str] = None, settle_mode: Optional[str] = None, type_delay_ms: Optional[int] = None):
+        self.page = page
+        self.cfg = cfg
+        self.app = cfg.name
+        self.task = task
+        self.max_steps = max_steps
+        self.planner = planner or TaskPlanner()
+        self.settler = SettleEngine.from_env(settle_mode)
+        self.detector = make_detector(self.settler)
+        blobs = BlobStore(out_root) if os.getenv("SCREENSHOT_STORE", "files").lower() == "blobs" else None
+        self.shots = ScreenshotManager(out_root, scorer=self.detector.visual, writer=writer, blobs=blobs,
+                                       delta=DeltaEncoder.from_env())
+        self.meta = MetadataHandler(out_root)
+        self.memory = SelectorMemory.from_env(self.app)
+        self.execu = ActionExecutor(page, settler=self.settler, memory=self.memory, type_delay_ms=type_delay_ms,
+                                    sensitive=self.detector.sensitive_regions)
+        # "closed": plan one step at a time from what the page shows instead of the whole task up front
+        self.closed_loop = (plan_mode or os.getenv("PLAN_MODE", "upfront")).lower() == "closed"
+        # "screencast": stream frames during the run and pick the significant ones afterwards instead of pausing per step
+        self.screencast: Optional[Screencast] = None
+        if os.getenv("SCREENSHOT_MODE", "step").lower() == "screencast":
+            self.screencast = Screencast(page, image_format="png" if self.shots.writer.fmt == "png" else "jpeg",
+                                         threshold=self.detector.significance_threshold)
+
+    async def run(self) -> Dict[str, Any]:
+        # Reuse a tracer the caller already started (so login is on the same timeline), else start one
+        self.tracer = tracing.current() or tracing.Tracer.from_env(f"{self.app}: {self.task}")
+        token = tracing.activate(self.tracer)
+        try:
+            if self.screencast:
+                try:
+                    await self.screencast.start()
+                except Exception as e:
+                    logger.warning(f"Screencast unavailable, capturing per step instead: {e}")
+                    await self.screencast.close()
+                    self.screencast = None
+            return await self._execute()
+        finally:
+            if self.screencast:
+                await self.screencast.close()
+            await self.shots.close()
+            if self.memory:
+                self.memory.save()
+            tracing.deactivate(token)
+
+    async def _execute(self) -> Dict[str, Any]:
+        started = time.time()
+
+        recorded: List[Dict[str, Any]] = []
+        if self.closed_loop and self.planner.ai.provider:
+            plan: Dict[str, Any] = {"source": "closed_loop"}
+            plan_info = {"plan": {"source": "closed_loop", "provider": self.planner.ai.provider}}
+            self.meta.begin(self.app, self.task, extra=plan_info)
+            await self._run_closed_loop(recorded)
+        else:
+            if self.closed_loop:
+                logger.warning("PLAN_MODE=closed needs an AI provider; planning up front instead")
+            # Plan steps
+            with tracing.span("plan"):
+                plan = await self.planner.aplan(self.app, self.task, self.cfg.workspace_url or self.cfg.base_url)
+            steps: List[Dict[str, Any]] = plan.get("steps", [])
+
+            plan_info = {"plan": {"source": plan.get("source"), "cache_key": plan.get("cache_key")}}
+            if plan.get("templates"):
+                plan_info["plan"]["templates"] = plan["templates"]
+            logger.info(f"Executing {len(steps)} planned steps (max {self.max_steps})")
+
+            # Each step is journaled as soon as it is recorded so a crash loses at most the current step
+            self.meta.begin(self.app, self.task, extra=plan_info)
+            for i, step in enumerate(steps[:self.max_steps], start=1):
+                with tracing.span("step", index=i, action=step.get("action")):
+                    entry = await self._run_step(i, step)
+                recorded.append(entry)
+                self.meta.append(entry)
+
+        if self.screencast:
+            await self.screencast.stop()
+            with tracing.span("select_frames"):
+                for entry in recorded:
+                    await self._store_selected(entry)
+
+        # Frames are written off-loop; wait for them so metadata only references files that exist
+        with tracing.span("flush_frames"):
+            timings = await self.shots.flush()
+        for r in recorded:
+            if r.get("screenshot") in timings:
+                r["write_timing"] = timings[r["screenshot"]]
+
+        errors = len([r for r in recorded if r.get("error")])
+        if errors:
+            self.planner.mark_failed(self.app, plan)
+        elif recorded:
+            self.planner.mark_succeeded(self.app, self.task, plan, self.cfg.workspace_url or self.cfg.base_url)
+        if self.tracer:
+            plan_info["trace"] = {"file": tracing.TRACE_NAME, "phases": self.tracer.summary()}
+        with tracing.span("metadata_write"):
+            meta_path = self.meta.finalize(self.app, self.task, recorded, extra=plan_info)
+        if self.tracer:
+            self.tracer.export(meta_path.parent / tracing.TRACE_NAME)
+        self._index(meta_path)
+        screenshots = len([r for r in recorded if r.get("screenshot")])
+        logger.info(f"Workflow complete: {len(recorded)} steps recorded, {screenshots} screenshots captured")
+        if self.shots.blobs:
+            logger.info(f"Blob store: {self.shots.deduped} frames already stored, not rewritten")
+        if self.shots.delta:
+            d = self.shots.delta.stats
+            logger.info(f"Delta frames: {d['keyframes']} keyframes, {d['deltas']} deltas, "
+                        f"{d['bytes_written'] / 1e6:.2f} MB written for {d['bytes_full'] / 1e6:.2f} MB of screenshots")
+        return {
+            "app": self.app,
+            "task": self.task,
+            "steps": len(recorded),
+            "screenshots": screenshots,
+            "errors": errors,
+            "duration_s": time.time() - started,
+            "metadata": str(meta_path),
+        }
+
+    async def _observe(self, observer: Observer) -> Dict[str, Any]:
+        try:
+            return await observer.observe(self.page)
+        except Exception:
+            # Usually a navigation tore down the execution context mid-evaluate; the next document is ready soon
+            await asyncio.sleep(0.5)
+            return await observer.observe(self.page)
+
+    async def _run_closed_loop(self, recorded: List[Dict[str, Any]]):
+        """Observe, ask for one step, perform it, repeat; stops on {"done"} or after repeated failures."""
+        observer, dialogue = Observer(), Dialogue(self.app, self.task)
+        start_url = self.cfg.workspace_url or self.cfg.base_url
+        pending: List[Dict[str, Any]] = []
+        if urlparse(self.page.url).hostname != urlparse(start_url).hostname:
+            pending.append({"description": f"Open {self.app} workspace", "action": "goto", "selector": {"css": start_url}, "wait_ms": 1500})
+        max_failures = int(os.getenv("CLOSED_LOOP_MAX_ERRORS", "3"))
+        outcome, failures = None, 0
+        for i in range(1, self.max_steps + 1):
+            info: Dict[str, Any] = {}
+            if pending:
+                step = pending.pop(0)
+            else:
+                if dialogue.needs_full:
+                    observer.reset()
+                with tracing.span("observe"):
+                    obs = await self._observe(observer)
+                prompt_tokens = dialogue.observe(obs, outcome)
+                t0 = time.perf_counter()
+                with tracing.span("plan", index=i):
+                    step = await self.planner.next_step(self.app, self.task, dialogue.messages)
+                dialogue.reply(step)
+                info = {"observation_tokens": obs["tokens"], "full_observation": obs["full"], "prompt_tokens": prompt_tokens,
+                        "history_tokens": dialogue.tokens, "plan_ms": round((time.perf_counter() - t0) * 1000, 1)}
+                if step.get("done"):
+                    logger.info(f"Planner finished after {i - 1} steps{': ' + step['reason'] if step.get('reason') else ''}")
+                    break
+            with tracing.span("step", index=i, action=step.get("action")):
+                entry = await self._run_step(i, step)
+            if info:
+                entry["closed_loop"] = info
+            recorded.append(entry)
+            self.meta.append(entry)
+            if entry.get("error"):
+                failures += 1
+                outcome = f"failed ({entry['error']})"
+                if failures >= max_failures:
+                    logger.warning(f"Stopping after {failures} failed steps in a row")
+                    break
+            else:
+                failures, outcome = 0, "succeeded"
+            dialogue.trim()
+
+    def _index(self, meta_path):
+        if os.getenv("DATASET_INDEX", "on").lower() == "off":
+            return
+        try:
+            index = DatasetIndex(str(self.meta.out_root))
+            try:
+                index.index_file(meta_path)
+            finally:
+                index.close()
+        except Exception as e:
+            logger.warning(f"Dataset index update failed (run `main.py index refresh`): {e}")
+
+    def _add_regions(self, entry: Dict[str, Any], state: Dict[str, Any]):
+        """Screen regions (CSS px in the recorded viewport) used by `main.py postprocess`."""
+        if self.execu.last_target_box:
+            entry["target_box"] = self.execu.last_target_box
+        if state.get("viewport"):
+            entry["viewport"] = state["viewport"]
+            entry["sensitive_regions"] = state.get("sensitive") or []
+
+    async def _store_selected(self, entry: Dict[str, Any]):
+        """Write the screencast frames picked for a step; the step's screenshot is its final (or last kept) frame."""
+        selected = await self.screencast.selected(entry["index"])
+        if not selected:
+            return
+        desc = entry.get("description") or f"step-{entry['index']}"
+        frames = []
+        for f in selected:
+            path = await self.shots.store(f["data"], self.app, self.task, desc if f["final"] else f"{desc}-transient")
+            frames.append({"path": path, "ts": f["ts"], "score": round(f["score"], 4)})
+            if self.shots.blobs:
+                frames[-1]["frame"] = self.shots.last_frame
+        entry["screenshot"] = frames[-1]["path"]
+        entry["visual_score"] = frames[-1]["score"]
+        entry["frames"] = frames
+        if self.shots.blobs:
+            entry["frame"] = self.shots.last_frame
+
+    async def _run_streamed(self, i: int, step: Dict[str, Any]) -> Dict[str, Any]:
+        execu = self.execu
+        error = None
+        self.screencast.begin_step()
+        try:
+            await execu.perform(step)
+            state = await self.detector.detect(self.page, stabilize=False)
+        except Exception as e:
+            logger.warning(f"Step {i} encountered error (continuing): {e}")
+            state = {"timestamp": time.time()}
+            error = str(e)
+        finally:
+            self.screencast.end_step(i)
+        entry = {
+            "index": i,
+            "description": step.get("description"),
+            "action": step.get("action"),
+            "selector": step.get("selector"),
+            "input": step.get("input"),
+            "url": state.get("url"),
+            "has_modal": state.get("has_modal"),
+            "has_overlay": state.get("has_overlay"),
+            "screenshot": None,
+            "timestamp": state.get("timestamp"),
+            "settle": {"action": execu.last_settle},
+        }
+        self._add_regions(entry, state)
+        error = execu.last_error or error
+        if execu.last_locator and not error:
+            entry["locator"] = execu.last_locator
+        if error:
+            entry["error"] = error
+        return entry
+
+    async def _run_step(self, i: int, step: Dict[str, Any]) -> Dict[str, Any]:
+        if self.screencast:
+            return await self._run_streamed(i, step)
+        page, execu, shots = self.page, self.execu, self.shots
+        try:
+            # Always try to perform action (has internal error handling now)
+            await execu.perform(step)
+
+            # Always detect state and try to capture; the visual scorer drops frames that did not change
+            state = await self.detector.detect(page, snap=execu.last_snapshot)
+            img_path = None
+            try:
+                img_path = await shots.capture(page, self.app, self.task, step.get("description", f"step-{i}"), state=state)
+            except Exception as capture_err:
+                logger.warning(f"Screenshot capture failed: {capture_err}")
+
+            entry = {
+                "index": i,
+                "description": step.get("description"),
+                "action": step.get("action"),
+                "selector": step.get("selector"),
+                "input": step.get("input"),
+                "url": state.get("url"),
+                "has_modal": state.get("has_modal"),
+                "has_overlay": state.get("has_overlay"),
+                "screenshot": img_path,
+                "visual_score": shots.last_score,
+                "timestamp": state.get("timestamp"),
+                "settle": {"action": execu.last_settle, "capture": state.get("settle")},
+            }
+            self._add_regions(entry, state)
+            if img_path and shots.blobs:
+                entry["frame"] = shots.last_frame
+            if img_path and shots.last_delta:
+                entry["delta"] = shots.last_delta
+            if execu.last_locator and not execu.last_error:
+                entry["locator"] = execu.last_locator
+            if execu.last_error:
+                entry["error"] = execu.last_error
+            return entry
+        except Exception as e:
+            logger.warning(f"Step {i} encountered error (continuing): {e}")
+            # Still try to capture current state
+            try:
+                img_path = await shots.capture(page, self.app, self.task, f"step-{i}-error")
+                entry = {
+                    "index": i,
+                    "description": step.get("description"),
+                    "action": step.get("action"),
+                    "error": str(e),
+                    "screenshot": img_path,
+                    "timestamp": time.time(),
+                }
+                if img_path and shots.blobs:
+                    entry["frame"] = shots.last_frame
+                if img_path and shots.last_delta:
+                    entry["delta"] = shots.last_delta
+                return entry
+            except:
+                return {
+                    "index": i,
+                    "description": step.get("description"),
+                    "action": step.get("action"),
+                    "error": str(e),
+                    "timestamp": time.time(),
+                }
+
+
+async def run_workflow(page: Page, cfg: AppConfig, task: str, out_root: str, max_steps: int,
+                       planner: Optional[TaskPlanner] = None, writer: Optional[FrameWriter] = None,
+                       **overrides) -> Dict[str, Any]:
+    """overrides (plan_mode, settle_mode, type_delay_ms) take precedence over the environment for this run only."""
+    return await WorkflowRunner(page, cfg, task, out_root, max_steps, planner=planner, writer=writer, **overrides).run()
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+from loguru import logger
+
+BLOB_DIR = ".blobs"
+
+
+def iter_metadata(out_root: Path) -> Iterator[Tuple[Path, Dict[str, Any]]]:
+    for meta_path in sorted(Path(out_root).glob("*/*/metadata.json")):
+        try:
+            yield meta_path, json.loads(meta_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable {meta_path}: {e}")
+
+
+class BlobStore:
+    """Content-addressed screenshot store shared by every app/task under one dataset root.
+
+    Blobs live at <out_root>/.blobs/<aa>/<sha256><ext>, keyed by the raw screenshot bytes, so an identical
+    frame captured by any task is written once. Step metadata points at the blob and keeps the
+    per-task file name in "frame" (screencast frames under "frames" likewise) so export() can rebuild the
+    classic layout.
+    """
+
+    def __init__(self, out_root: str):
+        self.out_root = Path(out_root)
+        self.root = self.out_root / BLOB_DIR
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def path_for(self, digest: str, ext: str) -> Path:
+        return self.root / digest[:2] / f"{digest}{ext}"
+
+    def is_blob(self, screenshot: str) -> bool:
+        return BLOB_DIR in Path(screenshot.replace("\\", "/")).parts
+
+    def referenced(self) -> Set[str]:
+        names: Set[str] = set()
+        for _, meta in iter_metadata(self.out_root):
+            for step in meta.get("steps", []):
+                # Screencast steps also keep their transient frames under "frames"
+                for shot in [step.get("screenshot")] + [f.get("path") for f in step.get("frames", [])]:
+                    if shot and self.is_blob(shot):
+                        names.add(Path(shot.replace("\\", "/")).name)
+        return names
+
+    def gc(self, grace_s: float = 3600, dry_run: bool = False) -> Dict[str, int]:
+        """Delete blobs no metadata.json references. Blobs younger than grace_s are kept, since a run in
+        progress has written frames but not yet its metadata."""
+        keep = self.referenced()
+        now = time.time()
+        removed = freed = 0
+        for blob in self.root.glob("*/*"):
+            if not blob.is_file() or blob.name in keep:
+                continue
+            st = blob.stat()
+            if now - st.st_mtime < grace_s:
+                continue
+            if not dry_run:
+                blob.unlink(missing_ok=True)
+                thumb = blob.parent / "thumbs" / f"{blob.stem}.jpg"
+                thumb.unlink(missing_ok=True)
+            removed += 1
+            freed += st.st_size
+        logger.info(f"Blob GC: {'would remove' if dry_run else 'removed'} {removed} blobs ({freed / 1e6:.1f} MB), {len(keep)} referenced")
+        return {"removed": removed, "bytes_freed": freed, "referenced": len(keep)}
+
+    def _export_frame(self, shot: str, meta_path: Path, task_dir: Path, name: Optional[str], copy: bool) -> str:
+        src = Path(shot.replace("\\", "/"))
+        if not self.is_blob(shot):
+            src = meta_path.parent / src.name
+        # Frames recorded without a per-task name keep the blob's
+        target = task_dir / (name or src.name)
+        if not target.exists():
+            if copy:
+                shutil.copyfile(src, target)
+            else:
+                try:
+                    os.link(src, target)
+                except OSError:
+                    shutil.copyfile(src, target)
+        return target.as_posix()
+
+    def export(self, dest: str, copy: bool = False) -> Dict[str, int]:
+        """Materialize dataset/<app>/<task>/step-NN-*.png plus rewritten metadata.json under dest.
+        Files are hard-linked when possible so the export costs no extra disk space."""
+        dest_root = Path(dest)
+        workflows = frames = 0
+        for meta_path, meta in iter_metadata(self.out_root):
+            task_dir = dest_root / meta_path.parent.parent.name / meta_path.parent.name
+            task_dir.mkdir(parents=True, exist_ok=True)
+            exported: Dict[str, str] = {}
+            for step in meta.get("steps", []):
+                shot = step.get("screenshot")
+                if shot:
+                    step["screenshot"] = exported[shot] = self._export_frame(shot, meta_path, task_dir, step.get("frame"), copy)
+                    frames += 1
+                delta = step.get("delta")
+                if delta and delta.get("keyframe"):
+                    # The keyframe is an earlier step's screenshot, already exported under its per-task name
+                    key = delta["keyframe"]
+                    delta["keyframe"] = exported.get(key) or self._export_frame(key, meta_path, task_dir, None, copy)
+                for f in step.get("frames", []):
+                    if f.get("path"):
+                        f["path"] = self._export_frame(f["path"], meta_path, task_dir, f.pop("frame", None), copy)
+                        frames += 1
+                step.pop("frame", None)
+            (task_dir / "metadata.json").write_text(json.dumps(meta, indent=2))
+            workflows += 1
+        logger.info(f"Exported {workflows} workflows ({frames} frames) to {dest_root}")
+        return {"workflows": workflows, "frames": frames}
@@ -0,0 +1,193 @@
+import json
+import os
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from loguru import logger
+
+INDEX_NAME = "index.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workflows (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    app TEXT NOT NULL,
+    slug TEXT NOT NULL,
+    task TEXT,
+    mtime REAL NOT NULL,
+    step_count INTEGER NOT NULL,
+    error_count INTEGER NOT NULL,
+    interrupted INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS steps (
+    workflow_id INTEGER NOT NULL REFERENCES workflows(id) ON DELETE CASCADE,
+    idx INTEGER,
+    app TEXT NOT NULL,
+    description TEXT,
+    action TEXT,
+    selector TEXT,
+    selector_kind TEXT,
+    selector_value TEXT,
+    url TEXT,
+    has_modal INTEGER,
+    has_overlay INTEGER,
+    error TEXT,
+    screenshot TEXT,
+    visual_score REAL,
+    timestamp REAL
+);
+CREATE INDEX IF NOT EXISTS steps_workflow ON steps(workflow_id);
+CREATE INDEX IF NOT EXISTS steps_app_flags ON steps(app, has_modal, has_overlay);
+CREATE INDEX IF NOT EXISTS steps_app_action ON steps(app, action);
+CREATE INDEX IF NOT EXISTS steps_errors ON steps(app) WHERE error IS NOT NULL;
+CREATE INDEX IF NOT EXISTS steps_url ON steps(url);
+CREATE INDEX IF NOT EXISTS steps_selector ON steps(selector_kind, selector_value);
+"""
+
+
+SELECTOR_KINDS = ("css", "role", "text", "placeholder", "label", "xpath")
+
+
+def _selector_fields(selector: Any):
+    if not isinstance(selector, dict) or not selector:
+        return None, None, None
+    # Same precedence as ActionExecutor._resolve
+    kind = next((k for k in SELECTOR_KINDS if selector.get(k)), next(iter(selector)))
+    value = selector.get(kind)
+    if kind == "role":
+        value = f"{selector.get('role')}:{selector.get('name') or selector.get('name_regex') or ''}"
+    return json.dumps(selector, sort_keys=True), kind, None if value is None else str(value)
+
+
+def _flag(value: Any) -> Optional[int]:
+    return None if value is None else int(bool(value))
+
+
+class DatasetIndex:
+    """SQLite index over dataset/<app>/<task>/metadata.json, refreshed incrementally by file mtime."""
+
+    def __init__(self, out_root: str, db_path: Optional[str] = None):
+        self.out_root = Path(out_root)
+        self.db_path = Path(db_path) if db_path else self.out_root / INDEX_NAME
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path), timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _metadata_files(self) -> Dict[str, float]:
+        found: Dict[str, float] = {}
+        if not self.out_root.is_dir():
+            return found
+        # scandir + stat only; no JSON is parsed unless its mtime moved
+        for app_entry in os.scandir(self.out_root):
+            if not app_entry.is_dir() or app_entry.name.startswith("."):
+                continue
+            for task_entry in os.scandir(app_entry.path):
+                if not task_entry.is_dir():
+                    continue
+                meta = os.path.join(task_entry.path, "metadata.json")
+                try:
+                    found[Path(meta).as_posix()] = os.stat(meta).st_mtime
+                except FileNotFoundError:
+                    continue
+        return found
+
+    def refresh(self) -> Dict[str, int]:
+        on_disk = self._metadata_files()
+        known = {row["path"]: row["mtime"] for row in self.conn.execute("SELECT path, mtime FROM workflows")}
+        updated = removed = 0
+        with self.conn:
+            for path in known.keys() - on_disk.keys():
+                self.conn.execute("DELETE FROM workflows WHERE path = ?", (path,))
+                removed += 1
+            for path, mtime in on_disk.items():
+                if known.get(path) != mtime:
+                    self._index(Path(path), mtime)
+                    updated += 1
+        if updated or removed:
+            logger.info(f"Dataset index: {updated} workflows (re)indexed, {removed} removed")
+        return {"updated": updated, "removed": removed, "total": len(on_disk)}
+
+    def index_file(self, meta_path: Path):
+        """Index one metadata.json right after it is written (the writer-side hook)."""
+        meta_path = Path(meta_path)
+        with self.conn:
+            self._index(meta_path, meta_path.stat().st_mtime)
+
+    def _index(self, meta_path: Path, mtime: float):
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dataset index: skipping unreadable {meta_path}: {e}")
+            return
+        path = meta_path.as_posix()
+        app = meta.get("app") or meta_path.parent.parent.name
+        steps = meta.get("steps", [])
+        self.conn.execute("DELETE FROM workflows WHERE path = ?", (path,))
+        cur = self.conn.execute(
+            "INSERT INTO workflows (path, app, slug, task, mtime, step_count, error_count, interrupted) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, app, meta_path.parent.name, meta.get("task"), mtime, len(steps),
+             sum(1 for s in steps if s.get("error")), int(bool(meta.get("interrupted")))),
+        )
+        wid = cur.lastrowid
+        rows = []
+        for s in steps:
+            selector, kind, value = _selector_fields(s.get("selector"))
+            shot = s.get("screenshot")
+            rows.append((
+                wid, s.get("index"), app, s.get("description"), s.get("action"), selector, kind, value,
+                s.get("url"), _flag(s.get("has_modal")), _flag(s.get("has_overlay")), s.get("error"),
+                shot.replace("\\", "/") if shot else None, s.get("visual_score"), s.get("timestamp"),
+            ))
+        self.conn.executemany("INSERT INTO steps VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def query(self, app: Optional[str] = None, has_modal: Optional[bool] = None, has_overlay: Optional[bool] = None,
+              errored: Optional[bool] = None, action: Optional[str] = None, url_contains: Optional[str] = None,
+              selector: Optional[str] = None, task_contains: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """e.g. query(app="trello", has_modal=True, errored=True) -> all modal steps on Trello that errored."""
+        where, args = [], []
+        if app:
+            where.append("s.app = ?")
+            args.append(app)
+        if has_modal is not None:
+            where.append("s.has_modal = ?")
+            args.append(int(has_modal))
+        if has_overlay is not None:
+            where.append("s.has_overlay = ?")
+            args.append(int(has_overlay))
+        if errored is not None:
+            where.append("s.error IS NOT NULL" if errored else "s.error IS NULL")
+        if action:
+            where.append("s.action = ?")
+            args.append(action)
+        if url_contains:
+            where.append("s.url LIKE ?")
+            args.append(f"%{url_contains}%")
+        if selector:
+            where.append("s.selector_value = ?")
+            args.append(selector)
+        if task_contains:
+            where.append("w.task LIKE ?")
+            args.append(f"%{task_contains}%")
+        sql = (
+            "SELECT w.task, w.slug, w.path AS metadata, s.idx AS 'index', s.app, s.description, s.action, s.selector, "
+            "s.url, s.has_modal, s.has_overlay, s.error, s.screenshot, s.visual_score, s.timestamp "
+            "FROM steps s JOIN workflows w ON w.id = s.workflow_id"
+        )
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY s.workflow_id, s.idx"
+        if limit:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+        return [dict(row) for row in self.conn.execute(sql, args)]
+
+    def stats(self) -> Dict[str, Any]:
+        row = self.conn.execute("SELECT COUNT(*) AS workflows, COALESCE(SUM(step_count), 0) AS steps, COALESCE(SUM(error_count), 0) AS errors FROM workflows").fetchone()
+        per_app = {r["app"]: r["n"] for r in self.conn.execute("SELECT app, COUNT(*) AS n FROM workflows GROUP BY app")}
+        return {**dict(row), "apps": per_app}
@@ -0,0 +1,131 @@
+import io
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+from PIL import Image, ImageChops
+
+from src.capture.blob_store import BLOB_DIR
+
+
+class DeltaEncoder:
+    """Turns a workflow's screenshots into keyframes plus cropped deltas.
+
+    A keyframe is the full screenshot, untouched. Every other frame is diffed against the last keyframe and only
+    the bounding box of changed pixels is kept, with its offset; pasting it onto the keyframe gives back the exact
+    frame. A new keyframe starts every keyframe_every frames, on a URL change, on a viewport size change, or when the
+    changed box covers more than max_area of the frame (the crop would save little). The caller must store both
+    keyframes and crops losslessly (ScreenshotManager writes them as PNG whatever SCREENSHOT_FORMAT is); a lossy
+    keyframe would no longer be the image the crops were diffed against.
+    """
+
+    def __init__(self, keyframe_every: int = 5, max_area: float = 0.5):
+        self.keyframe_every = max(1, keyframe_every)
+        self.max_area = max_area
+        self.keyframe_path: Optional[str] = None
+        self._key: Optional[Image.Image] = None
+        self._key_rgb: Optional[Image.Image] = None
+        self._key_url: Optional[str] = None
+        self._since_key = 0
+        self.stats = {"keyframes": 0, "deltas": 0, "bytes_full": 0, "bytes_written": 0}
+
+    @classmethod
+    def from_env(cls) -> Optional["DeltaEncoder"]:
+        if os.getenv("SCREENSHOT_DELTA", "off").lower() != "on":
+            return None
+        return cls(keyframe_every=int(os.getenv("DELTA_KEYFRAME_EVERY", "5")), max_area=float(os.getenv("DELTA_MAX_AREA", "0.5")))
+
+    def encode(self, data: bytes, url: Optional[str]) -> Tuple[bytes, Optional[Dict[str, Any]]]:
+        """(bytes to store, delta info) for one screenshot; delta info is None for a keyframe. Runs off the loop."""
+        self.stats["bytes_full"] += len(data)
+        try:
+            img = Image.open(io.BytesIO(data))
+            img.load()
+        except Exception:
+            # Not decodable here (unexpected format); store it whole and diff against it no further
+            self._key = None
+            return self._keyframe(data)
+        rgb = img.convert("RGB")
+        if (self._key is None or url != self._key_url or img.size != self._key.size
+                or self._since_key + 1 >= self.keyframe_every):
+            return self._keyframe(data, img, rgb, url)
+        # getbbox on RGB: an RGBA bbox would only look at alpha
+        box = ImageChops.difference(self._key_rgb, rgb).getbbox() or (0, 0, 1, 1)
+        if (box[2] - box[0]) * (box[3] - box[1]) > self.max_area * img.width * img.height:
+            return self._keyframe(data, img, rgb, url)
+        buf = io.BytesIO()
+        img.crop(box).save(buf, "PNG")
+        payload = buf.getvalue()
+        self._since_key += 1
+        self.stats["deltas"] += 1
+        self.stats["bytes_written"] += len(payload)
+        return payload, {"offset": [box[0], box[1]], "frame_size": [img.width, img.height]}
+
+    def _keyframe(self, data: bytes, img: Optional[Image.Image] = None, rgb: Optional[Image.Image] = None,
+                  url: Optional[str] = None) -> Tuple[bytes, None]:
+        self._key, self._key_rgb, self._key_url = img, rgb, url
+        self._since_key = 0
+        self.keyframe_path = None
+        self.stats["keyframes"] += 1
+        self.stats["bytes_written"] += len(data)
+        return data, None
+
+
+def resolve_frame(shot: str, meta_path: Path) -> Path:
+    """Where a recorded screenshot is on disk. Task frames are looked up next to metadata.json first and blobs in
+    the dataset's own blob store, so a moved or copied dataset never reads the original's files."""
+    path = Path(shot.replace("\\", "/"))
+    local = (meta_path.parent.parent.parent / BLOB_DIR / path.parent.name if BLOB_DIR in path.parts else meta_path.parent) / path.name
+    return local if local.exists() or not path.exists() else path
+
+
+def compose(keyframe: Path, crop: Path, offset) -> Image.Image:
+    with Image.open(keyframe) as base, Image.open(crop) as patch:
+        frame = base.copy()
+        frame.paste(patch, tuple(offset))
+    return frame
+
+
+def reconstruct(step: Dict[str, Any], meta_path: Path) -> Optional[Image.Image]:
+    """The full frame for a step's screenshot, whether it was stored whole or as a delta."""
+    shot = step.get("screenshot")
+    if not shot:
+        return None
+    delta = step.get("delta")
+    if delta:
+        return compose(resolve_frame(delta["keyframe"], meta_path), resolve_frame(shot, meta_path), delta["offset"])
+    with Image.open(resolve_frame(shot, meta_path)) as im:
+        im.load()
+        return im
+
+
+def frame_bytes(step: Dict[str, Any], meta_path: Path) -> Optional[bytes]:
+    """PNG bytes of a step's full frame; keyframes are returned as stored, without re-encoding."""
+    shot = step.get("screenshot")
+    if not shot:
+        return None
+    if not step.get("delta"):
+        return resolve_frame(shot, meta_path).read_bytes()
+    buf = io.BytesIO()
+    reconstruct(step, meta_path).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def iter_frames(meta: Dict[str, Any], meta_path: Path) -> Iterator[Tuple[Dict[str, Any], Image.Image]]:
+    """(step, full frame) for every step with a screenshot, decoding each keyframe once."""
+    keyframes: Dict[str, Image.Image] = {}
+    for step in meta.get("steps", []):
+        shot, delta = step.get("screenshot"), step.get("delta")
+        if not shot:
+            continue
+        if not delta:
+            yield step, reconstruct(step, meta_path)
+            continue
+        if delta["keyframe"] not in keyframes:
+            keyframes.clear()
+            with Image.open(resolve_frame(delta["keyframe"], meta_path)) as im:
+                im.load()
+                keyframes[delta["keyframe"]] = im
+        frame = keyframes[delta["keyframe"]].copy()
+        with Image.open(resolve_frame(shot, meta_path)) as patch:
+            frame.paste(patch, tuple(delta["offset"]))
+        yield step, frame
@@ -0,0 +1,135 @@
+import asyncio
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from loguru import logger
+from PIL import Image
+
+FORMATS = {"png": ".png", "webp": ".webp", "jpeg": ".jpg"}
+
+
+class FrameWriter:
+    """Encodes and writes screenshots on a thread pool behind a bounded queue.
+
+    submit() blocks only when max_pending frames are already waiting, which keeps memory bounded when
+    many workflows capture at once. Each submitted frame gets a future resolved with its encode/write timings.
+    """
+
+    def __init__(self, fmt: str = "png", quality: int = 85, optimize: bool = False, thumbnails: bool = False,
+                 thumb_width: int = 320, threads: int = 2, max_pending: int = 16):
+        if fmt not in FORMATS:
+            raise ValueError(f"SCREENSHOT_FORMAT must be one of {list(FORMATS)}, got {fmt!r}")
+        self.fmt = fmt
+        self.quality = quality
+        self.optimize = optimize
+        self.thumbnails = thumbnails
+        self.thumb_width = thumb_width
+        self.threads = max(1, threads)
+        self.max_pending = max(1, max_pending)
+        self._queue: Optional[asyncio.Queue] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._workers: List[asyncio.Task] = []
+
+    @classmethod
+    def from_env(cls) -> "FrameWriter":
+        return cls(
+            fmt=os.getenv("SCREENSHOT_FORMAT", "png").lower(),
+            quality=int(os.getenv("SCREENSHOT_QUALITY", "85")),
+            optimize=str(os.getenv("SCREENSHOT_OPTIMIZE", "false")).lower() == "true",
+            thumbnails=str(os.getenv("SCREENSHOT_THUMBNAILS", "false")).lower() == "true",
+            threads=int(os.getenv("WRITER_THREADS", "2")),
+            max_pending=int(os.getenv("WRITER_QUEUE", "16")),
+        )
+
+    @property
+    def extension(self) -> str:
+        return FORMATS[self.fmt]
+
+    def _start(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="frame-writer")
+            self._workers = [asyncio.ensure_future(self._run()) for _ in range(self.threads)]
+
+    async def submit(self, data: bytes, path: Path, encode: bool = True) -> asyncio.Future:
+        """encode=False writes data as given (already a PNG that must stay lossless) whatever the format."""
+        self._start()
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((data, Path(path), encode, fut))
+        return fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            data, path, encode, fut = await self._queue.get()
+            try:
+                timing = await loop.run_in_executor(self._pool, self._encode_and_write, data, path, encode)
+                if not fut.done():
+                    fut.set_result(timing)
+            except Exception as e:
+                logger.warning(f"Writing {path} failed: {e}")
+                if not fut.done():
+                    fut.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    def _encode(self, data: bytes) -> Tuple[bytes, Optional[Image.Image]]:
+        img = None
+        if self.fmt != "png" or self.optimize or self.thumbnails:
+            img = Image.open(io.BytesIO(data))
+        if self.fmt == "png" and not self.optimize:
+            # Chromium already produced a PNG; write it untouched
+            return data, img
+        buf = io.BytesIO()
+        if self.fmt == "png":
+            img.save(buf, "PNG", optimize=True)
+        elif self.fmt == "webp":
+            img.save(buf, "WEBP", quality=self.quality, method=4)
+        else:
+            img.convert("RGB").save(buf, "JPEG", quality=self.quality, optimize=True)
+        return buf.getvalue(), img
+
+    @staticmethod
+    def _atomic_write(path: Path, payload: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Unique temp name: two writers may race on the same content-addressed path
+        tmp = path.with_name(f".{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+        tmp.write_bytes(payload)
+        os.replace(tmp, path)
+
+    def _encode_and_write(self, data: bytes, path: Path, encode: bool = True) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        if encode:
+            payload, img = self._encode(data)
+        else:
+            payload, img = data, Image.open(io.BytesIO(data)) if self.thumbnails else None
+        t1 = time.perf_counter()
+        self._atomic_write(path, payload)
+        t2 = time.perf_counter()
+        if self.thumbnails and img is not None:
+            thumb = img.convert("RGB")
+            thumb.thumbnail((self.thumb_width, self.thumb_width))
+            buf = io.BytesIO()
+            thumb.save(buf, "JPEG", quality=80)
+            self._atomic_write(path.parent / "thumbs" / f"{path.stem}.jpg", buf.getvalue())
+        t3 = time.perf_counter()
+        return {
+            "encode_ms": round((t1 - t0) * 1000, 2),
+            "write_ms": round((t2 - t1) * 1000, 2),
+            "thumb_ms": round((t3 - t2) * 1000, 2),
+            "bytes": len(payload),
+        }
+
+    async def close(self):
+        if self._queue is None:
+            return
+        await self._queue.join()
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._pool.shutdown(wait=True)
+        self._queue, self._pool, self._workers = None, None, []
@@ -1,14 +1,101 @@
-import json
+import os
+import time
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import orjson
+from loguru import logger
+
+JOURNAL_NAME = "metadata.journal.jsonl"
+FSYNC_POLICIES = ("always", "interval", "never")
+
+def task_slug(task: str) -> str:
+    from slugify import slugify
+    return slugify(task)[:80]
 
 class MetadataHandler:
-    def __init__(self, out_root: str):
+    """Streams each step to a JSONL journal as it happens and compacts it into metadata.json at the end.
+
+    A crash mid-workflow leaves the journal behind; recover() turns those into metadata.json files.
+    """
+
+    def __init__(self, out_root: str, fsync: Optional[str] = None, fsync_interval_s: Optional[float] = None):
         self.out_root = Path(out_root)
+        self.fsync = (fsync or os.getenv("METADATA_FSYNC", "interval")).lower()
+        if self.fsync not in FSYNC_POLICIES:
+            raise ValueError(f"METADATA_FSYNC must be one of {FSYNC_POLICIES}, got {self.fsync!r}")
+        self.fsync_interval_s = float(os.getenv("METADATA_FSYNC_INTERVAL_S", "1.0")) if fsync_interval_s is None else fsync_interval_s
+        self._journal = None
+        self._journal_path: Optional[Path] = None
+        self._last_sync = 0.0
 
-    def write(self, app: str, task: str, steps: List[Dict[str, Any]]):
-        from slugify import slugify
-        tslug = slugify(task)
-        td = self.out_root / app / tslug
+    def task_dir(self, app: str, task: str) -> Path:
+        td = self.out_root / app / task_slug(task)
         td.mkdir(parents=True, exist_ok=True)
-        (td / "metadata.json").write_text(json.dumps({"app": app, "task": task, "steps": steps}, indent=2))
+        return td
+
+    def begin(self, app: str, task: str, extra: Optional[Dict[str, Any]] = None):
+        self._journal_path = self.task_dir(app, task) / JOURNAL_NAME
+        self._journal = open(self._journal_path, "wb")
+        self._emit({"type": "header", "app": app, "task": task, "started_at": time.time(), **(extra or {})}, force_sync=True)
+
+    def append(self, step: Dict[str, Any]):
+        if self._journal is None:
+            return
+        self._emit({"type": "step", **step})
+
+    def _emit(self, record: Dict[str, Any], force_sync: bool = False):
+        self._journal.write(orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS))
+        self._journal.flush()
+        now = time.monotonic()
+        if self.fsync == "always" or force_sync or (self.fsync == "interval" and now - self._last_sync >= self.fsync_interval_s):
+            os.fsync(self._journal.fileno())
+            self._last_sync = now
+
+    def finalize(self, app: str, task: str, steps: List[Dict[str, Any]], extra: Optional[Dict[str, Any]] = None) -> Path:
+        """Write metadata.json from the in-memory steps (which may carry late fields) and drop the journal."""
+        path = self.write(app, task, steps, extra)
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+            self._journal_path.unlink(missing_ok=True)
+        return path
+
+    def write(self, app: str, task: str, steps: List[Dict[str, Any]], extra: Optional[Dict[str, Any]] = None) -> Path:
+        td = self.task_dir(app, task)
+        return _write_metadata(td, {"app": app, "task": task, **(extra or {}), "steps": steps})
+
+    @staticmethod
+    def recover(out_root: str) -> List[Path]:
+        """Rebuild metadata.json for every workflow whose run was interrupted before finalize()."""
+        recovered = []
+        for journal in sorted(Path(out_root).glob(f"*/*/{JOURNAL_NAME}")):
+            header: Dict[str, Any] = {}
+            steps: List[Dict[str, Any]] = []
+            for line in journal.read_bytes().splitlines():
+                try:
+                    record = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # Torn final line from the crash
+                    continue
+                kind = record.pop("type", "step")
+                if kind == "header":
+                    header = record
+                else:
+                    steps.append(record)
+            if not header:
+                logger.warning(f"Journal without header, skipping: {journal}")
+                continue
+            header.pop("started_at", None)
+            app, task = header.pop("app"), header.pop("task")
+            path = _write_metadata(journal.parent, {"app": app, "task": task, **header, "interrupted": True, "steps": steps})
+            journal.unlink()
+            logger.info(f"Recovered {len(steps)} steps into {path}")
+            recovered.append(path)
+        return recovered
+
+def _write_metadata(td: Path, data: Dict[str, Any]) -> Path:
+    path = td / "metadata.json"
+    tmp = td / "metadata.json.tmp"
+    tmp.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    os.replace(tmp, path)
+    return path
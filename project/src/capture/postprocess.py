@@ -0,0 +1,132 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+from loguru import logger
+from PIL import Image, ImageDraw
+
+from src.capture.blob_store import iter_metadata
+from src.capture.delta_frames import compose, resolve_frame
+
+ANNOTATED_DIR = "annotated"
+# Under ANNOTATED_DIR, never the task's thumbs/: FrameWriter writes unredacted thumbnails there
+THUMBS_DIR = "thumbs"
+
+
+def _scaled(box: Dict[str, float], scale: float, size) -> Optional[tuple]:
+    x0, y0 = max(0, round(box["x"] * scale)), max(0, round(box["y"] * scale))
+    x1, y1 = min(size[0], round((box["x"] + box["width"]) * scale)), min(size[1], round((box["y"] + box["height"]) * scale))
+    return (x0, y0, x1, y1) if x1 > x0 and y1 > y0 else None
+
+
+def process_frame(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Redact, annotate and thumbnail one frame; runs in a worker process and opens the image once."""
+    t0 = time.perf_counter()
+    if job.get("keyframe"):
+        img = compose(Path(job["keyframe"]), Path(job["src"]), job["offset"]).convert("RGB")
+    else:
+        with Image.open(job["src"]) as im:
+            img = im.convert("RGB")
+    viewport = job.get("viewport") or {}
+    # Boxes are CSS pixels; frames are device pixels (or downscaled screencast frames)
+    scale = img.width / viewport["width"] if viewport.get("width") else 1.0
+    draw = ImageDraw.Draw(img)
+    redacted = 0
+    for region in job.get("regions") or []:
+        box = _scaled(region, scale, img.size)
+        if box:
+            draw.rectangle(box, fill=job["redact_color"])
+            redacted += 1
+    if job.get("target_box"):
+        box = _scaled(job["target_box"], scale, img.size)
+        if box:
+            width = max(2, round(3 * scale))
+            pad = width
+            draw.rectangle((max(0, box[0] - pad), max(0, box[1] - pad), min(img.width - 1, box[2] + pad), min(img.height - 1, box[3] + pad)),
+                           outline=job["highlight_color"], width=width)
+    out, thumb = Path(job["out"]), Path(job["thumb"])
+    for p in (out, thumb):
+        p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(f".{out.name}.{os.getpid()}.tmp")
+    img.save(tmp, "PNG", compress_level=job["compress_level"])
+    os.replace(tmp, out)
+    img.thumbnail((job["thumb_width"], job["thumb_width"]))
+    tmp = thumb.with_name(f".{thumb.name}.{os.getpid()}.tmp")
+    img.save(tmp, "JPEG", quality=80)
+    os.replace(tmp, thumb)
+    return {"src": job["src"], "redacted": redacted, "ms": round((time.perf_counter() - t0) * 1000, 2)}
+
+
+class PostProcessor:
+    """Builds <task>/annotated/<frame>.png (sensitive regions blacked out, click target outlined) and a redacted
+    <task>/annotated/thumbs/<frame>.jpg for every recorded step, fanned out over a process pool.
+
+    Incremental: a frame is skipped when its outputs are newer than both the frame and its metadata.json.
+    Raw frames are never modified.
+    """
+
+    def __init__(self, out_root: str, workers: Optional[int] = None, thumb_width: Optional[int] = None):
+        self.out_root = Path(out_root)
+        self.workers = workers or int(os.getenv("POSTPROCESS_WORKERS", "0")) or os.cpu_count() or 1
+        self.thumb_width = thumb_width or int(os.getenv("THUMB_WIDTH", "320"))
+        self.compress_level = int(os.getenv("POSTPROCESS_PNG_LEVEL", "3"))
+
+    def jobs(self, app: Optional[str] = None, force: bool = False) -> Iterator[Dict[str, Any]]:
+        for meta_path, meta in iter_metadata(self.out_root):
+            if app and meta.get("app") != app:
+                continue
+            meta_mtime = meta_path.stat().st_mtime
+            task_dir = meta_path.parent
+            for step in meta.get("steps", []):
+                shots = [f["path"] for f in step.get("frames", [])] or [step.get("screenshot")]
+                for shot in filter(None, shots):
+                    src = resolve_frame(shot, meta_path)
+                    # Blob frames are named after their digest; use the per-task name for the outputs
+                    stem = Path(step["frame"]).stem if step.get("frame") and shot == step.get("screenshot") else src.stem
+                    out = task_dir / ANNOTATED_DIR / f"{stem}.png"
+                    thumb = task_dir / ANNOTATED_DIR / THUMBS_DIR / f"{stem}.jpg"
+                    # Delta frames are pasted back onto their keyframe first; the boxes are full-frame coordinates
+                    delta = step.get("delta") if shot == step.get("screenshot") else None
+                    keyframe = resolve_frame(delta["keyframe"], meta_path) if delta else None
+                    try:
+                        newest = max(src.stat().st_mtime, meta_mtime)
+                    except OSError:
+                        logger.warning(f"Missing frame {src} ({meta_path})")
+                        continue
+                    if not force and out.exists() and thumb.exists() and min(out.stat().st_mtime, thumb.stat().st_mtime) >= newest:
+                        continue
+                    # Intermediate screencast frames share the step's regions; the target box only fits the final frame
+                    yield {
+                        "src": str(src), "out": str(out), "thumb": str(thumb),
+                        "viewport": step.get("viewport"), "regions": step.get("sensitive_regions"),
+                        "target_box": step.get("target_box") if shot == step.get("screenshot") else None,
+                        "redact_color": (0, 0, 0), "highlight_color": (255, 45, 85),
+                        "thumb_width": self.thumb_width, "compress_level": self.compress_level,
+                        "keyframe": str(keyframe) if keyframe else None, "offset": delta["offset"] if delta else None,
+                    }
+
+    def run(self, app: Optional[str] = None, force: bool = False) -> Dict[str, Any]:
+        jobs: List[Dict[str, Any]] = list(self.jobs(app, force))
+        if not jobs:
+            logger.info("Post-processing: nothing to do")
+            return {"frames": 0, "workers": 0}
+        started = time.perf_counter()
+        done = failed = redacted = 0
+        workers = min(self.workers, len(jobs))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Jobs carry paths and boxes only; each worker reads and writes its own pixels
+            futures = [pool.submit(process_frame, job) for job in jobs]
+            for job, fut in zip(jobs, futures):
+                try:
+                    res = fut.result()
+                    done += 1
+                    redacted += res["redacted"]
+                except Exception as e:
+                    failed += 1
+                    logger.warning(f"Post-processing {job['src']} failed: {e}")
+        elapsed = time.perf_counter() - started
+        stats = {"frames": done, "failed": failed, "redacted_regions": redacted, "workers": workers,
+                 "elapsed_s": round(elapsed, 2), "frames_per_s": round(done / elapsed, 1) if elapsed else None}
+        logger.info(f"Post-processed {done} frames with {workers} workers in {elapsed:.1f}s ({stats['frames_per_s']} frames/s)")
+        return stats
@@ -0,0 +1,133 @@
+import asyncio
+import base64
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from loguru import logger
+from playwright.async_api import CDPSession, Page
+
+from src.capture.visual_diff import VisualScorer
+
+Frame = Tuple[float, bytes]
+
+
+def select_frames(frames: List[Frame], baseline: Optional[bytes], threshold: float, max_keep: int) -> List[Dict[str, Any]]:
+    """Pick the frames of one step worth keeping (runs in a worker process).
+
+    A frame is a candidate when it differs visibly from the last kept one (starting from the frame the step began on),
+    which catches transient toasts and mid-animation states as well as the final state. The last candidate always
+    stands for the step's end state and is kept; the remaining slots go to the highest-scoring candidates.
+    """
+    if not frames:
+        return []
+    scorer = VisualScorer(threshold)
+    if baseline is not None:
+        scorer.keep(scorer.score(baseline)[1])
+    candidates = []
+    for i, (ts, data) in enumerate(frames):
+        score, frame = scorer.score(data)
+        if scorer.is_significant(score):
+            candidates.append({"i": i, "ts": ts, "score": score})
+            scorer.keep(frame)
+    if not candidates:
+        return []
+    # Later frames did not change visibly from the last candidate: use the latest one, it is the settled state
+    last = {**candidates.pop(), "i": len(frames) - 1, "ts": frames[-1][0]}
+    keep = sorted(candidates, key=lambda c: -c["score"])[:max(0, max_keep - 1)] + [last]
+    keep.sort(key=lambda c: c["i"])
+    return [{**c, "data": frames[c["i"]][1], "final": c is last} for c in keep]
+
+
+class Screencast:
+    """Streams CDP screencast frames into a ring buffer and hands each finished step's frames to a worker process.
+
+    Selection for step N runs in the pool while the browser is already executing step N+1.
+    """
+
+    def __init__(self, page: Page, image_format: str = "png", max_frames: Optional[int] = None,
+                 threshold: float = 0.12, max_per_step: Optional[int] = None, quality: int = 80):
+        self.page = page
+        self.image_format = image_format
+        self.quality = quality
+        self.threshold = threshold
+        self.max_per_step = int(os.getenv("SCREENCAST_MAX_PER_STEP", "3")) if max_per_step is None else max_per_step
+        self.buffer: Deque[Frame] = deque(maxlen=int(os.getenv("SCREENCAST_BUFFER", "300")) if max_frames is None else max_frames)
+        self.frames_seen = 0
+        self.dropped = 0
+        self._cdp: Optional[CDPSession] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._step_start: Optional[float] = None
+        self._baseline: Optional[bytes] = None
+        self._selections: Dict[int, asyncio.Future] = {}
+
+    async def start(self):
+        self._cdp = await self.page.context.new_cdp_session(self.page)
+        self._cdp.on("Page.screencastFrame", self._on_frame)
+        viewport = self.page.viewport_size or {}
+        params: Dict[str, Any] = {"format": self.image_format, "everyNthFrame": 1}
+        if viewport:
+            params.update(maxWidth=viewport["width"], maxHeight=viewport["height"])
+        if self.image_format == "jpeg":
+            params["quality"] = self.quality
+        await self._cdp.send("Page.startScreencast", params)
+        self._pool = ProcessPoolExecutor(max_workers=int(os.getenv("SCREENCAST_WORKERS", "1")))
+
+    def _on_frame(self, params: Dict[str, Any]):
+        # Chromium stops sending frames until the previous one is acknowledged
+        asyncio.ensure_future(self._ack(params["sessionId"]))
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        ts = params.get("metadata", {}).get("timestamp") or time.time()
+        self.buffer.append((ts, base64.b64decode(params["data"])))
+        self.frames_seen += 1
+
+    async def _ack(self, session_id: int):
+        try:
+            await self._cdp.send("Page.screencastFrameAck", {"sessionId": session_id})
+        except Exception:
+            pass
+
+    def begin_step(self):
+        self._step_start = time.time()
+
+    def end_step(self, index: int):
+        """Close the step's frame window and submit it for selection."""
+        start, end = self._step_start or 0.0, time.time()
+        window = [f for f in self.buffer if start <= f[0] <= end]
+        # Frames before the window are no longer needed; keep the last one as the next baseline
+        while self.buffer and self.buffer[0][0] <= end:
+            self.buffer.popleft()
+        loop = asyncio.get_running_loop()
+        self._selections[index] = loop.run_in_executor(self._pool, select_frames, window, self._baseline, self.threshold, self.max_per_step)
+        if window:
+            self._baseline = window[-1][1]
+
+    async def selected(self, index: int) -> List[Dict[str, Any]]:
+        fut = self._selections.pop(index, None)
+        if fut is None:
+            return []
+        try:
+            return await fut
+        except Exception as e:
+            logger.warning(f"Screencast frame selection failed for step {index}: {e}")
+            return []
+
+    async def stop(self):
+        if self._cdp:
+            try:
+                await self._cdp.send("Page.stopScreencast")
+                await self._cdp.detach()
+            except Exception:
+                pass
+            self._cdp = None
+
+    async def close(self):
+        await self.stop()
+        if self._selections:
+            await asyncio.gather(*self._selections.values(), return_exceptions=True)
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        logger.info(f"Screencast: {self.frames_seen} frames received, {self.dropped} dropped from the ring buffer")
@@ -1,45 +1,128 @@
-import os
-import time
+import asyncio
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from loguru import logger
-from slugify import slugify
 from playwright.async_api import Page
+from src.agent.page_tracker import snapshot, signature
+from src.capture.visual_diff import VisualScorer
+from src.capture.frame_writer import FrameWriter
+from src.capture.blob_store import BlobStore
+from src.capture.delta_frames import DeltaEncoder
+from src.capture.metadata_handler import task_slug
+from src.utils import tracing
 
 class ScreenshotManager:
-    def __init__(self, out_root: str):
+    def __init__(self, out_root: str, scorer: Optional[VisualScorer] = None, writer: Optional[FrameWriter] = None,
+                 blobs: Optional[BlobStore] = None, delta: Optional[DeltaEncoder] = None):
         self.out_root = Path(out_root)
         self.out_root.mkdir(parents=True, exist_ok=True)
+        self.scorer = scorer
+        # A shared writer (batch mode) is closed by its owner; otherwise we own one
+        self._owns_writer = writer is None
+        self.writer = writer or FrameWriter.from_env()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.blobs = blobs
+        self.delta = delta
+        self.last_delta: Optional[Dict[str, Any]] = None
+        self.last_frame: Optional[str] = None
+        self.deduped = 0
         self.step_index = 0
+        self.last_score: Optional[float] = None
         self._last_url = None
-        self._last_dom_len = None
+        self._last_signature = None
 
     def task_dir(self, app: str, task: str) -> Path:
         app_dir = self.out_root / app
-        tslug = slugify(task)[:80]
-        td = app_dir / tslug
+        td = app_dir / task_slug(task)
         td.mkdir(parents=True, exist_ok=True)
         return td
 
-    async def capture(self, page: Page, app: str, task: str, description: str) -> str:
-        # Duplicate-state guard (same URL and DOM size)
+    async def capture(self, page: Page, app: str, task: str, description: str, state: Optional[Dict[str, Any]] = None) -> str:
+        with tracing.span("capture"):
+            return await self._capture(page, app, task, description, state)
+
+    async def _capture(self, page: Page, app: str, task: str, description: str, state: Optional[Dict[str, Any]] = None) -> str:
+        # Duplicate-state guard (same URL and mutation-tracker signature); reuse the detector's state when given
         try:
-            cur_url = page.url
-            dom_len = len(await page.content())
+            if state and state.get("signature"):
+                cur_url, sig = state.get("url"), state["signature"]
+            else:
+                snap = await snapshot(page)
+                cur_url, sig = snap.get("url"), signature(snap)
         except Exception:
             cur_url = None
-            dom_len = None
+            sig = None
 
-        if self._last_url == cur_url and self._last_dom_len == dom_len:
+        self.last_score = None
+        self.last_delta = None
+        frame = None
+        # Grab raw PNG bytes only; encoding and disk I/O happen on the writer's thread pool
+        with tracing.span("screenshot"):
+            data = await page.screenshot(full_page=False)
+        if self.scorer:
+            # Visual guard: compare downsampled pixels against the last kept frame
+            with tracing.span("visual_score"):
+                score, frame = await asyncio.to_thread(self.scorer.score, data)
+            self.last_score = score
+            if self._last_url == cur_url and not self.scorer.is_significant(score):
+                logger.info(f"Skipping screenshot (visual change {score:.3f} below threshold {self.scorer.threshold})")
+                return ""
+        elif self._last_url == cur_url and self._last_signature == sig:
             logger.info("Skipping screenshot (no state change detected)")
             return ""
 
+        if self.delta:
+            # Between keyframes only the changed region is written; metadata gets its offset and keyframe
+            with tracing.span("delta"):
+                data, delta = await asyncio.to_thread(self.delta.encode, data, cur_url)
+            path = await self.store(data, app, task, description, lossless=True)
+            if delta is None:
+                self.delta.keyframe_path = path
+            else:
+                self.last_delta = {"keyframe": self.delta.keyframe_path, **delta}
+        else:
+            path = await self.store(data, app, task, description)
+        if frame is not None:
+            self.scorer.keep(frame)
+        self._last_url, self._last_signature = cur_url, sig
+        return path
+
+    async def store(self, data: bytes, app: str, task: str, description: str, lossless: bool = False) -> str:
+        """Name a frame step-NN-<description> and queue it on the writer (also used for screencast frames).
+        lossless keeps PNG data as PNG whatever SCREENSHOT_FORMAT is."""
         self.step_index += 1
+        self.last_frame = None
         td = self.task_dir(app, task)
         dslug = description.lower().replace(" ", "-")[:70]
-        fname = f"step-{self.step_index:02d}-{dslug}.png"
+        ext = ".png" if lossless else self.writer.extension
+        fname = f"step-{self.step_index:02d}-{dslug}{ext}"
         path = td / fname
-        await page.screenshot(path=str(path), full_page=False)
+        self.last_frame = fname
+        if self.blobs:
+            # Content-addressed: identical frames from any task share one file
+            path = self.blobs.path_for(BlobStore.digest(data), ext)
+            if path.exists() or str(path) in self._pending:
+                self.deduped += 1
+            else:
+                self._pending[str(path)] = await self.writer.submit(data, path, encode=not lossless)
+        else:
+            self._pending[str(path)] = await self.writer.submit(data, path, encode=not lossless)
         logger.info(f"Captured screenshot: {path}")
-        self._last_url, self._last_dom_len = cur_url, dom_len
         return str(path)
+
+    async def flush(self) -> Dict[str, Dict[str, Any]]:
+        """Wait for this manager's queued frames; returns encode/write timings keyed by path."""
+        paths = list(self._pending)
+        results = await asyncio.gather(*(self._pending.pop(p) for p in paths), return_exceptions=True)
+        timings = {}
+        for p, res in zip(paths, results):
+            if isinstance(res, Exception):
+                logger.warning(f"Screenshot write failed: {p} | {res}")
+            else:
+                timings[p] = res
+        return timings
+
+    async def close(self):
+        await self.flush()
+        if self._owns_writer:
+            await self.writer.close()
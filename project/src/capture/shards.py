@@ -0,0 +1,309 @@
+import io
+import json
+import mmap
+import os
+import tarfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from loguru import logger
+from PIL import Image
+
+from src.capture.blob_store import BLOB_DIR
+
+MANIFEST_NAME = "manifest.json"
+BLOCK = tarfile.BLOCKSIZE
+
+
+def posix_path(path: str) -> str:
+    """Recorded paths may come from Windows ("dataset\\trello\\...\\step-01.png"); shards only use "/"."""
+    return path.replace("\\", "/")
+
+
+def shard_name(seq: int) -> str:
+    return f"shard-{seq:05d}"
+
+
+def _image_source(shot: str, meta_path: Path, out_root: Path) -> Path:
+    path = Path(posix_path(shot))
+    if BLOB_DIR in path.parts:
+        return out_root / BLOB_DIR / path.parent.name / path.name
+    return meta_path.parent / path.name
+
+
+def _add(tar: tarfile.TarFile, name: str, data: bytes, mtime: float) -> Tuple[int, int]:
+    """Append one member; returns (offset, size) of its data within the tar file."""
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    tar.addfile(info, io.BytesIO(data))
+    # addfile leaves tar.offset at the end of the block-padded data, whatever the header length was
+    return tar.offset - (len(data) + BLOCK - 1) // BLOCK * BLOCK, len(data)
+
+
+def write_shard(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Pack whole workflows into one tar shard plus its offsets index; runs in a worker process.
+
+    Members are <app>/<task>/metadata.json (paths rewritten to the member names) and the step images, so the
+    tar is self-describing. The .idx.json next to it lists one record per step with the image's data offset.
+    """
+    t0 = time.perf_counter()
+    out_root = Path(job["out_root"])
+    tar_path = Path(job["dest"]) / f"{job['shard']}.tar"
+    tmp = tar_path.with_name(f".{tar_path.name}.{os.getpid()}.tmp")
+    records: List[Dict[str, Any]] = []
+    done: Dict[str, float] = {}
+    missing = 0
+    with open(tmp, "wb") as fh, tarfile.open(fileobj=fh, mode="w", format=tarfile.PAX_FORMAT) as tar:
+        for wf in job["workflows"]:
+            meta_path = Path(wf["meta_path"])
+            try:
+                meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Shard export: skipping unreadable {meta_path}: {e}")
+                continue
+            key = wf["key"]
+            wf_records = []
+            members: Dict[str, str] = {}
+            for step in meta.get("steps", []):
+                record = {"workflow": key, "app": meta.get("app"), "task": meta.get("task"), "step": step, "image": None}
+                for n, shot in enumerate([step.get("screenshot")] + [f.get("path") for f in step.get("frames", [])]):
+                    if not shot:
+                        continue
+                    src = _image_source(shot, meta_path, out_root)
+                    # Blob frames are named after their digest; the member keeps the per-task name
+                    name = f"{key}/{step['frame'] if n == 0 and step.get('frame') else src.name}"
+                    try:
+                        data = src.read_bytes()
+                    except OSError:
+                        missing += 1
+                        logger.warning(f"Shard export: missing frame {src} ({meta_path})")
+                        continue
+                    span = _add(tar, name, data, src.stat().st_mtime)
+                    members[shot] = name
+                    if n == 0:
+                        step["screenshot"] = name
+                        record["image"] = span
+                    else:
+                        step["frames"][n - 1]["path"] = name
+                        record.setdefault("frames", []).append(span)
+                step.pop("frame", None)
+                if step.get("delta"):
+                    # Keyframes come earlier in the same workflow, so they are already packed
+                    step["delta"]["keyframe"] = members.get(step["delta"]["keyframe"], posix_path(step["delta"]["keyframe"]))
+                wf_records.append(record)
+            _add(tar, f"{key}/metadata.json", json.dumps(meta, indent=2).encode("utf-8"), wf["mtime"])
+            records.extend(wf_records)
+            done[key] = wf["mtime"]
+    os.replace(tmp, tar_path)
+    _write_index(tar_path.with_suffix(".idx.json"), records)
+    return {
+        "shard": job["shard"], "workflows": done, "records": len(records), "missing": missing,
+        "bytes": tar_path.stat().st_size, "ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
+
+
+def _write_index(path: Path, records: List[Dict[str, Any]]):
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(records), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+class ShardExporter:
+    """Streams dataset/<app>/<task>/ into ~shard_mb tar shards under dest, fanned out over a process pool.
+
+    Incremental: manifest.json remembers each workflow's metadata.json mtime and shard. Re-exporting packs only
+    new or changed workflows into new shards; the records they replace are dropped from the old shards' indexes,
+    and a shard left with no live records is deleted. Workflows are never split across shards.
+    """
+
+    def __init__(self, out_root: str, dest: str, shard_mb: Optional[float] = None, workers: Optional[int] = None):
+        self.out_root = Path(out_root)
+        self.dest = Path(dest)
+        self.shard_bytes = int((shard_mb or float(os.getenv("SHARD_SIZE_MB", "256"))) * 1024 * 1024)
+        self.workers = workers or int(os.getenv("SHARD_WORKERS", "0")) or os.cpu_count() or 1
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        try:
+            return json.loads((self.dest / MANIFEST_NAME).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {"version": 1, "next_shard": 0, "workflows": {}, "shards": {}}
+
+    def _save_manifest(self, manifest: Dict[str, Any]):
+        path = self.dest / MANIFEST_NAME
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def _scan(self) -> Dict[str, Tuple[Path, float, int]]:
+        """key -> (metadata.json, mtime, approximate packed size); stat only, nothing is parsed here."""
+        found = {}
+        for meta_path in sorted(self.out_root.glob("*/*/metadata.json")):
+            if meta_path.parent.parent.name.startswith("."):
+                continue
+            st = meta_path.stat()
+            size = st.st_size + sum(p.stat().st_size for p in meta_path.parent.iterdir() if p.is_file())
+            found[f"{meta_path.parent.parent.name}/{meta_path.parent.name}"] = (meta_path, st.st_mtime, size)
+        return found
+
+    def _drop(self, manifest: Dict[str, Any], stale: Dict[str, List[str]]) -> int:
+        """Remove superseded workflows from their shards' indexes; delete shards with nothing left."""
+        deleted = 0
+        for shard, keys in stale.items():
+            idx_path = self.dest / f"{shard}.idx.json"
+            try:
+                records = json.loads(idx_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                records = []
+            live = [r for r in records if r["workflow"] not in keys]
+            info = manifest["shards"].get(shard)
+            if live or (info and any(w not in keys for w in info.get("workflows", []))):
+                _write_index(idx_path, live)
+                if info:
+                    info["workflows"] = [w for w in info["workflows"] if w not in keys]
+                    info["records"] = len(live)
+            else:
+                (self.dest / f"{shard}.tar").unlink(missing_ok=True)
+                idx_path.unlink(missing_ok=True)
+                manifest["shards"].pop(shard, None)
+                deleted += 1
+        return deleted
+
+    def export(self, force: bool = False) -> Dict[str, Any]:
+        self.dest.mkdir(parents=True, exist_ok=True)
+        manifest = self._load_manifest()
+        if force:
+            manifest["workflows"] = {}
+        on_disk = self._scan()
+        known = manifest["workflows"]
+        pending = [k for k, (_, mtime, _) in on_disk.items() if force or known.get(k, {}).get("mtime") != mtime]
+        stale: Dict[str, List[str]] = {}
+        for key in list(known):
+            if key not in on_disk or key in pending:
+                stale.setdefault(known.pop(key)["shard"], []).append(key)
+        if force:
+            stale = {s: info.get("workflows", []) for s, info in manifest["shards"].items()}
+
+        # Fill shards in key order up to shard_bytes; a workflow bigger than a shard gets one of its own
+        jobs: List[Dict[str, Any]] = []
+        for key in pending:
+            meta_path, mtime, size = on_disk[key]
+            if not jobs or (jobs[-1]["size"] + size > self.shard_bytes and jobs[-1]["workflows"]):
+                jobs.append({"shard": shard_name(manifest["next_shard"]), "seq": manifest["next_shard"], "size": 0,
+                             "workflows": [], "out_root": str(self.out_root), "dest": str(self.dest)})
+                manifest["next_shard"] += 1
+            jobs[-1]["workflows"].append({"key": key, "meta_path": str(meta_path), "mtime": mtime})
+            jobs[-1]["size"] += size
+
+        started = time.perf_counter()
+        stats = {"shards": 0, "workflows": 0, "records": 0, "bytes": 0, "missing": 0, "failed": 0}
+        if jobs:
+            workers = min(self.workers, len(jobs))
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(write_shard, job) for job in jobs]
+                for job, fut in zip(jobs, futures):
+                    try:
+                        res = fut.result()
+                    except Exception as e:
+                        stats["failed"] += 1
+                        logger.warning(f"Shard export: {job['shard']} failed: {e}")
+                        continue
+                    for key, mtime in res["workflows"].items():
+                        known[key] = {"mtime": mtime, "shard": res["shard"]}
+                    manifest["shards"][res["shard"]] = {
+                        "seq": job["seq"], "bytes": res["bytes"], "records": res["records"],
+                        "workflows": sorted(res["workflows"]), "created_at": time.time(),
+                    }
+                    stats["shards"] += 1
+                    stats["workflows"] += len(res["workflows"])
+                    stats["records"] += res["records"]
+                    stats["bytes"] += res["bytes"]
+                    stats["missing"] += res["missing"]
+        # Superseded records are dropped only once their replacements are packed; the manifest goes last, so
+        # readers never see a shard that is still being written
+        deleted = self._drop(manifest, stale)
+        self._save_manifest(manifest)
+        elapsed = time.perf_counter() - started
+        stats.update({"unchanged": len(on_disk) - len(pending), "deleted_shards": deleted, "elapsed_s": round(elapsed, 2)})
+        logger.info(f"Shard export: {stats['workflows']} workflows into {stats['shards']} shards "
+                    f"({stats['bytes'] / 1e6:.1f} MB) in {elapsed:.1f}s, {stats['unchanged']} unchanged")
+        return stats
+
+
+class ShardReader:
+    """Iterates (record, image) over exported shards without copying image bytes.
+
+    Each shard is memory-mapped once and images come back as memoryview slices of the map; take bytes(view)
+    to keep one past close(). record is {"workflow", "app", "task", "step", "image": [offset, size]} with POSIX
+    member paths in step["screenshot"]; frame() decodes a record's full frame, rebuilding delta frames. For
+    parallel readers, give each worker its own (worker, workers) pair; for incremental reads, pass since= the
+    highest shard seq already consumed.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.manifest = json.loads((self.root / MANIFEST_NAME).read_text(encoding="utf-8"))
+        self._maps: Dict[str, mmap.mmap] = {}
+        self._spans: Dict[str, Dict[str, List[int]]] = {}
+
+    def shards(self, worker: int = 0, workers: int = 1, since: Optional[int] = None) -> List[str]:
+        names = sorted(self.manifest["shards"], key=lambda s: self.manifest["shards"][s]["seq"])
+        names = [s for s in names if since is None or self.manifest["shards"][s]["seq"] > since]
+        return names[worker::workers]
+
+    def index(self, shard: str) -> List[Dict[str, Any]]:
+        return json.loads((self.root / f"{shard}.idx.json").read_text(encoding="utf-8"))
+
+    def _map(self, shard: str) -> mmap.mmap:
+        if shard not in self._maps:
+            with open(self.root / f"{shard}.tar", "rb") as fh:
+                self._maps[shard] = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[shard]
+
+    def read(self, shard: str) -> Iterator[Tuple[Dict[str, Any], Optional[memoryview]]]:
+        view = memoryview(self._map(shard))
+        for record in self.index(shard):
+            span = record.get("image")
+            yield record, view[span[0]:span[0] + span[1]] if span else None
+
+    def frame(self, shard: str, record: Dict[str, Any]) -> Optional[Image.Image]:
+        """Decoded full frame for a record, pasting delta crops (SCREENSHOT_DELTA=on) onto their keyframe."""
+        span = record.get("image")
+        if not span:
+            return None
+        mm = self._map(shard)
+        img = Image.open(io.BytesIO(mm[span[0]:span[0] + span[1]]))
+        delta = record["step"].get("delta")
+        if not delta:
+            return img
+        if shard not in self._spans:
+            self._spans[shard] = {r["step"].get("screenshot"): r["image"] for r in self.index(shard) if r.get("image")}
+        k = self._spans[shard][delta["keyframe"]]
+        frame = Image.open(io.BytesIO(mm[k[0]:k[0] + k[1]]))
+        frame.load()
+        frame.paste(img, tuple(delta["offset"]))
+        return frame
+
+    def __iter__(self) -> Iterator[Tuple[Dict[str, Any], Optional[memoryview]]]:
+        return self.iter()
+
+    def iter(self, worker: int = 0, workers: int = 1, since: Optional[int] = None) -> Iterator[Tuple[Dict[str, Any], Optional[memoryview]]]:
+        for shard in self.shards(worker, workers, since):
+            yield from self.read(shard)
+
+    def close(self):
+        for shard, mm in list(self._maps.items()):
+            try:
+                mm.close()
+            except BufferError:
+                # A caller still holds a view into this shard; the map is released with it
+                pass
+            self._maps.pop(shard, None)
+
+    def __enter__(self) -> "ShardReader":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,67 @@
+import io
+from typing import List, Optional, Tuple
+from PIL import Image, ImageChops
+
+# Frames are compared as small grayscale thumbnails split into a grid of tiles. The score is the
+# largest fraction of changed pixels in any tile, so a dropdown or modal that changes one region
+# scores high while a spinner or blinking caret (a few pixels of one tile) stays near zero.
+THUMB_SIZE = (128, 80)
+GRID = (4, 4)
+PIXEL_DELTA = 24
+
+_CHANGED_LUT = [0] * PIXEL_DELTA + [255] * (256 - PIXEL_DELTA)
+
+
+def thumbnail(image_bytes: bytes) -> Image.Image:
+    img = Image.open(io.BytesIO(image_bytes))
+    img.draft("L", THUMB_SIZE)
+    img = img.convert("L")
+    factor = max(1, min(img.width // THUMB_SIZE[0], img.height // THUMB_SIZE[1]))
+    if factor > 1:
+        img = img.reduce(factor)
+    return img.resize(THUMB_SIZE, Image.BILINEAR)
+
+
+def dhash(thumb: Image.Image) -> int:
+    small = thumb.resize((9, 8), Image.BILINEAR)
+    px = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (px[row * 9 + col] > px[row * 9 + col + 1])
+    return bits
+
+
+def tile_scores(a: Image.Image, b: Image.Image) -> List[float]:
+    mask = ImageChops.difference(a, b).point(_CHANGED_LUT)
+    tw, th = THUMB_SIZE[0] // GRID[0], THUMB_SIZE[1] // GRID[1]
+    scores = []
+    for gy in range(GRID[1]):
+        for gx in range(GRID[0]):
+            tile = mask.crop((gx * tw, gy * th, (gx + 1) * tw, (gy + 1) * th))
+            scores.append(tile.histogram()[255] / (tw * th))
+    return scores
+
+
+class VisualScorer:
+    """Scores a frame against the last kept frame; 0.0 = identical, 1.0 = a whole tile changed."""
+
+    def __init__(self, threshold: float = 0.12):
+        self.threshold = threshold
+        self._last: Optional[Tuple[Image.Image, int]] = None
+
+    def score(self, image_bytes: bytes) -> Tuple[float, Tuple[Image.Image, int]]:
+        thumb = thumbnail(image_bytes)
+        frame = (thumb, dhash(thumb))
+        if self._last is None:
+            return 1.0, frame
+        last_thumb, last_hash = self._last
+        if last_hash == frame[1] and ImageChops.difference(last_thumb, thumb).getbbox() is None:
+            return 0.0, frame
+        return round(max(tile_scores(last_thumb, thumb)), 4), frame
+
+    def is_significant(self, score: float) -> bool:
+        return score >= self.threshold
+
+    def keep(self, frame: Tuple[Image.Image, int]):
+        self._last = frame
@@ -1,5 +1,5 @@
-from dataclasses import dataclass
-from typing import Optional, Dict
+from dataclasses import dataclass, field
+from typing import Any, Optional, Dict, List
 
 @dataclass
 class AppConfig:
@@ -7,24 +7,85 @@ class AppConfig:
     base_url: str
     login_url: Optional[str] = None
     workspace_url: Optional[str] = None
+    # Request routing: URL globs to abort on top of the shared tracker list, resource types to drop entirely
+    block_patterns: List[str] = field(default_factory=list)
+    block_resource_types: List[str] = field(default_factory=list)
+    cache_static: bool = True
+    # Cheap authenticated endpoint: a 2xx (without landing on login_url) means the saved session is still good
+    session_probe_url: Optional[str] = None
+    session_probe_method: str = "GET"
+    # Scheduler caps per domain (0 = uncapped): concurrent jobs across all workers, job starts per minute
+    max_concurrency: int = 4
+    starts_per_min: float = 0
+    # Clause templates for offline planning (src/utils/plan_templates.py): a "pattern" with {slots}, [optional words]
+    # and (a|b) alternatives, and the "steps" it expands to; the planner adds the goto to the workspace itself
+    templates: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def _click(description: str, selector: Dict[str, Any], wait_ms: int = 1500) -> Dict[str, Any]:
+    return {"description": description, "action": "click", "selector": selector, "wait_ms": wait_ms, "capture_hint": True}
+
+
+TRELLO_LIST = 'li[data-testid="list-wrapper"]:has(h2:text-is("{list}"))'
+TRELLO_TEMPLATES = [
+    {"pattern": "open {board} [from the home page]", "steps": [_click("Open {board}", {"text": "{board}"}, 2000)]},
+    {"pattern": "open the {board} board [from the home page]", "steps": [_click("Open {board} board", {"text": "{board}"}, 2000)]},
+    {"pattern": "[dismiss|accept] [the] cookie banner", "steps": [_click("Accept cookies", {"text": "Accept all"}, 1000)]},
+    {"pattern": "click add a card in the {list} list", "steps": [
+        _click("Click Add a card in {list}", {"css": f'{TRELLO_LIST} button[data-testid="list-add-card-button"]'}),
+    ]},
+    {"pattern": "add a card [called|named|titled] {title} [to|in] the {list} list", "steps": [
+        _click("Click Add a card in {list}", {"css": f'{TRELLO_LIST} button[data-testid="list-add-card-button"]'}),
+        {"description": "Type card title", "action": "type", "selector": {}, "input": "{title}", "wait_ms": 500, "capture_hint": True},
+        {"description": "Save card", "action": "press", "input": "Enter", "wait_ms": 1000, "capture_hint": True},
+    ]},
+    {"pattern": "click the first card in the {list} list", "steps": [
+        _click("Open first card in {list}", {"css": f'{TRELLO_LIST} li[data-testid="list-card"] >> nth=0'}, 2000),
+    ]},
+    {"pattern": "(open|click) the {card} card", "steps": [_click("Open card {card}", {"text": "{card}"}, 2000)]},
+    {"pattern": "click the {button} button", "steps": [_click("Click {button}", {"role": "button", "name": "{button}"})]},
+    {"pattern": "(open|click) [on] the card's {section}", "steps": [_click("Open {section}", {"text": "{section}"}, 1000)]},
+]
+
+NOTION_TEMPLATES = [
+    {"pattern": "(open|click) [on] the {page} page (from|in) the sidebar", "steps": [_click("Open {page}", {"text": "{page}"}, 2000)]},
+    {"pattern": "(open|click) [on] {item} in the sidebar [menu]", "steps": [_click("Click {item}", {"text": "{item}"}, 2000)]},
+    {"pattern": "(open|click) [on] the {page} page", "steps": [_click("Open {page}", {"text": "{page}"}, 2000)]},
+    {"pattern": "open its actions menu", "steps": [_click("Open actions menu", {"role": "button", "name": "More actions"}, 800)]},
+    {"pattern": "click the {button} button", "steps": [_click("Click {button}", {"role": "button", "name": "{button}"})]},
+    {"pattern": "search for {query}", "steps": [
+        _click("Open search", {"text": "Search"}, 1000),
+        {"description": "Type query", "action": "type", "selector": {}, "input": "{query}", "wait_ms": 1500, "capture_hint": True},
+    ]},
+]
 
 APPS: Dict[str, AppConfig] = {
     "trello": AppConfig(
         name="trello",
         base_url="https://trello.com",
         login_url="https://trello.com/login",
-        workspace_url="https://trello.com"
+        workspace_url="https://trello.com",
+        session_probe_url="https://trello.com/1/members/me?fields=id",
+        block_patterns=["*atl-paas.net/*/analytics*", "*api-private.atlassian.com/gasv3/*"],
+        block_resource_types=["media"],
+        templates=TRELLO_TEMPLATES,
     ),
     "notion": AppConfig(
         name="notion",
         base_url="https://www.notion.so",
         login_url="https://www.notion.so/login",
-        workspace_url="https://www.notion.so"
+        workspace_url="https://www.notion.so",
+        session_probe_url="https://www.notion.so/api/v3/getSpaces",
+        session_probe_method="POST",
+        block_patterns=["*notion.so/api/v3/etClient*", "*http-inputs-notion.splunkcloud.com/*"],
+        block_resource_types=["media"],
+        templates=NOTION_TEMPLATES,
     ),
     "linear": AppConfig(
         name="linear",
         base_url="https://linear.app",
         login_url="https://linear.app/login",
-        workspace_url="https://linear.app"
+        workspace_url="https://linear.app",
+        block_resource_types=["media"],
     ),
 }
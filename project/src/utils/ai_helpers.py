@@ -1,104 +1,333 @@
+import asyncio
 import os
 import json
-from typing import Any, Dict, List
+import time
+from typing import Any, Dict, List, Optional
 from loguru import logger
+from src.utils.plan_cache import PlanCache
+from src.utils.plan_templates import PlanTemplates
+
+ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-3-5-sonnet-latest")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+SYSTEM_PROMPT = (
+    "You plan UI automation steps for web applications. "
+    "Return ONLY valid JSON with this structure: {\"steps\": [{\"description\": \"...\", \"action\": \"...\", \"selector\": {...}, \"input\": \"...\", \"wait_ms\": 500, \"capture_hint\": true}]}\n\n"
+    "Actions: goto, click, hover, type, press, wait_for, scroll\n"
+    "Selectors: {\"role\": \"button\", \"name\": \"New page\"} OR {\"text\": \"Create\"} OR {\"placeholder\": \"Search...\"} OR {\"css\": \".button\"} OR {\"xpath\": \"//button[text()='OK']\"} OR {\"label\": \"Email\"}\n\n"
+    "CRITICAL TRELLO INSTRUCTIONS:\n"
+    "- FIRST STEP: If on Trello home, click on board name like {\"text\": \"My Trello board\"} to open it\n"
+    "- To dismiss cookie banner: Click {\"text\": \"Accept all\"} or {\"text\": \"Only necessary\"}, wait 1000ms\n"
+    "- To add card: Click {\"text\": \"Add a card\"} in the specific list, wait 1500ms, type into focused textarea, press Enter\n"
+    "- To open card: Click card name using {\"text\": \"Card Name Exact\"}\n"
+    "- Card modal buttons: {\"text\": \"Labels\"}, {\"text\": \"Members\"}, {\"text\": \"Dates\"}, {\"text\": \"Checklist\"}\n"
+    "- Input fields: {\"placeholder\": \"Enter a title for this card…\"} or focused element (no selector)\n"
+    "- ALWAYS wait 1500-2000ms after clicks that open modals/cards\n"
+    "- Use exact text matching: {\"text\": \"Add a card\"} not partial match\n\n"
+    "NOTION INSTRUCTIONS:\n"
+    "- FIRST STEP: From Notion home/workspace, click existing page from sidebar using {\"text\": \"Page Name\"}\n"
+    "- To open page: Click page title in sidebar: {\"text\": \"Budget Template\"}, {\"text\": \"Job Finder\"}, etc.\n"
+    "- Buttons work with: {\"text\": \"Share\"}, {\"text\": \"Settings\"}, {\"role\": \"button\", \"name\": \"...\"}\n"
+    "- AVOID page creation (New page/keyboard shortcuts don't work reliably)\n"
+    "- Focus on navigation, opening existing pages, clicking buttons, using search\n"
+    "- Wait 1500-2000ms after navigation for page to fully load\n\n"
+    "Keep steps concise (4-7 steps). Add wait_ms: 1500-2000 after clicks that open modals."
+)
+
+NEXT_STEP_PROMPT = (
+    "You operate a web application one UI action at a time to complete a task. "
+    "After each action you get the page's interactive elements as lines of `role \"name\" @region`: every element "
+    "after a navigation, otherwise only what changed (+ added, - removed).\n"
+    "Return ONLY valid JSON: {\"step\": {\"description\": \"...\", \"action\": \"...\", \"selector\": {...}, \"input\": \"...\", \"wait_ms\": 800}} "
+    "for the next action, or {\"done\": true} once the task is complete or cannot progress.\n\n"
+    "Actions: click, hover, type, press, wait_for, scroll, goto\n"
+    "Selectors: use a role and name from the element list, e.g. {\"role\": \"button\", \"name\": \"Share\"}; "
+    "{\"text\": \"...\"}, {\"placeholder\": \"...\"} and {\"label\": \"...\"} also work.\n"
+    "If the last action failed, pick a different element instead of repeating it."
+)
+
+class RateLimiter:
+    """Caps concurrent LLM calls and spaces their start times to stay under a requests/minute budget."""
+
+    def __init__(self, concurrency: int = 4, per_minute: float = 0):
+        self._sem = asyncio.Semaphore(max(1, concurrency))
+        self._interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next_at = 0.0
+
+    async def __aenter__(self):
+        await self._sem.acquire()
+        if self._interval:
+            now = time.monotonic()
+            start_at = max(now, self._next_at)
+            self._next_at = start_at + self._interval
+            if start_at > now:
+                await asyncio.sleep(start_at - now)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._sem.release()
 
 class AIClient:
     def __init__(self):
         self.anthropic_key = os.getenv("ANTHROPIC_API_KEY")
         self.openai_key = os.getenv("OPENAI_API_KEY")
-        self.provider = "anthropic" if self.anthropic_key else ("openai" if self.openai_key else None)
+        self.provider = os.getenv("AI_PROVIDER") or ("anthropic" if self.anthropic_key else ("openai" if self.openai_key else None))
+        self.client = None
+        self.aclient = None
 
         if self.provider == "anthropic":
             try:
-                from anthropic import Anthropic
+                from anthropic import Anthropic, AsyncAnthropic
                 self.client = Anthropic(api_key=self.anthropic_key)
+                self.aclient = AsyncAnthropic(api_key=self.anthropic_key)
             except Exception as e:
                 logger.warning(f"Anthropic client init failed: {e}")
                 self.provider = None
         elif self.provider == "openai":
             try:
-                from openai import OpenAI
+                from openai import OpenAI, AsyncOpenAI
                 self.client = OpenAI(api_key=self.openai_key)
+                self.aclient = AsyncOpenAI(api_key=self.openai_key)
             except Exception as e:
                 logger.warning(f"OpenAI client init failed: {e}")
                 self.provider = None
-        else:
-            self.client = None
+        elif self.provider == "stub":
+            # Offline stand-in for tests/benchmarks: heuristic plans after a configurable delay
+            self.stub_latency_s = int(os.getenv("STUB_PLANNER_LATENCY_MS", "500")) / 1000
+        elif self.provider:
+            logger.warning(f"Unknown AI_PROVIDER {self.provider!r}, using heuristic plans")
+            self.provider = None
+        self.cache = PlanCache.from_env()
+        # With an LLM available templates only stand in when it fails; without one they come first
+        self.templates = PlanTemplates.from_env(default_mode="fallback" if self.provider else "first")
+        self.limiter = RateLimiter(
+            concurrency=int(os.getenv("PLANNER_CONCURRENCY", "4")),
+            per_minute=float(os.getenv("PLANNER_RPM", "0")),
+        )
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.coalesced = 0
+
+    @property
+    def model(self) -> str:
+        if self.provider == "stub":
+            return "stub"
+        return ANTHROPIC_MODEL if self.provider == "anthropic" else OPENAI_MODEL
+
+    def _cached(self, key: str, app: str, task: str) -> Optional[Dict[str, Any]]:
+        if self.provider == "stub":
+            return None
+        cached = self.cache.get(key)
+        if cached:
+            logger.info(f"✓ Plan cache hit ({len(cached['steps'])} steps) for {app}: {task}")
+            return {**cached, "cache_key": key, "source": "cache"}
+        return None
+
+    @staticmethod
+    def _user_prompt(app: str, task: str, url: str) -> str:
+        return f"App: {app}\nTask: {task}\nStart URL: {url}\n\nGenerate automation steps."
+
+    def _accept(self, key: str, content: str, app: str, task: str, url: str) -> Optional[Dict[str, Any]]:
+        # Try to extract JSON if wrapped in markdown
+        if "```json" in content:
+            content = content.split("```json")[1].split("```")[0].strip()
+        elif "```" in content:
+            content = content.split("```")[1].split("```")[0].strip()
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError as e:
+            logger.warning(f"AI returned non-JSON response: {content[:200]}... | Error: {e}")
+            return None
+        if isinstance(data, dict) and "steps" in data and len(data["steps"]) > 0:
+            logger.info(f"✓ AI plan generated with {len(data['steps'])} steps")
+            if self.provider != "stub":
+                self.cache.put(key, data, app=app, task=task, url=url, model=self.model)
+            return {**data, "cache_key": key, "source": self.provider}
+        logger.warning(f"AI returned invalid plan structure: {data}")
+        return None
+
+    def _template_plan(self, app: str, task: str, url: str) -> Optional[Dict[str, Any]]:
+        if self.templates.mode != "first":
+            return None
+        data = self.templates.plan(app, task, url)
+        if data:
+            logger.info(f"✓ Template plan ({len(data['steps'])} steps) for {app}: {task}")
+        return data
 
     def plan(self, app: str, task: str, url: str) -> Dict[str, Any]:
+        templated = self._template_plan(app, task, url)
+        if templated:
+            return templated
         if not self.provider:
             logger.info("No AI provider configured, using heuristic plan")
             return self._heuristic_plan(app, task, url)
+
+        key = PlanCache.key(app, task, url, self.model, SYSTEM_PROMPT)
+        cached = self._cached(key, app, task)
+        if cached:
+            return cached
         
         logger.info(f"Planning with {self.provider} for {app}: {task}")
         try:
-            system_prompt = (
-                "You plan UI automation steps for web applications. "
-                "Return ONLY valid JSON with this structure: {\"steps\": [{\"description\": \"...\", \"action\": \"...\", \"selector\": {...}, \"input\": \"...\", \"wait_ms\": 500, \"capture_hint\": true}]}\n\n"
-                "Actions: goto, click, hover, type, press, wait_for, scroll\n"
-                "Selectors: {\"role\": \"button\", \"name\": \"New page\"} OR {\"text\": \"Create\"} OR {\"placeholder\": \"Search...\"} OR {\"css\": \".button\"} OR {\"xpath\": \"//button[text()='OK']\"} OR {\"label\": \"Email\"}\n\n"
-                "CRITICAL TRELLO INSTRUCTIONS:\n"
-                "- FIRST STEP: If on Trello home, click on board name like {\"text\": \"My Trello board\"} to open it\n"
-                "- To dismiss cookie banner: Click {\"text\": \"Accept all\"} or {\"text\": \"Only necessary\"}, wait 1000ms\n"
-                "- To add card: Click {\"text\": \"Add a card\"} in the specific list, wait 1500ms, type into focused textarea, press Enter\n"
-                "- To open card: Click card name using {\"text\": \"Card Name Exact\"}\n"
-                "- Card modal buttons: {\"text\": \"Labels\"}, {\"text\": \"Members\"}, {\"text\": \"Dates\"}, {\"text\": \"Checklist\"}\n"
-                "- Input fields: {\"placeholder\": \"Enter a title for this card…\"} or focused element (no selector)\n"
-                "- ALWAYS wait 1500-2000ms after clicks that open modals/cards\n"
-                "- Use exact text matching: {\"text\": \"Add a card\"} not partial match\n\n"
-                "NOTION INSTRUCTIONS:\n"
-                "- FIRST STEP: From Notion home/workspace, click existing page from sidebar using {\"text\": \"Page Name\"}\n"
-                "- To open page: Click page title in sidebar: {\"text\": \"Budget Template\"}, {\"text\": \"Job Finder\"}, etc.\n"
-                "- Buttons work with: {\"text\": \"Share\"}, {\"text\": \"Settings\"}, {\"role\": \"button\", \"name\": \"...\"}\n"
-                "- AVOID page creation (New page/keyboard shortcuts don't work reliably)\n"
-                "- Focus on navigation, opening existing pages, clicking buttons, using search\n"
-                "- Wait 1500-2000ms after navigation for page to fully load\n\n"
-                "Keep steps concise (4-7 steps). Add wait_ms: 1500-2000 after clicks that open modals."
-            )
+            user_prompt = self._user_prompt(app, task, url)
             
-            user_prompt = f"App: {app}\nTask: {task}\nStart URL: {url}\n\nGenerate automation steps."
-            
-            if self.provider == "anthropic":
+            if self.provider == "stub":
+                time.sleep(self.stub_latency_s)
+                content = json.dumps({"steps": self._heuristic_plan(app, task, url)["steps"]})
+            elif self.provider == "anthropic":
                 msg = self.client.messages.create(
-                    model="claude-3-5-sonnet-latest",
-                    system=system_prompt,
+                    model=ANTHROPIC_MODEL,
+                    system=SYSTEM_PROMPT,
                     max_tokens=2000,
                     messages=[{"role": "user", "content": user_prompt}]
                 )
                 content = msg.content[0].text if msg and msg.content else "{}"
             else:
                 resp = self.client.chat.completions.create(
-                    model="gpt-4o-mini",
+                    model=OPENAI_MODEL,
                     messages=[
-                        {"role": "system", "content": system_prompt},
+                        {"role": "system", "content": SYSTEM_PROMPT},
                         {"role": "user", "content": user_prompt}
                     ],
                     temperature=0.2
                 )
                 content = resp.choices[0].message.content
             
-            # Try to extract JSON if wrapped in markdown
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
-            
-            data = json.loads(content)
-            if isinstance(data, dict) and "steps" in data and len(data["steps"]) > 0:
-                logger.info(f"✓ AI plan generated with {len(data['steps'])} steps")
+            data = self._accept(key, content, app, task, url)
+            if data:
                 return data
-            else:
-                logger.warning(f"AI returned invalid plan structure: {data}")
-        except json.JSONDecodeError as e:
-            logger.warning(f"AI returned non-JSON response: {content[:200]}... | Error: {e}")
         except Exception as e:
             logger.warning(f"AI planning failed: {e}")
         
         logger.info("Falling back to heuristic plan")
         return self._heuristic_plan(app, task, url)
 
+    async def aplan(self, app: str, task: str, url: str) -> Dict[str, Any]:
+        """Event-loop friendly plan(): async SDK clients, rate limited, identical in-flight requests coalesced."""
+        templated = self._template_plan(app, task, url)
+        if templated:
+            return templated
+        if not self.provider:
+            return self._heuristic_plan(app, task, url)
+
+        key = PlanCache.key(app, task, url, self.model, SYSTEM_PROMPT)
+        cached = self._cached(key, app, task)
+        if cached:
+            return cached
+
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            logger.info(f"Joining in-flight plan request for {app}: {task}")
+        else:
+            fut = asyncio.ensure_future(self._aplan_uncached(key, app, task, url))
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shield so one cancelled waiter does not cancel the request for everyone else
+        return {**await asyncio.shield(fut)}
+
+    async def _aplan_uncached(self, key: str, app: str, task: str, url: str) -> Dict[str, Any]:
+        try:
+            async with self.limiter:
+                logger.info(f"Planning with {self.provider} for {app}: {task}")
+                user_prompt = self._user_prompt(app, task, url)
+                if self.provider == "stub":
+                    await asyncio.sleep(self.stub_latency_s)
+                    content = json.dumps({"steps": self._heuristic_plan(app, task, url)["steps"]})
+                elif self.provider == "anthropic":
+                    msg = await self.aclient.messages.create(
+                        model=ANTHROPIC_MODEL,
+                        system=SYSTEM_PROMPT,
+                        max_tokens=2000,
+                        messages=[{"role": "user", "content": user_prompt}]
+                    )
+                    content = msg.content[0].text if msg and msg.content else "{}"
+                else:
+                    resp = await self.aclient.chat.completions.create(
+                        model=OPENAI_MODEL,
+                        messages=[
+                            {"role": "system", "content": SYSTEM_PROMPT},
+                            {"role": "user", "content": user_prompt}
+                        ],
+                        temperature=0.2
+                    )
+                    content = resp.choices[0].message.content
+            data = self._accept(key, content, app, task, url)
+            if data:
+                return data
+        except Exception as e:
+            logger.warning(f"AI planning failed: {e}")
+
+        logger.info("Falling back to heuristic plan")
+        return self._heuristic_plan(app, task, url)
+
+    @staticmethod
+    def _parse_step(content: str) -> Dict[str, Any]:
+        if "```" in content:
+            content = content.split("```json" if "```json" in content else "```")[1].split("```")[0].strip()
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError:
+            logger.warning(f"AI returned non-JSON step: {content[:200]}")
+            return {"done": True, "reason": "unparseable reply"}
+        if isinstance(data, dict) and isinstance(data.get("step"), dict) and data["step"].get("action"):
+            return data["step"]
+        if isinstance(data, dict) and data.get("done"):
+            return {"done": True}
+        logger.warning(f"AI returned invalid step: {data}")
+        return {"done": True, "reason": "invalid step"}
+
+    async def next_step(self, app: str, task: str, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """Closed-loop planning: the next single step given the observation history, or {"done": True}."""
+        if not self.provider:
+            return {"done": True, "reason": "no AI provider"}
+        try:
+            async with self.limiter:
+                if self.provider == "stub":
+                    await asyncio.sleep(self.stub_latency_s)
+                    content = json.dumps(self._stub_next_step(task, messages))
+                elif self.provider == "anthropic":
+                    msg = await self.aclient.messages.create(
+                        model=ANTHROPIC_MODEL,
+                        system=NEXT_STEP_PROMPT,
+                        max_tokens=400,
+                        messages=messages,
+                    )
+                    content = msg.content[0].text if msg and msg.content else "{}"
+                else:
+                    resp = await self.aclient.chat.completions.create(
+                        model=OPENAI_MODEL,
+                        messages=[{"role": "system", "content": NEXT_STEP_PROMPT}, *messages],
+                        temperature=0.2,
+                    )
+                    content = resp.choices[0].message.content
+        except Exception as e:
+            logger.warning(f"AI step planning failed: {e}")
+            return {"done": True, "reason": str(e)}
+        return self._parse_step(content)
+
+    @staticmethod
+    def _stub_next_step(task: str, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """Offline stand-in: click the longest element name that appears in the task text and was not clicked yet."""
+        done = {json.loads(m["content"]).get("step", {}).get("selector", {}).get("name") for m in messages if m["role"] == "assistant"}
+        task_lower = task.lower()
+        best = None
+        for line in messages[-1]["content"].splitlines():
+            line = line[2:] if line.startswith("+ ") else line
+            role, _, rest = line.partition(' "')
+            name = rest.split('"', 1)[0]
+            if not rest or " " in role or len(name) < 3 or name in done or name.lower() not in task_lower:
+                continue
+            if best is None or len(name) > len(best[1]):
+                best = (role, name)
+        if best is None:
+            return {"done": True}
+        return {"step": {"description": f"Click {best[1]}", "action": "click", "selector": {"role": best[0], "name": best[1]}, "wait_ms": 800}}
+
     def _heuristic_plan(self, app: str, task: str, url: str) -> Dict[str, Any]:
+        # In "fallback" mode templates are tried only once the LLM is unavailable or failed ("first" already did)
+        templated = self.templates.plan(app, task, url) if self.templates.mode == "fallback" else None
+        if templated:
+            return templated
         logger.info(f"Using heuristic plan for {app}")
         # More targeted exploratory strategy: fewer steps, longer waits, better selectors
         plan: List[Dict[str, Any]] = [
@@ -144,4 +373,4 @@ class AIClient:
             "capture_hint": True
         })
         
-        return {"steps": plan}
+        return {"steps": plan, "source": "heuristic"}
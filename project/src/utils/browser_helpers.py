@@ -1,11 +1,19 @@
 import os
-import time
-from typing import Optional
+from typing import Dict, Optional
 from loguru import logger
-from playwright.async_api import async_playwright, BrowserContext, Page
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page
+from src.agent.page_tracker import install_tracker
+from src.config.app_configs import AppConfig
+from src.utils.request_router import RequestRouter
+from src.utils.session_manager import SessionManager
+
+LAUNCH_ARGS = ["--disable-blink-features=AutomationControlled"]
+VIEWPORT = {"width": 1400, "height": 900}
 
 class BrowserManager:
-    def __init__(self, headless: Optional[bool] = None, profile: Optional[str] = None, navigation_timeout_ms: int = 20000):
+    def __init__(self, headless: Optional[bool] = None, profile: Optional[str] = None, navigation_timeout_ms: int = 20000,
+                 router: Optional[RequestRouter] = None):
+        self.router = router
         self.headless = (str(os.getenv("HEADLESS", "false")).lower() == "true") if headless is None else headless
         self.profile = os.getenv("PERSISTENT_PROFILE", ".playwright") if profile is None else profile
         self.navigation_timeout_ms = int(os.getenv("NAVIGATION_TIMEOUT_MS", str(navigation_timeout_ms)))
@@ -17,11 +25,14 @@ class BrowserManager:
         self.context = await self._pw.chromium.launch_persistent_context(
             user_data_dir=self.profile,
             headless=self.headless,
-            args=["--disable-blink-features=AutomationControlled"],
-            viewport={"width": 1400, "height": 900},
-            slow_mo=50,
+            args=LAUNCH_ARGS,
+            viewport=VIEWPORT,
+            slow_mo=int(os.getenv("SLOW_MO_MS", "50")),
         )
         self.context.set_default_navigation_timeout(self.navigation_timeout_ms)
+        await install_tracker(self.context)
+        if self.router:
+            await self.router.install(self.context)
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
@@ -38,31 +49,75 @@ class BrowserManager:
         page.set_default_navigation_timeout(self.navigation_timeout_ms)
         return page
 
-    @staticmethod
-    async def ensure_logged_in(page: Page, login_url: Optional[str], manual: bool = False):
-        if not login_url:
-            return
-        if manual:
-            logger.info("Manual login enabled. Navigating to login page and waiting for user action.")
-            await page.goto(login_url)
-            logger.info("Please complete login in the opened browser window. Waiting 90s...")
-            await page.wait_for_timeout(90000)
-            return
-        logger.info("Attempting password-based login via environment variables (if present).")
-        await page.goto(login_url)
-        # Best-effort: try to find email/password fields by role/placeholder, but do not hardcode selectors
+
+class SharedBrowser:
+    """One Chromium process handing out isolated contexts seeded from the app's saved session (or the persistent profile)."""
+
+    def __init__(self, headless: Optional[bool] = None, profile: Optional[str] = None, navigation_timeout_ms: int = 20000,
+                 sessions: Optional[SessionManager] = None, slow_mo_ms: Optional[int] = None):
+        self.sessions = sessions
+        self.slow_mo_ms = int(os.getenv("SLOW_MO_MS", "50")) if slow_mo_ms is None else slow_mo_ms
+        self.headless = (str(os.getenv("HEADLESS", "false")).lower() == "true") if headless is None else headless
+        self.profile = os.getenv("PERSISTENT_PROFILE", ".playwright") if profile is None else profile
+        self.navigation_timeout_ms = int(os.getenv("NAVIGATION_TIMEOUT_MS", str(navigation_timeout_ms)))
+        self._pw = None
+        self.browser: Optional[Browser] = None
+        self.storage_state: Optional[dict] = None
+        # One router per app so its blocklist applies and its stats add up across workers
+        self.routers: Dict[str, Optional[RequestRouter]] = {}
+
+    async def __aenter__(self):
+        self._pw = await async_playwright().start()
+        self.storage_state = await self._export_profile_state()
+        self.browser = await self._pw.chromium.launch(headless=self.headless, args=LAUNCH_ARGS, slow_mo=self.slow_mo_ms)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if self.browser:
+                await self.browser.close()
+        finally:
+            if self._pw:
+                await self._pw.stop()
+
+    async def _export_profile_state(self) -> Optional[dict]:
+        # Persistent contexts cannot spawn sibling contexts, so copy cookies/localStorage out once
+        if not os.path.isdir(self.profile):
+            logger.info(f"No persistent profile at {self.profile}; contexts start logged out")
+            return None
+        ctx = await self._pw.chromium.launch_persistent_context(user_data_dir=self.profile, headless=True, args=LAUNCH_ARGS)
         try:
-            email = os.getenv("EMAIL") or None
-            password = os.getenv("PASSWORD") or None
-            if email and password:
-                inp = page.get_by_role("textbox").first
-                await inp.fill(email)
-                await page.get_by_role("textbox").nth(1).fill(password)
-                await page.get_by_role("button", name="Log in").first.click()
-                await page.wait_for_load_state("networkidle")
-            else:
-                logger.info("Credentials not provided; waiting for manual login for 60s.")
-                await page.wait_for_timeout(60000)
+            return await ctx.storage_state()
         except Exception as e:
-            logger.warning(f"Login helper encountered an issue: {e}")
-            await page.wait_for_timeout(30000)
+            logger.warning(f"Could not export storage state from {self.profile}: {e}")
+            return None
+        finally:
+            await ctx.close()
+
+    async def new_context(self, cfg: Optional[AppConfig] = None) -> BrowserContext:
+        assert self.browser
+        state = self.storage_state
+        if cfg is not None and self.sessions and self.sessions.state(cfg.name):
+            state = self.sessions.state(cfg.name)
+        context = await self.browser.new_context(storage_state=state, viewport=VIEWPORT)
+        context.set_default_navigation_timeout(self.navigation_timeout_ms)
+        await install_tracker(context)
+        if cfg is not None:
+            if cfg.name not in self.routers:
+                self.routers[cfg.name] = RequestRouter.from_env(cfg)
+            if self.routers[cfg.name]:
+                await self.routers[cfg.name].install(context)
+        return context
+
+    async def ensure_session(self, cfg: AppConfig, manual: bool = False) -> bool:
+        """Probe (and if needed refresh) cfg's saved session once, before workers start sharing it."""
+        if not self.sessions:
+            return False
+        context = await self.new_context(cfg)
+        try:
+            return await self.sessions.ensure(context, cfg, manual=manual, interactive=not self.headless)
+        finally:
+            await context.close()
+
+    def network_stats(self) -> Dict[str, Dict[str, int]]:
+        return {app: dict(r.stats) for app, r in self.routers.items() if r}
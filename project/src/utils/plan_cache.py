@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+from loguru import logger
+
+MODES = ("on", "off", "refresh")
+
+def normalize_task(task: str) -> str:
+    return re.sub(r"\s+", " ", task.strip().lower()).rstrip(".!?")
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+class PlanCache:
+    """On-disk LLM plan cache, one JSON file per key; file mtime doubles as the LRU clock."""
+
+    def __init__(self, root: str = ".plan_cache", mode: str = "on", max_entries: int = 2000,
+                 max_bytes: int = 50 * 1024 * 1024, max_age_s: float = 14 * 86400):
+        if mode not in MODES:
+            raise ValueError(f"PLAN_CACHE must be one of {MODES}, got {mode!r}")
+        self.root = Path(root)
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "rejected_failed": 0}
+
+    @classmethod
+    def from_env(cls) -> "PlanCache":
+        return cls(
+            root=os.getenv("PLAN_CACHE_DIR", ".plan_cache"),
+            mode=os.getenv("PLAN_CACHE", "on").lower(),
+            max_entries=int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "2000")),
+            max_bytes=int(os.getenv("PLAN_CACHE_MAX_MB", "50")) * 1024 * 1024,
+            max_age_s=float(os.getenv("PLAN_CACHE_MAX_AGE_DAYS", "14")) * 86400,
+        )
+
+    @staticmethod
+    def key(app: str, task: str, url: str, model: str, system_prompt: str) -> str:
+        raw = "\x1f".join([app, normalize_task(task), url.rstrip("/"), model, prompt_hash(system_prompt)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.mode != "on":
+            return None
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self.stats["misses"] += 1
+            return None
+        if entry.get("failed"):
+            self.stats["rejected_failed"] += 1
+            self.stats["misses"] += 1
+            return None
+        if time.time() - entry.get("created_at", 0) > self.max_age_s:
+            path.unlink(missing_ok=True)
+            self.stats["evictions"] += 1
+            self.stats["misses"] += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.stats["hits"] += 1
+        return entry.get("plan")
+
+    def put(self, key: str, plan: Dict[str, Any], **info: Any):
+        if self.mode == "off":
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        entry = {"key": key, "created_at": time.time(), "failed": False, "plan": plan, **info}
+        tmp = self._path(key).with_suffix(".tmp")
+        tmp.write_text(json.dumps(entry), encoding="utf-8")
+        os.replace(tmp, self._path(key))
+        self.stats["stores"] += 1
+        self.evict()
+
+    def mark_failed(self, key: str):
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        entry["failed"] = True
+        entry["failed_at"] = time.time()
+        path.write_text(json.dumps(entry), encoding="utf-8")
+        logger.info(f"Plan cache entry {key[:12]} marked failed; it will not be served again")
+
+    def evict(self):
+        try:
+            files = [(p, p.stat()) for p in self.root.glob("*.json")]
+        except OSError:
+            return
+        now = time.time()
+        # Least recently used first
+        files.sort(key=lambda f: f[1].st_mtime)
+        total = sum(st.st_size for _, st in files)
+        count = len(files)
+        for p, st in files:
+            too_old = now - st.st_mtime > self.max_age_s
+            if not too_old and count <= self.max_entries and total <= self.max_bytes:
+                continue
+            p.unlink(missing_ok=True)
+            count -= 1
+            total -= st.st_size
+            self.stats["evictions"] += 1
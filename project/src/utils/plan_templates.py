@@ -0,0 +1,304 @@
+import json
+import os
+import re
+import time
+from itertools import product
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from loguru import logger
+
+from src.config.app_configs import APPS
+
+MODES = ("first", "fallback", "off")
+# Words that join two clauses of one task: "open X and click Y", "click X, then Y"
+CONNECTORS = (("and", "then"), ("and",), ("then",), (",", "then"), (",",))
+# A slot value never spans a connector, so "click the {button} button" cannot swallow "... and invite Bob"
+STOP_WORDS = {c[0] for c in CONNECTORS}
+MAX_SLOT_WORDS = 8
+SLOT = re.compile(r"\{(\w+)\}")
+GROUP = re.compile(r"\[[^\]]*\]|\([^)]*\)|\S+")
+# Selector fields (and the step input) whose literal values promotion turns into slots
+SLOT_FIELDS = ("text", "name", "placeholder", "label")
+
+
+def tokenize(text: str) -> List[str]:
+    """Words with surrounding quotes/punctuation stripped; commas kept as their own token (clause breaks)."""
+    tokens = []
+    for raw in text.replace(",", " , ").split():
+        word = raw if raw == "," else raw.strip("\"'“”‘’.!?:;()")
+        if word:
+            tokens.append(word)
+    return tokens
+
+
+def _expand(pattern: str) -> List[List[str]]:
+    """"(open|click) [on] the {page} page [in the sidebar]" -> every concrete token sequence.
+
+    [a|b c] is optional and (a|b c) required; either may hold several alternatives of one or more words.
+    """
+    options = []
+    for group in GROUP.findall(pattern.lower().replace(",", " , ")):
+        if group[0] in "[(":
+            alts = [alt.split() for alt in group[1:-1].split("|")]
+            options.append(alts + [[]] if group[0] == "[" else alts)
+        else:
+            options.append([[group]])
+    return [[w for alt in combo for w in alt] for combo in product(*options)]
+
+
+def _css_escape(text: str) -> str:
+    # Only quotes and backslashes need escaping inside a CSS string; URLs (the {url} slot) have neither
+    return text.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _fill(value: Any, slots: Dict[str, str], css: bool = False) -> Any:
+    """Substitute {slot}s. In a "css" selector the slots sit inside quoted strings (h2:text-is("{list}")), so their
+    values are escaped as CSS string content; a quote or backslash in a list name would otherwise break the selector."""
+    if isinstance(value, str):
+        if css:
+            return SLOT.sub(lambda m: _css_escape(slots[m.group(1)]) if m.group(1) in slots else m.group(0), value)
+        return SLOT.sub(lambda m: slots.get(m.group(1), m.group(0)), value)
+    if isinstance(value, dict):
+        return {k: _fill(v, slots, css=k == "css") for k, v in value.items()}
+    if isinstance(value, list):
+        return [_fill(v, slots) for v in value]
+    return value
+
+
+class _Node:
+    __slots__ = ("children", "slot", "terminals")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.slot: Optional["_Node"] = None
+        # (template number, slot names in order, literal token count)
+        self.terminals: List[Tuple[int, List[str], int]] = []
+
+
+class TemplateIndex:
+    """Token trie over one app's clause templates.
+
+    Literal words are trie edges and every {slot} is a wildcard edge that swallows 1..MAX_SLOT_WORDS words (never
+    a connector), so
+    matching a clause costs a walk over its few tokens regardless of how many templates exist. When several
+    templates match, the one with the most literal words wins (the most specific).
+    """
+
+    def __init__(self, templates: List[Dict[str, Any]]):
+        self.templates = templates
+        self.root = _Node()
+        for n, tpl in enumerate(templates):
+            for tokens in _expand(tpl["pattern"]):
+                node, names = self.root, []
+                for tok in tokens:
+                    m = SLOT.fullmatch(tok)
+                    if m:
+                        names.append(m.group(1))
+                        node.slot = node.slot or _Node()
+                        node = node.slot
+                    else:
+                        node = node.children.setdefault(tok, _Node())
+                node.terminals.append((n, names, len(tokens) - len(names)))
+
+    def match(self, tokens: List[str]) -> Optional[Tuple[int, Dict[str, str], int]]:
+        """Best (template number, slot values, literal word count) covering all of tokens, or None."""
+        lower = [t.lower() for t in tokens]
+        best: Optional[Tuple[Tuple[int, int, int], List[Tuple[int, int]], Tuple[int, List[str], int]]] = None
+
+        def walk(node: _Node, i: int, spans: List[Tuple[int, int]]):
+            nonlocal best
+            if i == len(tokens):
+                for term in node.terminals:
+                    # More literal words first, then shorter slot values, then earlier (hand-written) templates
+                    score = (term[2], -sum(e - s for s, e in spans), -term[0])
+                    if best is None or score > best[0]:
+                        best = (score, list(spans), term)
+                return
+            child = node.children.get(lower[i])
+            if child:
+                walk(child, i + 1, spans)
+            if node.slot:
+                for j in range(i + 1, min(len(tokens), i + MAX_SLOT_WORDS) + 1):
+                    if lower[j - 1] in STOP_WORDS:
+                        break
+                    spans.append((i, j))
+                    walk(node.slot, j, spans)
+                    spans.pop()
+
+        walk(self.root, 0, [])
+        if best is None:
+            return None
+        _, spans, (n, names, literals) = best
+        return n, {name: " ".join(tokens[s:e]) for name, (s, e) in zip(names, spans)}, literals
+
+
+class PlanTemplates:
+    """Per-app plan templates: the hand-written ones on AppConfig.templates plus ones learned from LLM plans that
+    succeeded (kept in <root>/<app>.json). A task is matched whole or as clauses joined by "and"/"then"; each
+    clause's steps are filled in and the plan starts with a goto to the workspace.
+    """
+
+    def __init__(self, root: str = ".plan_templates", mode: str = "first", max_cached: int = 4096):
+        if mode not in MODES:
+            raise ValueError(f"PLAN_TEMPLATES must be one of {MODES}, got {mode!r}")
+        self.root = Path(root)
+        self.mode = mode
+        self._indexes: Dict[str, TemplateIndex] = {}
+        self._covers: Dict[Tuple[str, Tuple[str, ...]], Optional[tuple]] = {}
+        self.max_cached = max_cached
+        self.stats = {"hits": 0, "misses": 0, "promoted": 0, "demoted": 0}
+
+    @classmethod
+    def from_env(cls, default_mode: str = "first") -> "PlanTemplates":
+        return cls(root=os.getenv("PLAN_TEMPLATE_DIR", ".plan_templates"), mode=os.getenv("PLAN_TEMPLATES", default_mode).lower())
+
+    def _learned_path(self, app: str) -> Path:
+        return self.root / f"{app}.json"
+
+    def learned(self, app: str) -> List[Dict[str, Any]]:
+        try:
+            return json.loads(self._learned_path(app).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return []
+
+    def _save_learned(self, app: str, templates: List[Dict[str, Any]]):
+        path = self._learned_path(app)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(templates, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+        self._indexes.pop(app, None)
+        self._covers = {k: v for k, v in self._covers.items() if k[0] != app}
+
+    def index(self, app: str) -> TemplateIndex:
+        if app not in self._indexes:
+            cfg = APPS.get(app)
+            self._indexes[app] = TemplateIndex((cfg.templates if cfg else []) + self.learned(app))
+        return self._indexes[app]
+
+    def _cover(self, app: str, tokens: Tuple[str, ...]) -> Optional[Tuple[Tuple[int, Tuple[Tuple[str, str], ...]], ...]]:
+        """Split tokens into clauses at connectors so every clause matches a template, preferring the split with the
+        most literal words, then the fewest clauses. Returns (template number, slots) per clause."""
+        index = self.index(app)
+        n = len(tokens)
+        lower = [t.lower() for t in tokens]
+        # Clause ends: the end of the task and every connector; a clause can only start at 0 or right after one
+        breaks: Dict[int, List[int]] = {}
+        for end in range(1, n):
+            for c in CONNECTORS:
+                if tuple(lower[end:end + len(c)]) == c:
+                    breaks.setdefault(end, []).append(end + len(c))
+        memo: Dict[int, Optional[Tuple[int, int, list]]] = {n: (0, 0, [])}
+
+        def solve(i: int) -> Optional[Tuple[int, int, list]]:
+            if i in memo:
+                return memo[i]
+            found = None
+            for end in [e for e in breaks if e > i] + [n]:
+                m = index.match(list(tokens[i:end]))
+                if m is None:
+                    continue
+                t, slots, literals = m
+                for nxt in breaks.get(end, [n]):
+                    rest = solve(nxt)
+                    if rest is None:
+                        continue
+                    cand = (rest[0] - literals, rest[1] + 1, [(t, tuple(slots.items()))] + rest[2])
+                    if found is None or cand[:2] < found[:2]:
+                        found = cand
+            memo[i] = found
+            return found
+
+        best = solve(0)
+        return tuple(best[2]) if best else None
+
+    def plan(self, app: str, task: str, url: str) -> Optional[Dict[str, Any]]:
+        if self.mode == "off":
+            return None
+        tokens = tuple(tokenize(task))
+        key = (app, tokens)
+        if key not in self._covers:
+            if len(self._covers) >= self.max_cached:
+                self._covers.clear()
+            self._covers[key] = self._cover(app, tokens) if tokens else None
+        cover = self._covers[key]
+        if not cover:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        index = self.index(app)
+        steps: List[Dict[str, Any]] = [
+            {"description": f"Navigate to {app} workspace", "action": "goto", "selector": {"css": url}, "wait_ms": 2000, "capture_hint": True}
+        ]
+        patterns = []
+        for n, slots in cover:
+            tpl = index.templates[n]
+            patterns.append(tpl["pattern"])
+            steps.extend(_fill(tpl["steps"], {**dict(slots), "url": url}))
+        return {"steps": steps, "source": "template", "templates": patterns}
+
+    def promote(self, app: str, task: str, plan: Dict[str, Any], url: str) -> Optional[Dict[str, Any]]:
+        """Turn a plan that just succeeded into a template: literal values that also appear in the task become slots."""
+        steps = [s for s in plan.get("steps", []) if not (s.get("action") == "goto" and (s.get("selector") or {}).get("css", "").rstrip("/") == url.rstrip("/"))]
+        if not steps:
+            return None
+        tokens = tokenize(task)
+        lower = [t.lower() for t in tokens]
+        values = set()
+        for s in steps:
+            sel = s.get("selector") or {}
+            values.update(str(sel[f]) for f in SLOT_FIELDS if sel.get(f))
+            if s.get("action") == "type" and s.get("input"):
+                values.add(str(s["input"]))
+        # Longest values first so "This Week" is not claimed by a step that only clicks "Week"
+        spans: Dict[int, Tuple[int, str]] = {}
+        taken = [False] * len(lower)
+        for value in sorted(values, key=lambda v: (-len(v), v)):
+            vt = [t.lower() for t in tokenize(value)]
+            for i in range(len(lower) - len(vt) + 1):
+                if vt and lower[i:i + len(vt)] == vt and not any(taken[i:i + len(vt)]):
+                    spans[i] = (len(vt), value)
+                    taken[i:i + len(vt)] = [True] * len(vt)
+                    break
+        # Slots are numbered in the order they appear in the task
+        words: List[str] = []
+        slots: Dict[str, str] = {}
+        i = 0
+        while i < len(lower):
+            if i in spans:
+                length, value = spans[i]
+                slots[f"s{len(slots) + 1}"] = value
+                words.append(f"{{s{len(slots)}}}")
+                i += length
+            else:
+                words.append(lower[i])
+                i += 1
+        pattern_text = " ".join(words)
+        if not any(not SLOT.fullmatch(p) for p in pattern_text.split()):
+            return None
+        by_value = {v: k for k, v in slots.items()}
+        generic = json.loads(json.dumps(steps))
+        for s in generic:
+            sel = s.get("selector") or {}
+            for f in SLOT_FIELDS:
+                if sel.get(f) in by_value:
+                    sel[f] = f"{{{by_value[sel[f]]}}}"
+            if s.get("action") == "type" and s.get("input") in by_value:
+                s["input"] = f"{{{by_value[s['input']]}}}"
+        learned = self.learned(app)
+        if any(t["pattern"] == pattern_text for t in learned):
+            return None
+        template = {"pattern": pattern_text, "steps": generic, "learned_from": task, "created_at": time.time()}
+        self._save_learned(app, learned + [template])
+        self.stats["promoted"] += 1
+        logger.info(f"Promoted plan to a {app} template: {pattern_text!r}")
+        return template
+
+    def demote(self, app: str, patterns: List[str]):
+        """Drop learned templates behind a plan that failed; hand-written ones stay."""
+        learned = self.learned(app)
+        kept = [t for t in learned if t["pattern"] not in patterns]
+        if len(kept) != len(learned):
+            self._save_learned(app, kept)
+            self.stats["demoted"] += len(learned) - len(kept)
+            logger.info(f"Removed {len(learned) - len(kept)} learned {app} templates after a failed run")
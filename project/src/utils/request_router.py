@@ -0,0 +1,217 @@
+import asyncio
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from loguru import logger
+from playwright.async_api import BrowserContext, Route, Request
+
+from src.config.app_configs import AppConfig
+
+# Third-party analytics/telemetry that never affects what the UI renders
+DEFAULT_BLOCKLIST = [
+    "*google-analytics.com/*", "*googletagmanager.com/*", "*doubleclick.net/*", "*facebook.net/*",
+    "*segment.io/*", "*segment.com/v1/*", "*api.amplitude.com/*", "*hotjar.com/*", "*fullstory.com/*",
+    "*sentry.io/*", "*browser-intake-datadoghq.com/*", "*clarity.ms/*", "*mixpanel.com/*",
+]
+CACHEABLE_TYPES = ("script", "stylesheet", "font", "image")
+# Response headers that no longer describe the (decoded) body we replay
+DROP_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "set-cookie", "date", "age"}
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+def cache_ttl(headers: Dict[str, str]) -> Optional[float]:
+    """Seconds a response may be reused, per Cache-Control; None when it must not be cached."""
+    cc = headers.get("cache-control", "").lower()
+    if not cc or any(d in cc for d in ("no-store", "no-cache", "private")):
+        return None
+    vary = {v.strip().lower() for v in headers.get("vary", "").split(",") if v.strip()}
+    if vary - {"accept-encoding", "origin"}:
+        return None
+    m = _MAX_AGE.search(cc)
+    if "immutable" in cc:
+        return float(m.group(1)) if m else 365 * 86400.0
+    if m and int(m.group(1)) > 0:
+        return float(m.group(1))
+    return None
+
+
+class HttpCache:
+    """On-disk cache of static responses: <root>/<aa>/<sha256>.body + .json (status, headers, expires).
+
+    Entries live at most max_age_s whatever their Cache-Control says. Once the bodies pass max_bytes, expired entries
+    and then the least recently stored ones are deleted until the cache is back under 90% of the cap.
+    """
+
+    def __init__(self, root: str, max_bytes: Optional[int] = None, max_age_s: Optional[float] = None):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self._meta: Dict[str, Dict[str, Any]] = {}
+        # Body bytes on disk; None until the first put scans the directory
+        self._bytes: Optional[int] = None
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    @classmethod
+    def from_env(cls) -> "HttpCache":
+        max_mb = float(os.getenv("HTTP_CACHE_MAX_MB", "500"))
+        max_age = float(os.getenv("HTTP_CACHE_MAX_AGE_S", str(7 * 86400)))
+        return cls(os.getenv("HTTP_CACHE_DIR", ".http_cache"), max_bytes=int(max_mb * 1e6) if max_mb > 0 else None,
+                   max_age_s=max_age if max_age > 0 else None)
+
+    def _paths(self, url: str):
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base = self.root / digest[:2] / digest
+        return base.with_suffix(".json"), base.with_suffix(".body")
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        meta_path, body_path = self._paths(url)
+        meta = self._meta.get(url)
+        if meta is None:
+            try:
+                meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                return None
+            self._meta[url] = meta
+        if meta["expires"] < time.time():
+            self._remove(meta_path, body_path)
+            self._meta.pop(url, None)
+            return None
+        try:
+            return {**meta, "body": body_path.read_bytes()}
+        except OSError:
+            self._meta.pop(url, None)
+            return None
+
+    def put(self, url: str, status: int, headers: Dict[str, str], body: bytes, ttl: float):
+        if self.max_age_s:
+            ttl = min(ttl, self.max_age_s)
+        meta_path, body_path = self._paths(url)
+        meta_path.parent.mkdir(parents=True, exist_ok=True)
+        meta = {"url": url, "status": status, "expires": time.time() + ttl,
+                "headers": {k: v for k, v in headers.items() if k.lower() not in DROP_HEADERS}}
+        # Body first, then metadata: a reader never sees metadata pointing at a partial body
+        tmp = body_path.with_name(f".{body_path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(body)
+        os.replace(tmp, body_path)
+        tmp = meta_path.with_name(f".{meta_path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(tmp, meta_path)
+        self._meta[url] = meta
+        if self.max_bytes:
+            with self._lock:
+                if self._bytes is None:
+                    self._bytes = sum(p.stat().st_size for p in self.root.glob("*/*.body"))
+                else:
+                    self._bytes += len(body)
+                if self._bytes > self.max_bytes:
+                    self._prune()
+
+    def _remove(self, meta_path: Path, body_path: Path) -> int:
+        freed = 0
+        for path in (meta_path, body_path):
+            try:
+                if path == body_path:
+                    freed = path.stat().st_size
+                path.unlink()
+            except OSError:
+                pass
+        return freed
+
+    def _prune(self):
+        now = time.time()
+        entries = []
+        for body_path in self.root.glob("*/*.body"):
+            meta_path = body_path.with_suffix(".json")
+            try:
+                st = body_path.stat()
+                expires = json.loads(meta_path.read_text(encoding="utf-8"))["expires"]
+            except (OSError, ValueError, KeyError):
+                expires = 0
+                st = None
+            entries.append((expires >= now, st.st_mtime if st else 0, meta_path, body_path))
+        # Expired (or unreadable) first, then oldest stored first
+        entries.sort(key=lambda e: (e[0], e[1]))
+        target = int(self.max_bytes * 0.9)
+        for _, _, meta_path, body_path in entries:
+            if self._bytes <= target:
+                break
+            self._bytes -= self._remove(meta_path, body_path)
+            self.evicted += 1
+        # Lookups re-read metadata from disk, so evicted URLs simply miss
+        self._meta.clear()
+        logger.debug(f"HTTP cache pruned to {self._bytes / 1e6:.1f} MB ({self.evicted} entries evicted so far)")
+
+
+class RequestRouter:
+    """context.route layer: aborts tracker requests and serves cacheable static assets from HttpCache.
+
+    Routing disables Chromium's own HTTP cache for the context, so the disk cache is what keeps repeat loads cheap.
+    """
+
+    def __init__(self, block_patterns: Optional[List[str]] = None, block_resource_types: Optional[List[str]] = None,
+                 cache: Optional[HttpCache] = None):
+        self.block_patterns = list(block_patterns or [])
+        self.block_resource_types = set(block_resource_types or [])
+        self.cache = cache
+        self.stats = {"requests": 0, "blocked": 0, "cache_hits": 0, "cache_stores": 0, "bytes_saved": 0}
+
+    @classmethod
+    def from_env(cls, cfg: Optional[AppConfig] = None) -> Optional["RequestRouter"]:
+        if os.getenv("REQUEST_ROUTER", "on").lower() == "off":
+            return None
+        patterns = DEFAULT_BLOCKLIST + (cfg.block_patterns if cfg else [])
+        use_cache = os.getenv("HTTP_CACHE", "on").lower() != "off" and (cfg.cache_static if cfg else True)
+        cache = HttpCache.from_env() if use_cache else None
+        return cls(patterns, cfg.block_resource_types if cfg else None, cache)
+
+    async def install(self, context: BrowserContext):
+        await context.route("**/*", self._handle)
+
+    def blocked(self, url: str, resource_type: str) -> bool:
+        if resource_type in self.block_resource_types:
+            return True
+        return any(fnmatch.fnmatchcase(url, p) for p in self.block_patterns)
+
+    async def _handle(self, route: Route, request: Request):
+        self.stats["requests"] += 1
+        url, rtype = request.url, request.resource_type
+        try:
+            if self.blocked(url, rtype):
+                self.stats["blocked"] += 1
+                await route.abort("blockedbyclient")
+                return
+            if self.cache is None or request.method != "GET" or rtype not in CACHEABLE_TYPES:
+                await route.continue_()
+                return
+            hit = await asyncio.to_thread(self.cache.get, url)
+            if hit:
+                self.stats["cache_hits"] += 1
+                self.stats["bytes_saved"] += len(hit["body"])
+                await route.fulfill(status=hit["status"], headers=hit["headers"], body=hit["body"])
+                return
+            response = await route.fetch()
+            body = await response.body()
+            ttl = cache_ttl(response.headers) if response.status == 200 else None
+            if ttl:
+                await asyncio.to_thread(self.cache.put, url, response.status, response.headers, body, ttl)
+                self.stats["cache_stores"] += 1
+            headers = {k: v for k, v in response.headers.items() if k.lower() not in ("content-encoding", "content-length", "transfer-encoding")}
+            await route.fulfill(status=response.status, headers=headers, body=body)
+        except Exception as e:
+            logger.debug(f"Request router: {url} | {e}")
+            # An unhandled route hangs the request; hand it back to the browser (a no-op error if already handled)
+            try:
+                await route.continue_()
+            except Exception:
+                try:
+                    await route.abort()
+                except Exception:
+                    # Page closed mid-request, or the route was already handled
+                    pass
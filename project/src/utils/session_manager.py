@@ -0,0 +1,137 @@
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+from loguru import logger
+from playwright.async_api import BrowserContext, Page
+
+from src.config.app_configs import AppConfig
+from src.config.credentials import Credentials
+
+
+class SessionManager:
+    """Per-app Playwright storage state in .sessions/<app>.json, probed before use and refreshed only on failure.
+
+    One state file can seed any number of contexts at once; a per-app lock keeps concurrent callers from
+    logging in twice, and a successful probe is trusted for SESSION_PROBE_TTL_S.
+    """
+
+    def __init__(self, root: Optional[str] = None, probe_ttl_s: Optional[float] = None):
+        self.root = Path(root or os.getenv("SESSION_DIR", ".sessions"))
+        self.probe_ttl_s = float(os.getenv("SESSION_PROBE_TTL_S", "300")) if probe_ttl_s is None else probe_ttl_s
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._states: Dict[str, Dict[str, Any]] = {}
+        self._valid_until: Dict[str, float] = {}
+
+    def path_for(self, app: str) -> Path:
+        return self.root / f"{app}.json"
+
+    def state(self, app: str) -> Optional[Dict[str, Any]]:
+        """Saved storage state for new_context(storage_state=...), or None."""
+        if app not in self._states:
+            try:
+                self._states[app] = json.loads(self.path_for(app).read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                return None
+        return self._states[app]
+
+    async def save(self, context: BrowserContext, app: str):
+        state = await context.storage_state()
+        path = self.path_for(app)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(state), encoding="utf-8")
+        os.replace(tmp, path)
+        self._states[app] = state
+        logger.info(f"Saved {app} session to {path}")
+
+    @staticmethod
+    def _on_login_page(url: str, cfg: AppConfig) -> bool:
+        return bool(cfg.login_url) and urlparse(url).path.startswith(urlparse(cfg.login_url).path)
+
+    async def probe(self, context: BrowserContext, cfg: AppConfig) -> bool:
+        """One HTTP request with the context's cookies; no page load."""
+        if not cfg.login_url:
+            return True
+        if not cfg.session_probe_url:
+            # A public page answers 200 logged in or not, so without an authenticated endpoint there is nothing to probe
+            logger.info(f"No session_probe_url for {cfg.name}; cannot validate the saved session, logging in")
+            return False
+        url = cfg.session_probe_url
+        try:
+            if cfg.session_probe_method.upper() == "POST":
+                resp = await context.request.post(url, data={}, timeout=10000)
+            else:
+                resp = await context.request.get(url, timeout=10000)
+            ok = resp.ok and not self._on_login_page(resp.url, cfg)
+            await resp.dispose()
+        except Exception as e:
+            logger.warning(f"Session probe for {cfg.name} failed: {e}")
+            return False
+        logger.info(f"Session probe {cfg.name}: {'valid' if ok else 'not logged in'}")
+        return ok
+
+    async def _logged_in(self, page: Page, context: BrowserContext, cfg: AppConfig) -> bool:
+        if cfg.session_probe_url:
+            return await self.probe(context, cfg)
+        # Nothing to probe: having left the login page is the only signal
+        return not self._on_login_page(page.url, cfg)
+
+    async def ensure(self, context: BrowserContext, cfg: AppConfig, manual: bool = False, interactive: bool = False,
+                     page: Optional[Page] = None) -> bool:
+        """Make context logged in to cfg's app, logging in (and saving the new state) only if the probe fails."""
+        lock = self._locks.setdefault(cfg.name, asyncio.Lock())
+        async with lock:
+            saved = self.state(cfg.name)
+            if saved and saved.get("cookies"):
+                await context.add_cookies(saved["cookies"])
+            if self._valid_until.get(cfg.name, 0) > time.monotonic():
+                return True
+            if await self.probe(context, cfg):
+                self._valid_until[cfg.name] = time.monotonic() + self.probe_ttl_s
+                if not saved:
+                    await self.save(context, cfg.name)
+                return True
+            page = page or await context.new_page()
+            if not await self.login(page, context, cfg, manual=manual, interactive=interactive):
+                return False
+            await self.save(context, cfg.name)
+            self._valid_until[cfg.name] = time.monotonic() + self.probe_ttl_s
+            return True
+
+    async def login(self, page: Page, context: BrowserContext, cfg: AppConfig, manual: bool = False, interactive: bool = False) -> bool:
+        creds = Credentials.load_for(cfg.name)
+        email = creds.email or os.getenv("EMAIL") or None
+        password = creds.password or os.getenv("PASSWORD") or None
+        await page.goto(cfg.login_url)
+        if not cfg.session_probe_url and not self._on_login_page(page.url, cfg):
+            # The login page sent us on: the saved cookies are still good
+            return True
+        if email and password and not manual:
+            logger.info(f"Logging in to {cfg.name} with password credentials")
+            try:
+                # Best-effort: try to find email/password fields by role/placeholder, but do not hardcode selectors
+                await page.get_by_role("textbox").first.fill(email)
+                await page.get_by_role("textbox").nth(1).fill(password)
+                await page.get_by_role("button", name="Log in").first.click()
+                await page.wait_for_load_state("networkidle")
+            except Exception as e:
+                logger.warning(f"Login helper encountered an issue: {e}")
+            if await self._logged_in(page, context, cfg):
+                return True
+        if not (manual or interactive):
+            logger.warning(f"Not logged in to {cfg.name} and no way to log in headless; continuing logged out")
+            return False
+        # Poll instead of sleeping a fixed minute: returns as soon as the user has finished logging in
+        wait_s = 90 if manual else 60
+        logger.info(f"Please complete the {cfg.name} login in the opened browser window (up to {wait_s}s)")
+        deadline = time.monotonic() + wait_s
+        while time.monotonic() < deadline:
+            await asyncio.sleep(2)
+            if await self._logged_in(page, context, cfg):
+                return True
+        logger.warning(f"Still not logged in to {cfg.name} after {wait_s}s; continuing")
+        return False
@@ -0,0 +1,114 @@
+import contextlib
+import json
+import os
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+TRACE_NAME = "trace.json"
+
+_current: ContextVar[Optional["Tracer"]] = ContextVar("tracer", default=None)
+_NOOP = contextlib.nullcontext()
+
+
+def enabled() -> bool:
+    return os.getenv("TRACE", "off").lower() in ("on", "1", "true")
+
+
+def current() -> Optional["Tracer"]:
+    return _current.get()
+
+
+def activate(tracer: Optional["Tracer"]):
+    """Make tracer the one span() reports to in this task (and the tasks it spawns); returns a reset token."""
+    return _current.set(tracer)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+def span(name: str, **args: Any):
+    """with span("click"): ... -- a shared no-op context when tracing is off."""
+    tracer = _current.get()
+    if tracer is None:
+        return _NOOP
+    return tracer.span(name, **args)
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+class Tracer:
+    """Collects complete ("X") trace events for one workflow; export() writes Chrome trace-event JSON."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.events: List[Dict[str, Any]] = []
+        self._t0 = time.perf_counter()
+        self._wall0 = time.time()
+
+    @classmethod
+    def from_env(cls, name: str) -> Optional["Tracer"]:
+        return cls(name) if enabled() else None
+
+    @contextlib.contextmanager
+    def span(self, name: str, **args: Any):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.events.append({"name": name, "ts": (start - self._t0) * 1e6, "dur": (end - start) * 1e6, "args": args})
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Per span name: count, total_ms, max_ms (what gets embedded in metadata.json)."""
+        out: Dict[str, Dict[str, float]] = {}
+        for ev in self.events:
+            s = out.setdefault(ev["name"], {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            ms = ev["dur"] / 1000
+            s["count"] += 1
+            s["total_ms"] += ms
+            s["max_ms"] = max(s["max_ms"], ms)
+        return {k: {**v, "total_ms": round(v["total_ms"], 1), "max_ms": round(v["max_ms"], 1)} for k, v in out.items()}
+
+    def export(self, path: Path) -> Path:
+        # Spans are appended on exit; Chrome's viewer nests "X" events by ts/dur regardless of order
+        trace = {
+            "traceEvents": [
+                {"name": ev["name"], "cat": "workflow", "ph": "X", "ts": round(ev["ts"], 1), "dur": round(ev["dur"], 1),
+                 "pid": os.getpid(), "tid": 1, "args": ev["args"]}
+                for ev in sorted(self.events, key=lambda e: e["ts"])
+            ],
+            "displayTimeUnit": "ms",
+            "otherData": {"workflow": self.name, "started_at": self._wall0},
+        }
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(trace), encoding="utf-8")
+        return path
+
+
+def report(out_root: str) -> Dict[str, Dict[str, float]]:
+    """p50/p95 duration per span name across every trace.json under the dataset."""
+    durations: Dict[str, List[float]] = {}
+    for path in Path(out_root).glob(f"*/*/{TRACE_NAME}"):
+        try:
+            events = json.loads(path.read_text(encoding="utf-8")).get("traceEvents", [])
+        except (OSError, ValueError):
+            continue
+        for ev in events:
+            durations.setdefault(ev["name"], []).append(ev["dur"] / 1000)
+    return {
+        name: {"count": len(v), "p50_ms": round(percentile(v, 50), 1), "p95_ms": round(percentile(v, 95), 1),
+               "total_ms": round(sum(v), 1)}
+        for name, v in sorted(durations.items(), key=lambda kv: -sum(kv[1]))
+    }